@@ -0,0 +1,100 @@
+"""
+Use any (synchronous) :class:`~sanskrit_data.db.interfaces.DbInterface` from asyncio code, via :class:`ThreadPoolAsyncDb`.
+
+Example::
+
+  async_db = ThreadPoolAsyncDb(db_interface=db_interface, max_workers=8)
+  book = await books.BookPortion.from_id_async(id=book_id, db_interface=async_db)
+  async for doc in async_db.find(find_filter={"jsonClass": "BookPortion"}):
+    ...
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from sanskrit_data.db.interfaces import AsyncDbInterface
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def _next_batch(iterator, batch_size):
+  batch = []
+  for doc in iterator:
+    batch.append(doc)
+    if len(batch) >= batch_size:
+      break
+  return batch
+
+
+class ThreadPoolAsyncDb(AsyncDbInterface):
+  """Runs the calls to a synchronous DbInterface on a bounded thread pool, so that they don't block the event loop.
+
+  The wrapped interface must be usable from multiple threads (as are InMemoryDb, SqliteDb and CachingDbInterface).
+  """
+
+  def __init__(self, db_interface, max_workers=8, find_batch_size=100):
+    """
+
+    :param DbInterface db_interface: The database interface being wrapped.
+    :param max_workers: Maximum number of concurrently running calls to db_interface.
+    :param find_batch_size: Number of results of a find call fetched in each call to the pool.
+    """
+    super(ThreadPoolAsyncDb, self).__init__(db_name_frontend=db_interface.db_name_frontend, external_file_store=db_interface.external_file_store)
+    self.db_interface = db_interface
+    self.find_batch_size = find_batch_size
+    self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ThreadPoolAsyncDb")
+
+  def close(self):
+    """Shut down the thread pool (but not the wrapped interface)."""
+    self.executor.shutdown(wait=True)
+
+  async def _run(self, fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+  async def run_with_sync_interface(self, fn):
+    return await self._run(fn, self.db_interface)
+
+  async def update_doc(self, doc):
+    return await self._run(self.db_interface.update_doc, doc)
+
+  async def delete_doc(self, doc_id):
+    return await self._run(self.db_interface.delete_doc, doc_id)
+
+  async def update_docs(self, docs):
+    return await self._run(self.db_interface.update_docs, docs)
+
+  async def delete_docs(self, doc_ids):
+    return await self._run(self.db_interface.delete_docs, doc_ids)
+
+  # noinspection PyShadowingBuiltins
+  async def find_by_id(self, id):
+    return await self._run(self.db_interface.find_by_id, id)
+
+  async def find_by_ids(self, ids):
+    return await self._run(self.db_interface.find_by_ids, ids)
+
+  async def find(self, find_filter):
+    """Yield the results of db_interface.find, fetched from the pool find_batch_size at a time."""
+    iterator = await self._run(lambda: iter(self.db_interface.find(find_filter)))
+    try:
+      while True:
+        batch = await self._run(_next_batch, iterator, self.find_batch_size)
+        for doc in batch:
+          yield doc
+        if len(batch) < self.find_batch_size:
+          break
+    finally:
+      # Release any resources (eg. database cursors) held by an unfinished generator.
+      close = getattr(iterator, "close", None)
+      if close is not None:
+        await self._run(close)
+
+  async def update_index(self, name, fields, upsert=False):
+    return await self._run(self.db_interface.update_index, name, fields, upsert=upsert)
+
+  async def add_index(self, keys_dict, index_name):
+    return await self._run(self.db_interface.add_index, keys_dict, index_name)
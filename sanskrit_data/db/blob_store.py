@@ -0,0 +1,232 @@
+"""
+A content-addressed layout for :py:attr:`~sanskrit_data.db.interfaces.DbInterface.external_file_store` - optional, in place of the default directory per object _id (see :meth:`~sanskrit_data.schema.common.JsonObject.get_external_storage_path`).
+
+An external file store with a _blobs directory (see :meth:`BlobStore.create`) holds:
+
+- _blobs/<first 2 hex digits>/<sha256 hex digest>: File contents, stored once however many objects (eg. pages of several books scanned from the same images) have them.
+- _manifests/<object _id>.json: Per-object manifests like {"files": {<file name>: {"hash": <sha256 hex digest>, "size": <bytes>}}} - listed instead of globbing object directories.
+
+Blobs are never modified - files are exported as hardlinks to them (see :meth:`BlobStore.link_file`), and are made read only. Blobs no manifest refers to are reclaimed by :meth:`BlobStore.gc`.
+"""
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+from sanskrit_data.file_helper import fsync_dir
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+BLOBS_DIR = "_blobs"
+MANIFESTS_DIR = "_manifests"
+_COPY_CHUNK_SIZE = 1 << 20
+
+
+class BlobStore(object):
+  def __init__(self, root_dir):
+    self.root_dir = root_dir
+    self.blobs_dir = os.path.join(root_dir, BLOBS_DIR)
+    self.manifests_dir = os.path.join(root_dir, MANIFESTS_DIR)
+    # Serializes read-modify-write cycles of manifests within this process.
+    self.manifest_lock = threading.Lock()
+
+  @classmethod
+  def create(cls, root_dir):
+    """Switch the external file store at root_dir to the content-addressed layout (if not already done) - see :meth:`migrate_object_dirs` for existing files."""
+    os.makedirs(os.path.join(root_dir, BLOBS_DIR), exist_ok=True)
+    os.makedirs(os.path.join(root_dir, MANIFESTS_DIR), exist_ok=True)
+    return cls(root_dir=root_dir)
+
+  @classmethod
+  def get_if_present(cls, root_dir):
+    """:return: A BlobStore if root_dir has the content-addressed layout, else None."""
+    if root_dir is not None and os.path.isdir(os.path.join(root_dir, BLOBS_DIR)):
+      return cls(root_dir=root_dir)
+    return None
+
+  def get_blob_path(self, content_hash):
+    return os.path.join(self.blobs_dir, content_hash[:2], content_hash)
+
+  def _get_manifest_path(self, obj_id):
+    return os.path.join(self.manifests_dir, obj_id + ".json")
+
+  def get_manifest(self, obj_id):
+    """:return: A map from file names to {"hash": ..., "size": ...} for the object with obj_id (empty if it has no files)."""
+    try:
+      with open(self._get_manifest_path(obj_id), encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)["files"]
+    except FileNotFoundError:
+      return {}
+
+  def _write_manifest(self, obj_id, files):
+    manifest_path = self._get_manifest_path(obj_id)
+    if not files:
+      if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+      return
+    os.makedirs(self.manifests_dir, exist_ok=True)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+      json.dump({"files": files}, manifest_file, ensure_ascii=False, sort_keys=True)
+      manifest_file.flush()
+      os.fsync(manifest_file.fileno())
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+  def add_blob(self, source_path):
+    """Store the contents of the file at source_path (unless stored already).
+
+    :return: (sha256 hex digest, size)
+    """
+    digest = hashlib.sha256()
+    num_bytes = 0
+    os.makedirs(self.blobs_dir, exist_ok=True)
+    temp_path = os.path.join(self.blobs_dir, "tmp_%d_%d" % (os.getpid(), threading.get_ident()))
+    # Hashed while copying, so that the source is read once.
+    with open(source_path, "rb") as source_file, open(temp_path, "wb") as temp_file:
+      for chunk in iter(lambda: source_file.read(_COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        temp_file.write(chunk)
+        num_bytes += len(chunk)
+      temp_file.flush()
+      os.fsync(temp_file.fileno())
+    content_hash = digest.hexdigest()
+    blob_path = self.get_blob_path(content_hash)
+    if os.path.exists(blob_path):
+      os.remove(temp_path)
+      # A recent modification time keeps a concurrent gc from reclaiming the blob.
+      os.utime(blob_path)
+    else:
+      os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+      os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+      os.replace(temp_path, blob_path)
+      fsync_dir(os.path.dirname(blob_path))
+    return content_hash, num_bytes
+
+  def add_file(self, obj_id, source_path, file_name=None):
+    """Associate a file with the contents of the file at source_path with the object with obj_id.
+
+    :param file_name: Defaults to the base name of source_path. Replaces any file of the object with the same name.
+    :return: The sha256 hex digest of the contents.
+    """
+    content_hash, num_bytes = self.add_blob(source_path=source_path)
+    with self.manifest_lock:
+      files = self.get_manifest(obj_id)
+      files[file_name or os.path.basename(source_path)] = {"hash": content_hash, "size": num_bytes}
+      self._write_manifest(obj_id, files)
+    return content_hash
+
+  def remove_files(self, obj_id, file_names=None):
+    """Disassociate files (all, by default) from the object with obj_id. Their blobs remain until :meth:`gc`."""
+    with self.manifest_lock:
+      files = self.get_manifest(obj_id)
+      for file_name in (list(files) if file_names is None else file_names):
+        files.pop(file_name, None)
+      self._write_manifest(obj_id, files)
+
+  def list_files(self, obj_id, suffix_pattern="*"):
+    """:return: Sorted names of the files of the object with obj_id which match the (glob) suffix_pattern."""
+    return sorted(file_name for file_name in self.get_manifest(obj_id) if fnmatch.fnmatch(file_name, suffix_pattern))
+
+  def get_file_path(self, obj_id, file_name):
+    """:return: The path of the blob with the contents of the file (not to be modified), or None if there is no such file."""
+    entry = self.get_manifest(obj_id).get(file_name, None)
+    return None if entry is None else self.get_blob_path(entry["hash"])
+
+  def link_file(self, obj_id, file_name, dest_path):
+    """Place the file at dest_path - as a hardlink to its blob, or as a copy where hardlinks are not possible (eg. across file systems).
+
+    :return: Whether a hardlink was made.
+    """
+    blob_path = self.get_file_path(obj_id=obj_id, file_name=file_name)
+    if blob_path is None:
+      raise FileNotFoundError("%s has no file %s" % (obj_id, file_name))
+    return link_or_copy(source_path=blob_path, dest_path=dest_path)
+
+  def migrate_object_dirs(self):
+    """Move files from directories per object _id (the default layout) into blobs and manifests.
+
+    :return: The number of files moved.
+    """
+    num_files = 0
+    for dir_entry in os.scandir(self.root_dir):
+      if not dir_entry.is_dir() or dir_entry.name in (BLOBS_DIR, MANIFESTS_DIR):
+        continue
+      for file_entry in os.scandir(dir_entry.path):
+        if file_entry.is_file():
+          self.add_file(obj_id=dir_entry.name, source_path=file_entry.path)
+          os.remove(file_entry.path)
+          num_files += 1
+      if not os.listdir(dir_entry.path):
+        os.rmdir(dir_entry.path)
+    return num_files
+
+  def gc(self, db_interface=None, min_age_seconds=60):
+    """Reclaim blobs no manifest refers to.
+
+    Blobs modified in the last min_age_seconds (eg. by an :meth:`add_file` whose manifest is yet to be written) are spared.
+
+    :param db_interface: If given, manifests of objects no longer in this database are removed first.
+    :return: (number of blobs removed, bytes reclaimed)
+    """
+    start_time = time.time()
+    manifest_ids = [file_name[:-len(".json")] for file_name in os.listdir(self.manifests_dir) if file_name.endswith(".json")] if os.path.isdir(self.manifests_dir) else []
+    if db_interface is not None:
+      for obj_id, doc in zip(manifest_ids, db_interface.find_by_ids(ids=manifest_ids)):
+        if doc is None:
+          logging.info("Removing the manifest of deleted object %s", obj_id)
+          self.remove_files(obj_id=obj_id)
+    referenced_hashes = set()
+    for obj_id in manifest_ids:
+      referenced_hashes.update(entry["hash"] for entry in self.get_manifest(obj_id).values())
+
+    num_blobs = 0
+    num_bytes = 0
+    if not os.path.isdir(self.blobs_dir):
+      return num_blobs, num_bytes
+    for prefix_entry in os.scandir(self.blobs_dir):
+      if not prefix_entry.is_dir():
+        # Temporary files of interrupted add_blob calls.
+        if prefix_entry.stat().st_mtime < start_time - min_age_seconds:
+          os.remove(prefix_entry.path)
+        continue
+      for blob_entry in os.scandir(prefix_entry.path):
+        if blob_entry.name in referenced_hashes:
+          continue
+        blob_stat = blob_entry.stat()
+        if blob_stat.st_mtime >= start_time - min_age_seconds:
+          continue
+        os.remove(blob_entry.path)
+        num_blobs += 1
+        num_bytes += blob_stat.st_size
+    logging.info("Reclaimed %d blobs (%d bytes) in %s", num_blobs, num_bytes, self.blobs_dir)
+    return num_blobs, num_bytes
+
+
+def link_or_copy(source_path, dest_path):
+  """Replace dest_path with a hardlink to source_path - or a copy, where hardlinks are not possible.
+
+  :return: Whether a hardlink was made.
+  """
+  if os.path.exists(dest_path) and os.path.samefile(source_path, dest_path):
+    # Renaming a hardlink over another link to the same file would do nothing.
+    return True
+  os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+  temp_path = dest_path + ".tmp"
+  if os.path.lexists(temp_path):
+    os.remove(temp_path)
+  try:
+    os.link(source_path, temp_path)
+    linked = True
+  except OSError:
+    # shutil.copyfile uses in-kernel copies where available.
+    shutil.copyfile(source_path, temp_path)
+    linked = False
+  os.replace(temp_path, dest_path)
+  return linked
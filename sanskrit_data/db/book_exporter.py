@@ -0,0 +1,255 @@
+"""
+Exporting books (see :meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.dump_books`) with :class:`BookExporter`.
+
+The layout is that of :meth:`~sanskrit_data.schema.books.BookPortion.dump_book_portion`: a book's tree of BookPortions goes to <export_dir>/<book _id>/book.json, and the files of each page to <export_dir>/<page _id>/.
+Books are exported concurrently, and page files are copied on a thread pool while book trees are being fetched and serialized.
+
+With a content-addressed external file store (see :py:mod:`~sanskrit_data.db.blob_store`), page files are exported as hardlinks to blobs rather than copies.
+
+Incremental exports keep a :class:`~sanskrit_data.db.import_manifest.FileManifest` of exported files (export_manifest.jsonl in the export directory), with their content hashes. A file is skipped if the exported copy is intact and the content is unchanged - page files whose size and modification time are unchanged are not even read.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sanskrit_data import json_stream_helper
+from sanskrit_data.db import blob_store, import_manifest
+from sanskrit_data.schema import common
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+MANIFEST_FILE_NAME = "export_manifest.jsonl"
+_COPY_CHUNK_SIZE = 1 << 20
+
+
+class ExportStats(object):
+  """What :class:`BookExporter` did - overall, or for a single book."""
+
+  def __init__(self):
+    self.num_books = 0
+    self.num_files_copied = 0
+    self.num_files_linked = 0
+    self.num_files_skipped = 0
+    self.bytes_copied = 0
+    self.bytes_linked = 0
+    self.bytes_skipped = 0
+    self.seconds = 0.0
+    #: Maps the _id-s of books which could not be exported to error messages.
+    self.failures = {}
+    #: Maps book _id-s to their own ExportStats.
+    self.books = {}
+
+  def add_file(self, copied, num_bytes, linked=False):
+    if linked:
+      self.num_files_linked += 1
+      self.bytes_linked += num_bytes
+    elif copied:
+      self.num_files_copied += 1
+      self.bytes_copied += num_bytes
+    else:
+      self.num_files_skipped += 1
+      self.bytes_skipped += num_bytes
+
+  def add_book(self, book_id, book_stats):
+    self.books[book_id] = book_stats
+    self.num_books += 1
+    self.num_files_copied += book_stats.num_files_copied
+    self.num_files_linked += book_stats.num_files_linked
+    self.num_files_skipped += book_stats.num_files_skipped
+    self.bytes_copied += book_stats.bytes_copied
+    self.bytes_linked += book_stats.bytes_linked
+    self.bytes_skipped += book_stats.bytes_skipped
+
+  def __repr__(self):
+    return "%d books, %d failures; %d files (%d bytes) written, %d files (%d bytes) linked, %d files (%d bytes) unchanged; %.2f s" % (
+      self.num_books, len(self.failures), self.num_files_copied, self.bytes_copied, self.num_files_linked, self.bytes_linked, self.num_files_skipped, self.bytes_skipped, self.seconds)
+
+
+class BookExporter(object):
+  def __init__(self, db_interface, export_dir, num_workers=4, incremental=False, dump_annotations=False):
+    """
+
+    :param BookPortionsInterface db_interface:
+    :param num_workers: The number of books exported concurrently, and (separately) the number of files copied concurrently.
+    :param incremental: Whether to skip files unchanged since the last (incremental) export to export_dir.
+    :param dump_annotations: Whether to also write annotations.jsonl files (see :meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.dump_annotations`).
+    """
+    self.db_interface = db_interface
+    self.export_dir = export_dir
+    self.num_workers = num_workers
+    self.incremental = incremental
+    self.dump_annotations = dump_annotations
+    self.manifest = None
+    self.manifest_lock = threading.Lock()
+
+  def export(self, books):
+    """Export books (BookPortion objects).
+
+    :return: An :class:`ExportStats` object.
+    """
+    start_time = time.perf_counter()
+    stats = ExportStats()
+    os.makedirs(self.export_dir, exist_ok=True)
+    if self.incremental:
+      self.manifest = import_manifest.FileManifest(manifest_path=os.path.join(self.export_dir, MANIFEST_FILE_NAME), sync=False)
+    try:
+      with ThreadPoolExecutor(max_workers=self.num_workers) as book_executor, ThreadPoolExecutor(max_workers=self.num_workers) as copy_executor:
+        book_futures = [(book, book_executor.submit(self._export_book, book, copy_executor)) for book in books]
+        for book, book_future in book_futures:
+          try:
+            stats.add_book(book_id=book._id, book_stats=book_future.result())
+          except Exception as e:
+            logging.error("Could not export %s: %s", book._id, e)
+            stats.failures[book._id] = "%s: %s" % (e.__class__.__name__, e)
+    finally:
+      if self.manifest is not None:
+        self.manifest.sync()
+        self.manifest.compact()
+        self.manifest.close()
+        self.manifest = None
+    stats.seconds = time.perf_counter() - start_time
+    logging.info("Exported to %s: %s", self.export_dir, stats)
+    return stats
+
+  def _get_entry(self, relative_path):
+    if self.manifest is None:
+      return None
+    with self.manifest_lock:
+      return self.manifest.get(relative_path)
+
+  def _put_entry(self, relative_path, entry):
+    if self.manifest is not None:
+      with self.manifest_lock:
+        self.manifest.put(path=relative_path, entry=entry)
+
+  def _is_intact(self, relative_path, entry):
+    """Is the exported file as recorded in entry (going by its size)?"""
+    path = os.path.join(self.export_dir, relative_path)
+    return entry is not None and os.path.exists(path) and os.path.getsize(path) == entry["size"]
+
+  def _export_book(self, book, copy_executor):
+    """:return: ExportStats of the book."""
+    start_time = time.perf_counter()
+    book_stats = ExportStats()
+    book_node = common.JsonObjectNode.from_details(content=book)
+    book_node.fill_descendents(db_interface=self.db_interface, entity_type="BookPortion")
+    pages = []
+    nodes = [book_node]
+    while nodes:
+      node = nodes.pop()
+      nodes.extend(node.children)
+      if getattr(node.content, "portion_class", None) == "page":
+        pages.append(node.content)
+    copy_futures = []
+    if self.db_interface.external_file_store is not None:
+      page_file_names = common.JsonObject.list_files_many(objects=pages, db_interface=self.db_interface)
+      for page in pages:
+        for source_path, file_name in self._get_page_files(page=page, file_names=page_file_names[page._id]):
+          copy_futures.append(copy_executor.submit(self._copy_file, source_path, os.path.join(page._id, file_name)))
+
+    # Serialized while page files are being copied.
+    book_map = book_node.to_json_map()
+    nodes = [book_map]
+    while nodes:
+      node_map = nodes.pop()
+      node_map["content"].pop("path", None)
+      nodes.extend(node_map.get("children", []))
+    book_json = json.dumps(json_stream_helper.content_first(book_map), ensure_ascii=False, indent=2).encode("utf-8")
+    book_stats.add_file(*self._write_file(relative_path=os.path.join(book._id, "book.json"), content=book_json))
+    if self.dump_annotations:
+      book_stats.add_file(*self._write_annotations(book=book))
+
+    for copy_future in copy_futures:
+      book_stats.add_file(*copy_future.result())
+    book_stats.seconds = time.perf_counter() - start_time
+    return book_stats
+
+  def _get_page_files(self, page, file_names):
+    """:return: (source path, exported file name) pairs."""
+    # TODO: Remove this branch once data migration is done (as in BookPortion.dump_book_portion).
+    if getattr(page, "path", None) is not None:
+      return [(os.path.join(self.db_interface.external_file_store, page.path), "content" + os.path.splitext(os.path.basename(page.path))[1])]
+    return [(page.get_file_path(db_interface=self.db_interface, file_name=file_name), file_name) for file_name in file_names]
+
+  def _write_file(self, relative_path, content):
+    """Write content (bytes) to relative_path, unless it is there already.
+
+    :return: (whether it was written, its size)
+    """
+    content_hash = hashlib.sha256(content).hexdigest()
+    entry = self._get_entry(relative_path)
+    if self._is_intact(relative_path, entry) and entry["hash"] == content_hash:
+      return False, len(content)
+    path = os.path.join(self.export_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as out_file:
+      out_file.write(content)
+    os.replace(path + ".tmp", path)
+    self._put_entry(relative_path, {"hash": content_hash, "size": len(content)})
+    return True, len(content)
+
+  def _write_annotations(self, book):
+    """Like _write_file, for the annotations of book - streamed to a temporary file first."""
+    relative_path = os.path.join(book._id, "annotations.jsonl")
+    path = os.path.join(self.export_dir, relative_path)
+    self.db_interface.dump_annotations(root_id=book._id, jsonl_path=path + ".tmp")
+    content_hash = import_manifest.hash_file(path + ".tmp")
+    size = os.path.getsize(path + ".tmp")
+    entry = self._get_entry(relative_path)
+    if self._is_intact(relative_path, entry) and entry["hash"] == content_hash:
+      os.remove(path + ".tmp")
+      return False, size
+    os.replace(path + ".tmp", path)
+    self._put_entry(relative_path, {"hash": content_hash, "size": size})
+    return True, size
+
+  def _is_blob(self, source_path):
+    """Is source_path in the blob store (rather than, say, a legacy page file under its path attribute)?"""
+    store = getattr(self.db_interface, "blob_store", None)
+    if store is None:
+      return False
+    blobs_dir = os.path.abspath(store.blobs_dir)
+    return os.path.dirname(os.path.dirname(os.path.abspath(source_path))) == blobs_dir
+
+  def _copy_file(self, source_path, relative_path):
+    """Copy the file at source_path to relative_path, unless an unchanged copy is there already. Blobs are hardlinked instead.
+
+    :return: (whether it was copied or linked, its size, whether it was linked)
+    """
+    source_stat = os.stat(source_path)
+    source_signature = [source_stat.st_size, source_stat.st_mtime_ns]
+    path = os.path.join(self.export_dir, relative_path)
+    entry = self._get_entry(relative_path)
+    if self._is_blob(source_path):
+      # Blobs are named by their content hashes.
+      content_hash = os.path.basename(source_path)
+      if os.path.exists(path) and (os.path.samefile(source_path, path) or (self._is_intact(relative_path, entry) and entry["hash"] == content_hash)):
+        return False, source_stat.st_size, False
+      linked = blob_store.link_or_copy(source_path=source_path, dest_path=path)
+      self._put_entry(relative_path, {"hash": content_hash, "size": source_stat.st_size})
+      return True, source_stat.st_size, linked
+    if self._is_intact(relative_path, entry):
+      if entry.get("source") == source_signature:
+        return False, source_stat.st_size, False
+      if import_manifest.hash_file(source_path) == entry["hash"]:
+        self._put_entry(relative_path, dict(entry, source=source_signature))
+        return False, source_stat.st_size, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    num_bytes = 0
+    # Hashed while copying, so that the source is read once.
+    with open(source_path, "rb") as source_file, open(path + ".tmp", "wb") as out_file:
+      for chunk in iter(lambda: source_file.read(_COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        out_file.write(chunk)
+        num_bytes += len(chunk)
+    os.replace(path + ".tmp", path)
+    self._put_entry(relative_path, {"hash": digest.hexdigest(), "size": num_bytes, "source": source_signature})
+    return True, num_bytes, False
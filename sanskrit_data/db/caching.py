@@ -0,0 +1,254 @@
+"""
+A read-through cache in front of any :class:`~sanskrit_data.db.interfaces.DbInterface`.
+
+Wrap a database interface in a :class:`CachingDbInterface` (or one of its domain-specific subclasses) to serve repeated :meth:`find_by_id` and :meth:`find` calls from memory. Writes made through the wrapper invalidate the affected entries; writes made to the database by others are seen once cached entries expire (see ttl_seconds).
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from sanskrit_data.db import query_matcher
+from sanskrit_data.db.interfaces import DbInterface, users_db, ullekhanam_db
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+class _LruTtlCache(object):
+  """A bounded mapping, evicting least recently used entries, and ignoring entries older than ttl_seconds. Not thread-safe by itself."""
+
+  def __init__(self, max_size, ttl_seconds, stats, on_remove=None):
+    """
+
+    :param on_remove: Called with the key and value of every entry removed (evicted, expired, popped or cleared).
+    """
+    self.max_size = max_size
+    self.ttl_seconds = ttl_seconds
+    self.stats = stats
+    self.on_remove = on_remove
+    self.entries = OrderedDict()
+
+  def _removed(self, key, entry):
+    if self.on_remove is not None:
+      self.on_remove(key, entry[1])
+
+  def get(self, key):
+    """:return: (True, value) if key is cached, else (False, None)."""
+    entry = self.entries.get(key, None)
+    if entry is None:
+      return False, None
+    expiry, value = entry
+    if self.ttl_seconds is not None and time.monotonic() > expiry:
+      del self.entries[key]
+      self._removed(key, entry)
+      self.stats["expirations"] += 1
+      return False, None
+    self.entries.move_to_end(key)
+    return True, value
+
+  def put(self, key, value):
+    expiry = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+    self.pop(key, invalidation=False)
+    self.entries[key] = (expiry, value)
+    while len(self.entries) > self.max_size:
+      self._removed(*self.entries.popitem(last=False))
+      self.stats["evictions"] += 1
+
+  def pop(self, key, invalidation=True):
+    entry = self.entries.pop(key, None)
+    if entry is not None:
+      self._removed(key, entry)
+      if invalidation:
+        self.stats["invalidations"] += 1
+
+  def clear(self):
+    for key, entry in self.entries.items():
+      self._removed(key, entry)
+    self.entries.clear()
+
+
+class CachingDbInterface(DbInterface):
+  """Caches documents got with :meth:`find_by_id` (and :meth:`find_by_ids`), and results of :meth:`find` calls.
+
+  Callers get copies of cached documents, so that modifying them does not affect the cache. Safe for use from multiple threads.
+  """
+
+  def __init__(self, db_interface, max_docs=10000, max_find_filters=1000, max_find_results=1000, ttl_seconds=300):
+    """
+
+    :param DbInterface db_interface: The database interface being wrapped.
+    :param max_docs: Maximum number of documents cached by id.
+    :param max_find_filters: Maximum number of find filters whose results are cached.
+    :param max_find_results: Results of find calls yielding more documents than this are not cached.
+    :param ttl_seconds: Cached entries are not used after this many seconds. None for no limit.
+    """
+    super(CachingDbInterface, self).__init__(db_name_frontend=db_interface.db_name_frontend, external_file_store=db_interface.external_file_store)
+    self.db_interface = db_interface
+    self.max_find_results = max_find_results
+    #: Counts of hits, misses, evictions, expirations and invalidations.
+    self.stats = Counter()
+    self.docs_cache = _LruTtlCache(max_size=max_docs, ttl_seconds=ttl_seconds, stats=self.stats)
+    self.find_cache = _LruTtlCache(max_size=max_find_filters, ttl_seconds=ttl_seconds, stats=self.stats, on_remove=self._forget_find_result)
+    #: Maps the _id-s of documents in cached find results to the keys of those results.
+    self.find_keys_by_id = {}
+    self.lock = threading.RLock()
+    # Incremented on every write, so that results fetched concurrently with a write are not cached.
+    self.generation = 0
+
+  def __getattr__(self, name):
+    # Expose other methods of the wrapped interface (eg. close()).
+    if name == "db_interface":
+      raise AttributeError(name)
+    return getattr(self.db_interface, name)
+
+  def get_stats(self):
+    with self.lock:
+      return dict(self.stats)
+
+  def clear_cache(self):
+    with self.lock:
+      self.generation += 1
+      self.docs_cache.clear()
+      self.find_cache.clear()
+
+  # noinspection PyShadowingBuiltins
+  def find_by_id(self, id):
+    return self.find_by_ids(ids=[id])[0]
+
+  def find_by_ids(self, ids):
+    ids = list(ids)
+    docs = {}
+    with self.lock:
+      generation = self.generation
+      for doc_id in ids:
+        is_cached, doc = self.docs_cache.get(doc_id)
+        if is_cached:
+          docs[doc_id] = doc
+      self.stats["hits"] += len(docs)
+      missing_ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in docs]
+      self.stats["misses"] += len(missing_ids)
+    if missing_ids:
+      fetched_docs = self.db_interface.find_by_ids(ids=missing_ids)
+      with self.lock:
+        for doc_id, doc in zip(missing_ids, fetched_docs):
+          docs[doc_id] = doc
+          if self.generation == generation:
+            self.docs_cache.put(doc_id, copy.deepcopy(doc))
+    return [copy.deepcopy(docs[doc_id]) for doc_id in ids]
+
+  def find(self, find_filter):
+    try:
+      key = json.dumps(find_filter, sort_keys=True)
+    except (TypeError, ValueError):
+      key = None
+    if key is None:
+      for doc in self.db_interface.find(find_filter=find_filter):
+        yield doc
+      return
+    with self.lock:
+      generation = self.generation
+      is_cached, cached_entry = self.find_cache.get(key)
+      self.stats["hits" if is_cached else "misses"] += 1
+    if is_cached:
+      for doc in cached_entry[1]:
+        yield copy.deepcopy(doc)
+      return
+    # Results are yielded as they come, and kept for caching only while there are no more than max_find_results of them.
+    docs = []
+    results = self.db_interface.find(find_filter=find_filter)
+    try:
+      for doc in results:
+        docs = self._keep_find_result(docs, doc)
+        yield doc
+    except GeneratorExit:
+      # Closed early (eg. by a caller wanting just the first result) - the rest is fetched for caching, unless there is too much of it.
+      for doc in results:
+        docs = self._keep_find_result(docs, doc)
+        if docs is None:
+          break
+      self._cache_find_results(key=key, find_filter=find_filter, docs=docs, generation=generation)
+      raise
+    self._cache_find_results(key=key, find_filter=find_filter, docs=docs, generation=generation)
+
+  def _keep_find_result(self, docs, doc):
+    """:return: docs with a copy of doc added - or None (results not to be cached), if there would be too many."""
+    if docs is None or len(docs) >= self.max_find_results:
+      return None
+    docs.append(copy.deepcopy(doc))
+    return docs
+
+  def _cache_find_results(self, key, find_filter, docs, generation):
+    if docs is None:
+      return
+    with self.lock:
+      if self.generation == generation:
+        self.find_cache.put(key, (query_matcher.compile_filter(find_filter), docs))
+        for doc in docs:
+          self.find_keys_by_id.setdefault(doc.get("_id", None), set()).add(key)
+
+  def _forget_find_result(self, key, value):
+    for doc in value[1]:
+      keys = self.find_keys_by_id.get(doc.get("_id", None), None)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self.find_keys_by_id[doc.get("_id", None)]
+
+  def _invalidate(self, doc_ids, docs=()):
+    """Forget doc_ids, and results of find filters which included any of them or which any of docs (new versions) match. Should be called with the lock held."""
+    self.generation += 1
+    keys = set()
+    for doc_id in doc_ids:
+      self.docs_cache.pop(doc_id)
+      keys.update(self.find_keys_by_id.get(doc_id, ()))
+    if docs:
+      for key, (_, (matches, _)) in self.find_cache.entries.items():
+        if key not in keys and any(matches(doc) for doc in docs):
+          keys.add(key)
+    for key in keys:
+      self.find_cache.pop(key)
+
+  def update_doc(self, doc):
+    return self.update_docs(docs=[doc])[0]
+
+  def update_docs(self, docs):
+    # Results fetched concurrently are not cached, as the generation changes upon invalidation - and those cached before invalidation are forgotten.
+    try:
+      updated_docs = self.db_interface.update_docs(docs=docs)
+    except Exception:
+      # Some documents may have been written.
+      with self.lock:
+        self._invalidate(doc_ids=[doc["_id"] for doc in docs if "_id" in doc], docs=docs)
+      raise
+    with self.lock:
+      self._invalidate(doc_ids=[doc["_id"] for doc in updated_docs], docs=updated_docs)
+    self.notify_written(doc_ids=[doc["_id"] for doc in updated_docs])
+    return updated_docs
+
+  def delete_doc(self, doc_id):
+    self.delete_docs(doc_ids=[doc_id])
+
+  def delete_docs(self, doc_ids):
+    self.db_interface.delete_docs(doc_ids=doc_ids)
+    with self.lock:
+      self._invalidate(doc_ids=doc_ids)
+    self.notify_written(doc_ids=list(doc_ids))
+
+  def add_index(self, keys_dict, index_name):
+    self.db_interface.add_index(keys_dict=keys_dict, index_name=index_name)
+
+  def update_index(self, name, fields, upsert=False):
+    self.db_interface.update_index(name=name, fields=fields, upsert=upsert)
+
+
+class CachingBookPortionsDb(CachingDbInterface, ullekhanam_db.BookPortionsInterface):
+  pass
+
+
+class CachingUsersDb(CachingDbInterface, users_db.UsersInterface):
+  pass
@@ -0,0 +1,133 @@
+"""
+Ranged reads of files in an :py:attr:`~sanskrit_data.db.interfaces.DbInterface.external_file_store` (eg. tiles of large page images) through memory maps - see :meth:`~sanskrit_data.schema.common.JsonObject.open_file_view` and :meth:`~sanskrit_data.schema.common.JsonObject.read_file_range`.
+
+A :class:`FileHandlePool` keeps a bounded number of files open (and mapped), closing the least recently used ones - but not while views of them are in use.
+
+Files are mapped read only, and must not be modified in place while mapped: the library replaces files rather than rewriting them (see :meth:`~sanskrit_data.schema.common.JsonObject.store_file`). A replaced file is noticed (by a stat call per access) and mapped afresh.
+"""
+import collections
+import contextlib
+import logging
+import mmap
+import os
+import threading
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+class _MappedFile(object):
+  def __init__(self, path, signature):
+    self.signature = signature
+    self.num_users = 0
+    self.evicted = False
+    self.size = signature[1]
+    if self.size == 0:
+      # Empty files cannot be mapped.
+      self.fhandle = None
+      self.mmap = None
+      return
+    self.fhandle = open(path, "rb")
+    try:
+      self.mmap = mmap.mmap(self.fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+      self.fhandle.close()
+      raise
+
+  def close(self):
+    if self.mmap is not None:
+      try:
+        self.mmap.close()
+      except BufferError:
+        # Views derived from ones given out are still around - the map is closed when they are garbage collected.
+        logging.warning("Leaving a file with views in use open")
+      self.fhandle.close()
+
+
+def _get_signature(path):
+  path_stat = os.stat(path)
+  return path_stat.st_ino, path_stat.st_size, path_stat.st_mtime_ns
+
+
+class FileHandlePool(object):
+  def __init__(self, max_open_files=64):
+    """
+
+    :param max_open_files: The number of files kept open when not in use. (Files in use are not closed, so more may be open for a while.)
+    """
+    self.max_open_files = max_open_files
+    #: Maps paths to _MappedFile-s, least recently used first.
+    self.files = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+  def _acquire(self, path):
+    path = os.path.abspath(path)
+    signature = _get_signature(path)
+    with self.lock:
+      mapped_file = self.files.get(path, None)
+      if mapped_file is not None and mapped_file.signature == signature:
+        self.files.move_to_end(path)
+        mapped_file.num_users += 1
+        return mapped_file
+    new_file = _MappedFile(path=path, signature=signature)
+    with self.lock:
+      if path in self.files:
+        self._evict(path)
+      self.files[path] = new_file
+      new_file.num_users += 1
+      while len(self.files) > self.max_open_files:
+        self._evict(next(iter(self.files)))
+    return new_file
+
+  def _evict(self, path):
+    mapped_file = self.files.pop(path)
+    mapped_file.evicted = True
+    if mapped_file.num_users == 0:
+      mapped_file.close()
+
+  def _release(self, mapped_file):
+    with self.lock:
+      mapped_file.num_users -= 1
+      if mapped_file.evicted and mapped_file.num_users == 0:
+        mapped_file.close()
+
+  @contextlib.contextmanager
+  def open_view(self, path, offset=0, length=None):
+    """A context manager giving a read only memoryview of bytes [offset, offset + length) of the file at path (upto its end) - without copying them. The view must not be used after the context exits.
+
+    :param length: Defaults to the rest of the file.
+    """
+    if offset < 0 or (length is not None and length < 0):
+      raise ValueError("Invalid range: offset %d, length %s" % (offset, length))
+    mapped_file = self._acquire(path)
+    try:
+      if mapped_file.mmap is None:
+        view = memoryview(b"")
+      else:
+        end = mapped_file.size if length is None else min(offset + length, mapped_file.size)
+        view = memoryview(mapped_file.mmap)[offset:max(offset, end)]
+      try:
+        yield view
+      finally:
+        # Lest the map be closed with views still exported.
+        view.release()
+    finally:
+      self._release(mapped_file)
+
+  def read_range(self, path, offset=0, length=None):
+    """:return: Bytes [offset, offset + length) of the file at path (upto its end), as a bytes object."""
+    with self.open_view(path=path, offset=offset, length=length) as view:
+      return view.tobytes()
+
+  def get_size(self, path):
+    mapped_file = self._acquire(path)
+    self._release(mapped_file)
+    return mapped_file.size
+
+  def close(self):
+    """Close all files not in use (and others, once they are released)."""
+    with self.lock:
+      for path in list(self.files):
+        self._evict(path)
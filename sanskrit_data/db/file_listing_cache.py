@@ -0,0 +1,114 @@
+"""
+An in-process cache of the listings of object directories in an :py:attr:`~sanskrit_data.db.interfaces.DbInterface.external_file_store` (see :meth:`~sanskrit_data.schema.common.JsonObject.get_external_storage_path`) - for :meth:`~sanskrit_data.schema.common.JsonObject.list_files` to use instead of globbing the file system on every call, which is slow on network file systems with many directories. See :meth:`~sanskrit_data.db.interfaces.DbInterface.use_file_listing_cache`.
+
+Listings are filled by a single :func:`os.scandir` pass over the store (see :meth:`FileListingCache.refresh`), and kept fresh by comparing directory modification times (unless check_mtime is False), and by the library's own writes and deletions (see :meth:`FileListingCache.invalidate`).
+"""
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+#: Listings of directories modified more recently than this (by the clock of the file system, which may have a coarse mtime resolution) are not trusted to be complete.
+_RACY_SECONDS = 2
+
+
+class _Listing(object):
+  def __init__(self, mtime_ns, file_names, trusted):
+    self.mtime_ns = mtime_ns
+    self.file_names = file_names
+    #: False if the directory could have changed within the same modification time.
+    self.trusted = trusted
+
+
+class FileListingCache(object):
+  def __init__(self, root_dir, check_mtime=True):
+    """
+
+    :param check_mtime: Whether to check that a directory is unmodified (with a stat call) before using its cached listing. Without it, only changes made through :meth:`invalidate` (which the library calls when storing or deleting files) are noticed.
+    """
+    self.root_dir = root_dir
+    self.check_mtime = check_mtime
+    #: Maps directory names (object _id-s) to _Listing-s. Directories known not to exist map to None.
+    self.listings = {}
+    self.complete = False
+    self.lock = threading.Lock()
+
+  def _list_dir(self, dir_name, mtime_ns=None):
+    path = os.path.join(self.root_dir, dir_name)
+    try:
+      if mtime_ns is None:
+        mtime_ns = os.stat(path).st_mtime_ns
+      file_names = sorted(entry.name for entry in os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+      return None
+    return _Listing(mtime_ns=mtime_ns, file_names=file_names, trusted=time.time_ns() - mtime_ns > _RACY_SECONDS * 10 ** 9)
+
+  def _is_fresh(self, dir_name, listing):
+    if not self.check_mtime:
+      return True
+    try:
+      mtime_ns = os.stat(os.path.join(self.root_dir, dir_name)).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+      return listing is None
+    return listing is not None and listing.trusted and listing.mtime_ns == mtime_ns
+
+  def refresh(self):
+    """(Re)list all directories in the store, in one pass - re-reading only those modified since they were last listed."""
+    listings = {}
+    with os.scandir(self.root_dir) as root_entries:
+      for entry in root_entries:
+        if not entry.is_dir():
+          continue
+        mtime_ns = entry.stat().st_mtime_ns
+        listing = self.listings.get(entry.name, None)
+        if listing is None or not listing.trusted or listing.mtime_ns != mtime_ns:
+          listing = self._list_dir(entry.name, mtime_ns=mtime_ns)
+        listings[entry.name] = listing
+    with self.lock:
+      self.listings = listings
+      self.complete = True
+
+  def invalidate(self, dir_name):
+    """Note that files in the directory dir_name have been added or removed (or the directory itself) - it is listed again right away, so that the cache stays complete."""
+    listing = self._list_dir(dir_name)
+    with self.lock:
+      self.listings[dir_name] = listing
+
+  def _get_listing(self, dir_name):
+    if dir_name in self.listings:
+      listing = self.listings[dir_name]
+      if self._is_fresh(dir_name, listing):
+        return listing
+    elif self.complete and not self.check_mtime:
+      return None
+    listing = self._list_dir(dir_name)
+    with self.lock:
+      self.listings[dir_name] = listing
+    return listing
+
+  def list_files(self, dir_name, suffix_pattern="*"):
+    """:return: Sorted names of entries in the directory dir_name matching suffix_pattern (with hidden names matching only patterns starting with ".", as in :func:`glob.glob`)."""
+    listing = self._get_listing(dir_name)
+    if listing is None:
+      return []
+    return _filter_names(listing.file_names, suffix_pattern)
+
+  def list_files_many(self, dir_names, suffix_pattern="*"):
+    """:return: A map from each of dir_names to what :meth:`list_files` would return - listing the whole store in one pass first if it has not been listed."""
+    if self.complete:
+      return {dir_name: self.list_files(dir_name=dir_name, suffix_pattern=suffix_pattern) for dir_name in dir_names}
+    self.refresh()
+    # Just listed - no need to check modification times again.
+    listings = self.listings
+    return {dir_name: [] if listings.get(dir_name, None) is None else _filter_names(listings[dir_name].file_names, suffix_pattern) for dir_name in dir_names}
+
+
+def _filter_names(file_names, suffix_pattern):
+  include_hidden = suffix_pattern.startswith(".")
+  return [file_name for file_name in file_names if (include_hidden or not file_name.startswith(".")) and fnmatch.fnmatch(file_name, suffix_pattern)]
@@ -0,0 +1,250 @@
+"""
+Read-only corpus images, memory-mapped by :class:`FrozenDb` - so that processes serving the same corpus share a single copy of it (in the OS page cache).
+
+Write an image with :func:`freeze`, and open it (in each process) with :class:`FrozenDb`. Opening an image just maps it and reads a small header, however large the corpus; documents are decoded only when accessed.
+
+The image layout is:
+
+- The documents, as UTF-8 JSON, in the order of their _id-s (as UTF-8 bytes).
+- A strings region, holding the _id-s, and the (JSON encoded) values found in indexes.
+- An id table, with an entry (offsets and lengths of the _id and the document) per document, in _id order - for binary search.
+- A table per index, with an entry (offset and length of the value, document number) per value found at some path in some document, sorted by value.
+- A JSON header, describing where the above are.
+- A footer with the offset of the header, and a magic string.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+
+from sanskrit_data.db import query_matcher
+from sanskrit_data.db.interfaces import DbInterface, users_db, ullekhanam_db
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+_MAGIC = b"SDFROZN1"
+_FOOTER = struct.Struct("<Q8s")
+# Offset and length of the _id, offset and length of the document.
+_ID_ENTRY = struct.Struct("<QIQI")
+# Offset and length of the value, document number.
+_INDEX_ENTRY = struct.Struct("<QII")
+_FORMAT_VERSION = 1
+_FREEZE_BATCH_SIZE = 1000
+
+
+def _encode_index_value(value):
+  """Encode an indexable value as bytes, such that values which are equal (per query_matcher) get the same encoding."""
+  if isinstance(value, float) and value.is_integer():
+    value = int(value)
+  return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _get_default_index_paths(db_interface):
+  index_paths = ["jsonClass", "targets.container_id"]
+  for index in getattr(db_interface, "indexes", {}).values():
+    if index.path not in index_paths:
+      index_paths.append(index.path)
+  return index_paths
+
+
+def freeze(db_interface, image_path, index_paths=None):
+  """Write the contents of db_interface into an image, to be opened with :class:`FrozenDb`.
+
+  :param DbInterface db_interface:
+  :param image_path: Written atomically (via a temporary file).
+  :param index_paths: Paths to index (for equality and $in lookups). By default: jsonClass, targets.container_id, and the paths of the indexes of db_interface (if it is an InMemoryDb).
+  :return: The number of documents written.
+  """
+  if index_paths is None:
+    index_paths = _get_default_index_paths(db_interface=db_interface)
+  doc_ids = sorted((doc["_id"] for doc in db_interface.find(find_filter={})), key=lambda doc_id: str(doc_id).encode("utf-8"))
+  index_entries = dict((path, []) for path in index_paths)
+  doc_locations = []
+  temp_path = image_path + ".tmp"
+  with open(temp_path, "wb") as image_file:
+    offset = 0
+    for start in range(0, len(doc_ids), _FREEZE_BATCH_SIZE):
+      docs = db_interface.find_by_ids(ids=doc_ids[start:start + _FREEZE_BATCH_SIZE])
+      for doc_number, doc in enumerate(docs, start):
+        doc_bytes = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        image_file.write(doc_bytes)
+        doc_locations.append((offset, len(doc_bytes)))
+        offset += len(doc_bytes)
+        for path, entries in index_entries.items():
+          for value in set(query_matcher.get_indexable_values(doc, path.split("."))):
+            entries.append((_encode_index_value(value), doc_number))
+
+    strings = {}
+    strings_region = bytearray()
+
+    def get_string_location(string_bytes):
+      location = strings.get(string_bytes, None)
+      if location is None:
+        location = (offset + len(strings_region), len(string_bytes))
+        strings[string_bytes] = location
+        strings_region.extend(string_bytes)
+      return location
+
+    id_locations = [get_string_location(str(doc_id).encode("utf-8")) for doc_id in doc_ids]
+    for entries in index_entries.values():
+      entries.sort()
+      for value_bytes, _ in entries:
+        get_string_location(value_bytes)
+    image_file.write(strings_region)
+    offset += len(strings_region)
+
+    header = {"format_version": _FORMAT_VERSION, "num_docs": len(doc_ids), "ids_offset": offset, "indexes": {}}
+    for (id_offset, id_length), (doc_offset, doc_length) in zip(id_locations, doc_locations):
+      image_file.write(_ID_ENTRY.pack(id_offset, id_length, doc_offset, doc_length))
+    offset += _ID_ENTRY.size * len(doc_ids)
+    for path, entries in index_entries.items():
+      header["indexes"][path] = {"offset": offset, "num_entries": len(entries)}
+      for value_bytes, doc_number in entries:
+        value_offset, value_length = strings[value_bytes]
+        image_file.write(_INDEX_ENTRY.pack(value_offset, value_length, doc_number))
+      offset += _INDEX_ENTRY.size * len(entries)
+
+    image_file.write(json.dumps(header).encode("utf-8"))
+    image_file.write(_FOOTER.pack(offset, _MAGIC))
+    image_file.flush()
+    os.fsync(image_file.fileno())
+  os.replace(temp_path, image_path)
+  logging.info("Froze %d documents into %s", len(doc_ids), image_path)
+  return len(doc_ids)
+
+
+class FrozenDb(DbInterface):
+  """A read-only DbInterface serving an image written by :func:`freeze`. Safe for use from multiple threads (and processes)."""
+
+  def __init__(self, image_path, db_name_frontend, external_file_store=None):
+    super(FrozenDb, self).__init__(db_name_frontend=db_name_frontend, external_file_store=external_file_store)
+    self.image_path = image_path
+    with open(image_path, "rb") as image_file:
+      self.image = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+    header_offset, magic = _FOOTER.unpack_from(self.image, len(self.image) - _FOOTER.size)
+    if magic != _MAGIC:
+      raise ValueError("Not a frozen image: " + image_path)
+    header = json.loads(self.image[header_offset:len(self.image) - _FOOTER.size].decode("utf-8"))
+    if header["format_version"] != _FORMAT_VERSION:
+      raise ValueError("Unsupported frozen image format %s in %s" % (header["format_version"], image_path))
+    self.num_docs = header["num_docs"]
+    self.ids_offset = header["ids_offset"]
+    #: Maps indexed paths to (offset, number of entries) of their tables.
+    self.index_tables = dict((path, (table["offset"], table["num_entries"])) for path, table in header["indexes"].items())
+
+  def close(self):
+    self.image.close()
+
+  def __len__(self):
+    return self.num_docs
+
+  def _get_id_bytes(self, doc_number):
+    id_offset, id_length, _, _ = _ID_ENTRY.unpack_from(self.image, self.ids_offset + _ID_ENTRY.size * doc_number)
+    return self.image[id_offset:id_offset + id_length]
+
+  def _get_doc(self, doc_number):
+    _, _, doc_offset, doc_length = _ID_ENTRY.unpack_from(self.image, self.ids_offset + _ID_ENTRY.size * doc_number)
+    return json.loads(self.image[doc_offset:doc_offset + doc_length].decode("utf-8"))
+
+  def _find_doc_number(self, doc_id):
+    """Binary search the id table. :return: The document number, or None."""
+    id_bytes = str(doc_id).encode("utf-8")
+    low, high = 0, self.num_docs
+    while low < high:
+      middle = (low + high) // 2
+      if self._get_id_bytes(middle) < id_bytes:
+        low = middle + 1
+      else:
+        high = middle
+    if low < self.num_docs and self._get_id_bytes(low) == id_bytes:
+      return low
+    return None
+
+  def _get_indexed_doc_numbers(self, path, values):
+    """Numbers of the documents having one of values at path, or None if path is not indexed."""
+    if path not in self.index_tables:
+      return None
+    table_offset, num_entries = self.index_tables[path]
+
+    def get_entry(entry_number):
+      value_offset, value_length, doc_number = _INDEX_ENTRY.unpack_from(self.image, table_offset + _INDEX_ENTRY.size * entry_number)
+      return self.image[value_offset:value_offset + value_length], doc_number
+
+    doc_numbers = set()
+    for value in values:
+      value_bytes = _encode_index_value(value)
+      low, high = 0, num_entries
+      while low < high:
+        middle = (low + high) // 2
+        if get_entry(middle)[0] < value_bytes:
+          low = middle + 1
+        else:
+          high = middle
+      while low < num_entries:
+        entry_value_bytes, doc_number = get_entry(low)
+        if entry_value_bytes != value_bytes:
+          break
+        doc_numbers.add(doc_number)
+        low += 1
+    return doc_numbers
+
+  def _get_candidate_doc_numbers(self, find_filter):
+    """Use indexes to narrow down the documents which could match find_filter.
+
+    :return: A (possibly over-inclusive) sorted list of document numbers, or None if all documents need to be scanned.
+    """
+    candidate_sets = []
+    for path, values in query_matcher.get_indexable_clause_values(find_filter).items():
+      doc_numbers = self._get_indexed_doc_numbers(path=path, values=values)
+      if doc_numbers is not None:
+        candidate_sets.append(doc_numbers)
+    if not candidate_sets:
+      return None
+    candidate_sets.sort(key=len)
+    return sorted(candidate_sets[0].intersection(*candidate_sets[1:]))
+
+  # noinspection PyShadowingBuiltins
+  def find_by_id(self, id):
+    doc_number = self._find_doc_number(doc_id=id)
+    return self._get_doc(doc_number) if doc_number is not None else None
+
+  def find(self, find_filter):
+    matches = query_matcher.compile_filter(find_filter)
+    doc_numbers = self._get_candidate_doc_numbers(find_filter=find_filter)
+    if doc_numbers is None:
+      doc_numbers = range(self.num_docs)
+    for doc_number in doc_numbers:
+      doc = self._get_doc(doc_number)
+      if matches(doc):
+        yield doc
+
+  def update_doc(self, doc):
+    raise NotImplementedError("FrozenDb is read-only: " + self.image_path)
+
+  def update_docs(self, docs):
+    raise NotImplementedError("FrozenDb is read-only: " + self.image_path)
+
+  def delete_doc(self, doc_id):
+    raise NotImplementedError("FrozenDb is read-only: " + self.image_path)
+
+  def delete_docs(self, doc_ids):
+    raise NotImplementedError("FrozenDb is read-only: " + self.image_path)
+
+  def add_index(self, keys_dict, index_name):
+    """Indexes are fixed when freezing (see the index_paths argument of :func:`freeze`) - this does nothing."""
+    pass
+
+  def update_index(self, name, fields, upsert=False):
+    pass
+
+
+class FrozenBookPortionsDb(FrozenDb, ullekhanam_db.BookPortionsInterface):
+  pass
+
+
+class FrozenUsersDb(FrozenDb, users_db.UsersInterface):
+  pass
@@ -0,0 +1,75 @@
+"""
+An opt-in identity map for JsonObjects decoded from documents in a database.
+
+Within a session (typically the handling of one request), use::
+
+  with IdentityMap(db_interface=db_interface):
+    book_node = db_interface.get(path="myrepo/halAyudha")
+
+While the map is in use (in the current thread), documents fetched via :meth:`~sanskrit_data.schema.common.JsonObject.make_from_db_dict` (as by from_id, get_targetting_entities, fill_descendents, list_books etc.) are decoded only once - later fetches yield the same object. So, callers should not modify such objects without writing them to the database. Entries are forgotten when their documents are written through the interface, when a document with a different _rev is fetched, or (least recently used first) when there are more than max_size of them.
+"""
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+class IdentityMap(object):
+  """Maps _id-s of documents to (the revision and) the JsonObjects decoded from them."""
+
+  def __init__(self, db_interface, max_size=10000):
+    self.db_interface = db_interface
+    self.max_size = max_size
+    self.objects = OrderedDict()
+    #: Counts of hits and misses.
+    self.stats = Counter()
+    # Invalidations may come from other threads.
+    self.lock = threading.Lock()
+    self.previous_identity_map = None
+
+  def __enter__(self):
+    self.previous_identity_map = self.db_interface.get_identity_map()
+    self.db_interface.set_identity_map(self)
+    self.db_interface.write_listeners.append(self.invalidate)
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.db_interface.write_listeners.remove(self.invalidate)
+    self.db_interface.set_identity_map(self.previous_identity_map)
+    self.clear()
+    return False
+
+  def get_or_decode(self, input_dict, decode):
+    """Get the object decoded from a document earlier, or decode it (using decode) and remember it."""
+    if input_dict.get("_id", None) is None:
+      return decode(input_dict)
+    # Decoded objects have string _id-s.
+    doc_id = str(input_dict["_id"])
+    revision = input_dict.get("_rev", None)
+    with self.lock:
+      entry = self.objects.get(doc_id, None)
+      if entry is not None and entry[0] == revision:
+        self.objects.move_to_end(doc_id)
+        self.stats["hits"] += 1
+        return entry[1]
+      self.stats["misses"] += 1
+    obj = decode(input_dict)
+    with self.lock:
+      self.objects[doc_id] = (revision, obj)
+      self.objects.move_to_end(doc_id)
+      while len(self.objects) > self.max_size:
+        self.objects.popitem(last=False)
+    return obj
+
+  def invalidate(self, doc_ids):
+    with self.lock:
+      for doc_id in doc_ids:
+        self.objects.pop(str(doc_id), None)
+
+  def clear(self):
+    with self.lock:
+      self.objects.clear()
@@ -0,0 +1,138 @@
+"""
+Manifests: JSON Lines files with an entry (a JSON map) per path, recording what was done with the file at that path - so that unchanged files need not be processed again, and interrupted runs resume where they stopped.
+
+In particular, :class:`ImportManifest` records which books :meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.import_all` has imported (see its incremental parameter), with a line like {"path": <book.json path>, "hash": <content hash>, "ids": [<document _id-s>]} per imported book. (:py:mod:`~sanskrit_data.db.book_exporter` keeps a :class:`FileManifest` of exported files.)
+
+Lines are appended as entries get recorded - later lines superseding earlier ones for the same path; and the file is compacted (eg. when an import finishes). A line partly written when the process died is ignored.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from sanskrit_data.file_helper import fsync_dir
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_files(paths):
+  """:return: A hex digest of the contents of the files at paths (which exist), in the given order."""
+  digest = hashlib.sha256()
+  for path in paths:
+    digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+    with open(path, "rb") as fhandle:
+      for chunk in iter(lambda: fhandle.read(_HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+  return digest.hexdigest()
+
+
+def hash_file(path):
+  """:return: A hex digest of the contents of the file at path."""
+  digest = hashlib.sha256()
+  with open(path, "rb") as fhandle:
+    for chunk in iter(lambda: fhandle.read(_HASH_CHUNK_SIZE), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+class FileManifest(object):
+  """A JSON Lines file of entries (JSON maps) keyed by path - as described above, but for the contents of the entries. Not thread-safe."""
+
+  def __init__(self, manifest_path, sync=True):
+    """
+
+    :param sync: Whether to fsync each entry as it is recorded (else, see :meth:`sync`).
+    """
+    self.manifest_path = manifest_path
+    self.sync_records = sync
+    #: Maps paths to entries.
+    self.entries = {}
+    self.num_lines = 0
+    if os.path.exists(manifest_path):
+      complete_length = 0
+      with open(manifest_path, "rb") as manifest_file:
+        for line in manifest_file:
+          try:
+            if not line.endswith(b"\n"):
+              raise ValueError("No line end")
+            entry = json.loads(line.decode("utf-8"))
+          except ValueError:
+            logging.warning("Ignoring a partly written line in %s", manifest_path)
+            break
+          self.entries[entry.pop("path")] = entry
+          self.num_lines += 1
+          complete_length += len(line)
+      if complete_length < os.path.getsize(manifest_path):
+        # Lest lines appended hereafter get joined to the partial one.
+        with open(manifest_path, "r+b") as manifest_file:
+          manifest_file.truncate(complete_length)
+    else:
+      os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    self.manifest_file = open(manifest_path, "a", encoding="utf-8")
+
+  def _get_key(self, path):
+    return path
+
+  def get(self, path):
+    """:return: The entry for path, or None."""
+    return self.entries.get(self._get_key(path), None)
+
+  def put(self, path, entry):
+    path = self._get_key(path)
+    self.entries[path] = entry
+    self.manifest_file.write(json.dumps(dict(entry, path=path), ensure_ascii=False, sort_keys=True) + "\n")
+    self.num_lines += 1
+    if self.sync_records:
+      self.sync()
+
+  def sync(self):
+    """Make the entries recorded so far durable."""
+    self.manifest_file.flush()
+    os.fsync(self.manifest_file.fileno())
+
+  def compact(self):
+    """Rewrite the file with a line per path (dropping superseded lines)."""
+    if self.num_lines == len(self.entries):
+      return
+    self.manifest_file.close()
+    temp_path = self.manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as temp_file:
+      for path, entry in sorted(self.entries.items()):
+        temp_file.write(json.dumps(dict(entry, path=path), ensure_ascii=False, sort_keys=True) + "\n")
+      temp_file.flush()
+      os.fsync(temp_file.fileno())
+    os.replace(temp_path, self.manifest_path)
+    fsync_dir(os.path.dirname(os.path.abspath(self.manifest_path)))
+    self.num_lines = len(self.entries)
+    self.manifest_file = open(self.manifest_path, "a", encoding="utf-8")
+
+  def close(self):
+    self.manifest_file.close()
+
+
+class ImportManifest(FileManifest):
+  """Entries are keyed by absolute book.json paths, and are like {"hash": ..., "ids": [...]}.
+
+  While a book is being written, its entry is like {"hash": null, "ids": [...], "pending_root_ids": [...]}: the book's earlier documents, and the roots of the trees being written - so that an interrupted import can be cleaned up when the book is imported again.
+  """
+
+  def _get_key(self, path):
+    return os.path.abspath(path)
+
+  def record(self, path, content_hash, doc_ids):
+    """Durably note that the book at path, with content_hash, has been written as the documents with doc_ids."""
+    self.put(path=path, entry={"hash": content_hash, "ids": list(doc_ids)})
+
+  def record_pending(self, path, root_id):
+    """Durably note that the book at path is being written, as the tree of documents under the one with root_id. The documents recorded for the book earlier (and earlier pending roots) are kept in the entry."""
+    entry = self.get(path)
+    doc_ids = [] if entry is None else entry["ids"]
+    pending_root_ids = [] if entry is None else entry.get("pending_root_ids", [])
+    if root_id not in pending_root_ids:
+      pending_root_ids = pending_root_ids + [root_id]
+    self.put(path=path, entry={"hash": None, "ids": doc_ids, "pending_root_ids": pending_root_ids})
@@ -1,38 +1,714 @@
+"""
+A :class:`~sanskrit_data.db.interfaces.DbInterface` implementation keeping documents in memory - useful for tests, and for serving small datasets.
+
+InMemoryDb offers snapshot isolation, so that it can be used from many threads without a global lock:
+
+- Its documents and indexes are kept in immutable (persistent) maps, bundled into a version. Each read works with the version current when it started - so a find generator is unaffected by writes made while it is being consumed.
+- Writers are serialized by a lock, and publish a new version which shares all but O(log n) of its structure with the previous one. Readers never wait for writers.
+- Stored documents are never handed out: writes store copies of the given dicts, and reads return copies.
+- find yields documents in the order they were first written (re-writing a document keeps its place), as a dict would - independent of hashing.
+
+Given a log_dir, InMemoryDb persists its writes - see :mod:`~sanskrit_data.db.write_ahead_log`.
+"""
+import contextlib
+import gc
+import json
+import threading
+from collections.abc import Mapping
+
+from sanskrit_data.db import query_matcher
 from sanskrit_data.db.interfaces import DbInterface, get_random_string, users_db, ullekhanam_db
-from sanskrit_data.schema.common import JsonObject
+
+_CHUNK_BITS = 5
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+# Beyond this depth, keys with colliding hashes share a bucket.
+_MAX_DEPTH = 12
+_MAX_BUCKET_SIZE = 8
+# Versions whose document order has more places of deleted documents than this (and than documents) are compacted.
+_MAX_ORDER_GAPS = 32
+_ABSENT = object()
+
+
+class _TrieNode(dict):
+  """An internal node of a :class:`_PersistentMap`, mapping chunks of key hashes to child nodes or to buckets (plain dicts from keys to values)."""
+  __slots__ = ()
+
+
+def _copy_unless_owned(container, owned, container_class):
+  """Copy container (a node or bucket) - unless it is in owned, a dict of containers (by id) created during a batch of writes, which can be modified in place."""
+  if owned is None:
+    return container_class(container)
+  if id(container) in owned:
+    return container
+  new_container = container_class(container)
+  owned[id(new_container)] = new_container
+  return new_container
+
+
+def _set_in_node(node, key_hash, depth, key, value, owned=None):
+  """:return: A copy of node (see :func:`_copy_unless_owned`) with key set to value, and whether key was added."""
+  chunk = key_hash & _CHUNK_MASK
+  child = node.get(chunk, None)
+  new_node = _copy_unless_owned(node, owned, _TrieNode)
+  if type(child) is _TrieNode:
+    new_node[chunk], is_added = _set_in_node(child, key_hash >> _CHUNK_BITS, depth + 1, key, value, owned)
+    return new_node, is_added
+  bucket = _copy_unless_owned({} if child is None else child, owned, dict)
+  is_added = key not in bucket
+  bucket[key] = value
+  if len(bucket) > _MAX_BUCKET_SIZE and depth < _MAX_DEPTH:
+    # Split the bucket by the next chunk of the hashes of its keys.
+    sub_node = _copy_unless_owned(_TrieNode(), owned, _TrieNode)
+    shift = _CHUNK_BITS * (depth + 1)
+    for bucket_key, bucket_value in bucket.items():
+      sub_chunk = (hash(bucket_key) >> shift) & _CHUNK_MASK
+      if sub_chunk not in sub_node:
+        sub_node[sub_chunk] = _copy_unless_owned({}, owned, dict)
+      sub_node[sub_chunk][bucket_key] = bucket_value
+    new_node[chunk] = sub_node
+  else:
+    new_node[chunk] = bucket
+  return new_node, is_added
+
+
+def _build_node(keys, items_dict, depth):
+  """Build a node holding the items of items_dict with the given keys (whose hashes agree upto depth), as repeated :func:`_set_in_node` calls would."""
+  shift = _CHUNK_BITS * depth
+  groups = {}
+  for key in keys:
+    chunk = (hash(key) >> shift) & _CHUNK_MASK
+    group = groups.get(chunk, None)
+    if group is None:
+      groups[chunk] = [key]
+    else:
+      group.append(key)
+  node = _TrieNode()
+  for chunk, group in groups.items():
+    if len(group) > _MAX_BUCKET_SIZE and depth < _MAX_DEPTH:
+      node[chunk] = _build_node(group, items_dict, depth + 1)
+    else:
+      node[chunk] = dict((key, items_dict[key]) for key in group)
+  return node
+
+
+def _discard_from_node(node, key_hash, key, owned=None):
+  """:return: A copy of node (see :func:`_copy_unless_owned`) without key (or node itself, if key is absent), and whether key was removed."""
+  chunk = key_hash & _CHUNK_MASK
+  child = node.get(chunk, None)
+  if child is None:
+    return node, False
+  if type(child) is _TrieNode:
+    new_child, is_removed = _discard_from_node(child, key_hash >> _CHUNK_BITS, key, owned)
+    if not is_removed:
+      return node, False
+  elif key in child:
+    new_child = _copy_unless_owned(child, owned, dict)
+    del new_child[key]
+  else:
+    return node, False
+  new_node = _copy_unless_owned(node, owned, _TrieNode)
+  if new_child:
+    new_node[chunk] = new_child
+  else:
+    del new_node[chunk]
+  return new_node, True
+
+
+class _PersistentMap(object):
+  """An immutable mapping (a hash array mapped trie). :meth:`set` and :meth:`discard` return new maps, sharing all but O(log n) nodes with this one.
+
+  In a batch of changes, where only the final map is published, pass the same dict as owned to each set/ discard call: nodes copied earlier in the batch are then modified in place, rather than copied again.
+  """
+  __slots__ = ("root", "size")
+
+  def __init__(self, root=None, size=0):
+    self.root = _TrieNode() if root is None else root
+    self.size = size
+
+  @classmethod
+  def from_dict(cls, items_dict):
+    """Build a map with the items of items_dict - much faster than setting them one by one."""
+    return cls(root=_build_node(items_dict, items_dict, 0), size=len(items_dict))
+
+  def __len__(self):
+    return self.size
+
+  def __contains__(self, key):
+    return self.get(key, _ABSENT) is not _ABSENT
+
+  def __getitem__(self, key):
+    value = self.get(key, _ABSENT)
+    if value is _ABSENT:
+      raise KeyError(key)
+    return value
+
+  def __iter__(self):
+    for key, _ in self.items():
+      yield key
+
+  def get(self, key, default=None):
+    node = self.root
+    key_hash = hash(key)
+    while True:
+      child = node.get(key_hash & _CHUNK_MASK, None)
+      if child is None:
+        return default
+      if type(child) is not _TrieNode:
+        return child.get(key, default)
+      node = child
+      key_hash >>= _CHUNK_BITS
+
+  def set(self, key, value, owned=None):
+    root, is_added = _set_in_node(self.root, hash(key), 0, key, value, owned)
+    return _PersistentMap(root=root, size=self.size + is_added)
+
+  def discard(self, key, owned=None):
+    root, is_removed = _discard_from_node(self.root, hash(key), key, owned)
+    if not is_removed:
+      return self
+    return _PersistentMap(root=root, size=self.size - 1)
+
+  def keys(self):
+    return iter(self)
+
+  def values(self):
+    for _, value in self.items():
+      yield value
+
+  def items(self):
+    nodes = [self.root]
+    while nodes:
+      for child in nodes.pop().values():
+        if type(child) is _TrieNode:
+          nodes.append(child)
+        else:
+          for item in child.items():
+            yield item
+
+
+def _set_in_vector_node(node, shift, index, value, owned=None):
+  """:return: A copy of node (see :func:`_copy_unless_owned`) with value at index."""
+  new_node = _copy_unless_owned(node, owned, list)
+  chunk = (index >> shift) & _CHUNK_MASK
+  new_node[chunk] = value if shift == 0 else _set_in_vector_node(node[chunk], shift - _CHUNK_BITS, index, value, owned)
+  return new_node
+
+
+def _push_leaf(node, shift, start, leaf, owned=None):
+  """:return: A copy of node (see :func:`_copy_unless_owned`) with leaf (a full list of items) added at position start."""
+  new_node = _copy_unless_owned(node, owned, list)
+  chunk = (start >> shift) & _CHUNK_MASK
+  if shift == _CHUNK_BITS:
+    new_node.append(leaf)
+  elif chunk < len(new_node):
+    new_node[chunk] = _push_leaf(node[chunk], shift - _CHUNK_BITS, start, leaf, owned)
+  else:
+    new_node.append(_push_leaf([], shift - _CHUNK_BITS, start, leaf, owned))
+  return new_node
+
+
+class _PersistentVector(object):
+  """An immutable sequence (a trie of lists, indexed by chunks of positions, followed by a tail list of upto 32 items). :meth:`set` and :meth:`append` return new vectors, sharing all but O(log n) nodes with this one - appends mostly copy just the tail.
+
+  See :class:`_PersistentMap` regarding owned.
+  """
+  __slots__ = ("root", "size", "shift", "tail")
+
+  def __init__(self, root=None, size=0, shift=0, tail=None):
+    self.root = [] if root is None else root
+    self.size = size
+    # The position of the chunk of indexes which the root is indexed by - 0 if the root holds items.
+    self.shift = shift
+    self.tail = [] if tail is None else tail
+
+  @classmethod
+  def from_list(cls, items):
+    chunk_size = 1 << _CHUNK_BITS
+    trie_size = (len(items) - 1) // chunk_size * chunk_size if items else 0
+    nodes = [items[start:start + chunk_size] for start in range(0, trie_size, chunk_size)] or [[]]
+    shift = 0
+    while len(nodes) > 1:
+      nodes = [nodes[start:start + chunk_size] for start in range(0, len(nodes), chunk_size)]
+      shift += _CHUNK_BITS
+    return cls(root=nodes[0], size=len(items), shift=shift, tail=items[trie_size:])
+
+  def __len__(self):
+    return self.size
+
+  def __getitem__(self, index):
+    if not 0 <= index < self.size:
+      raise IndexError(index)
+    tail_start = self.size - len(self.tail)
+    if index >= tail_start:
+      return self.tail[index - tail_start]
+    node = self.root
+    shift = self.shift
+    while shift > 0:
+      node = node[(index >> shift) & _CHUNK_MASK]
+      shift -= _CHUNK_BITS
+    return node[index & _CHUNK_MASK]
+
+  def __iter__(self):
+    if self.size > len(self.tail):
+      nodes = [(self.root, self.shift)]
+      while nodes:
+        node, shift = nodes.pop()
+        if shift == 0:
+          for item in node:
+            yield item
+        else:
+          nodes.extend((child, shift - _CHUNK_BITS) for child in reversed(node))
+    for item in self.tail:
+      yield item
+
+  def set(self, index, value, owned=None):
+    if not 0 <= index < self.size:
+      raise IndexError(index)
+    tail_start = self.size - len(self.tail)
+    if index >= tail_start:
+      tail = _copy_unless_owned(self.tail, owned, list)
+      tail[index - tail_start] = value
+      return _PersistentVector(root=self.root, size=self.size, shift=self.shift, tail=tail)
+    return _PersistentVector(root=_set_in_vector_node(self.root, self.shift, index, value, owned), size=self.size, shift=self.shift, tail=self.tail)
+
+  def append(self, value, owned=None):
+    if len(self.tail) < 1 << _CHUNK_BITS:
+      tail = _copy_unless_owned(self.tail, owned, list)
+      tail.append(value)
+      return _PersistentVector(root=self.root, size=self.size + 1, shift=self.shift, tail=tail)
+    # Move the full tail into the trie.
+    trie_size = self.size - len(self.tail)
+    root = self.root
+    shift = self.shift
+    if trie_size == 0:
+      root = self.tail
+    else:
+      if trie_size == 1 << (shift + _CHUNK_BITS):
+        root = [root]
+        shift += _CHUNK_BITS
+      root = _push_leaf(root, shift, trie_size, self.tail, owned)
+    return _PersistentVector(root=root, size=self.size + 1, shift=shift, tail=[value])
+
+_EMPTY_MAP = _PersistentMap()
+_EMPTY_VECTOR = _PersistentVector()
+
+
+@contextlib.contextmanager
+def _gc_paused():
+  """Pause garbage collection while building large structures - which otherwise triggers repeated, futile full collections."""
+  was_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if was_enabled:
+      gc.enable()
+
+
+def _copy_json(value):
+  """Copy a json map (dicts, lists and scalars) - much faster than copy.deepcopy."""
+  if isinstance(value, dict):
+    return dict((key, _copy_json(item)) for key, item in value.items())
+  elif isinstance(value, list):
+    return [_copy_json(item) for item in value]
+  return value
+
+
+class _HashIndex(object):
+  """Maps values at a dotted path to the ids of the documents having them. Immutable: :meth:`with_doc` returns an updated index.
+
+  The values indexed for each document are remembered, so that the stale entries of re-written documents can be removed.
+  """
+
+  def __init__(self, path, ids_by_value=_EMPTY_MAP, values_by_id=_EMPTY_MAP):
+    self.path = path
+    self.path_parts = path.split(".")
+    self.ids_by_value = ids_by_value
+    self.values_by_id = values_by_id
+
+  @classmethod
+  def from_docs(cls, path, docs):
+    """Index docs (an iterable of (id, document) pairs) in one go."""
+    path_parts = path.split(".")
+    ids_by_value = {}
+    values_by_id = {}
+    for doc_id, doc in docs:
+      values = frozenset(query_matcher.get_indexable_values(doc, path_parts))
+      if values:
+        values_by_id[doc_id] = values
+        for value in values:
+          ids_by_value.setdefault(value, {})[doc_id] = None
+    ids_by_value = dict((value, _PersistentMap.from_dict(ids)) for value, ids in ids_by_value.items())
+    return cls(path=path, ids_by_value=_PersistentMap.from_dict(ids_by_value), values_by_id=_PersistentMap.from_dict(values_by_id))
+
+  def with_doc(self, doc_id, doc, owned=None):
+    """:param doc: The new version of the document, or None if it is deleted.
+    :param owned: See :class:`_PersistentMap`.
+    """
+    new_values = frozenset(query_matcher.get_indexable_values(doc, self.path_parts)) if doc is not None else frozenset()
+    old_values = self.values_by_id.get(doc_id, frozenset())
+    if new_values == old_values:
+      return self
+    ids_by_value = self.ids_by_value
+    for value in old_values - new_values:
+      ids = ids_by_value[value].discard(doc_id, owned)
+      ids_by_value = ids_by_value.set(value, ids, owned) if ids else ids_by_value.discard(value, owned)
+    for value in new_values - old_values:
+      ids_by_value = ids_by_value.set(value, ids_by_value.get(value, _EMPTY_MAP).set(doc_id, None, owned), owned)
+    values_by_id = self.values_by_id.set(doc_id, new_values, owned) if new_values else self.values_by_id.discard(doc_id, owned)
+    return _HashIndex(path=self.path, ids_by_value=ids_by_value, values_by_id=values_by_id)
+
+  def get_ids(self, value):
+    return self.ids_by_value.get(value, _EMPTY_MAP)
+
+
+class _TargetIndex(object):
+  """Maps container_id-s to the ids of the documents targetting them, grouped by the jsonClass of the targetting documents. Immutable: :meth:`with_doc` returns an updated index."""
+
+  PATH = "targets.container_id"
+
+  def __init__(self, ids_by_container=_EMPTY_MAP, edges_by_id=_EMPTY_MAP):
+    self.ids_by_container = ids_by_container
+    self.edges_by_id = edges_by_id
+
+  @classmethod
+  def from_docs(cls, docs):
+    """Index docs (an iterable of (id, document) pairs) in one go."""
+    ids_by_container = {}
+    edges_by_id = {}
+    for doc_id, doc in docs:
+      json_class = doc.get("jsonClass", None)
+      edges = frozenset((container_id, json_class) for container_id in query_matcher.get_indexable_values(doc, ["targets", "container_id"]))
+      if edges:
+        edges_by_id[doc_id] = edges
+        for container_id, edge_json_class in edges:
+          ids_by_container.setdefault(container_id, {}).setdefault(edge_json_class, {})[doc_id] = None
+    ids_by_container = dict((container_id, _PersistentMap.from_dict(dict((json_class, _PersistentMap.from_dict(ids)) for json_class, ids in ids_by_class.items()))) for container_id, ids_by_class in ids_by_container.items())
+    return cls(ids_by_container=_PersistentMap.from_dict(ids_by_container), edges_by_id=_PersistentMap.from_dict(edges_by_id))
+
+  def with_doc(self, doc_id, doc, owned=None):
+    """:param doc: The new version of the document, or None if it is deleted.
+    :param owned: See :class:`_PersistentMap`.
+    """
+    if doc is not None and "targets" in doc:
+      json_class = doc.get("jsonClass", None)
+      new_edges = frozenset((container_id, json_class) for container_id in query_matcher.get_indexable_values(doc, ["targets", "container_id"]))
+    else:
+      new_edges = frozenset()
+    old_edges = self.edges_by_id.get(doc_id, frozenset())
+    if new_edges == old_edges:
+      return self
+    ids_by_container = self.ids_by_container
+    for container_id, json_class in old_edges - new_edges:
+      ids_by_class = ids_by_container[container_id]
+      ids = ids_by_class[json_class].discard(doc_id, owned)
+      ids_by_class = ids_by_class.set(json_class, ids, owned) if ids else ids_by_class.discard(json_class, owned)
+      ids_by_container = ids_by_container.set(container_id, ids_by_class, owned) if ids_by_class else ids_by_container.discard(container_id, owned)
+    for container_id, json_class in new_edges - old_edges:
+      ids_by_class = ids_by_container.get(container_id, _EMPTY_MAP)
+      ids_by_class = ids_by_class.set(json_class, ids_by_class.get(json_class, _EMPTY_MAP).set(doc_id, None, owned), owned)
+      ids_by_container = ids_by_container.set(container_id, ids_by_class, owned)
+    edges_by_id = self.edges_by_id.set(doc_id, new_edges, owned) if new_edges else self.edges_by_id.discard(doc_id, owned)
+    return _TargetIndex(ids_by_container=ids_by_container, edges_by_id=edges_by_id)
+
+  def get_ids(self, container_ids, json_classes=None):
+    ids = {}
+    for container_id in container_ids:
+      ids_by_class = self.ids_by_container.get(container_id, _EMPTY_MAP)
+      for json_class in (ids_by_class if json_classes is None else json_classes):
+        ids.update(dict.fromkeys(ids_by_class.get(json_class, _EMPTY_MAP)))
+    return ids
+
+
+class _Version(object):
+  """An immutable state of an :class:`InMemoryDb` - its documents and indexes."""
+
+  def __init__(self, entries=_EMPTY_MAP, order=_EMPTY_VECTOR, indexes=None, target_index=None):
+    """
+
+    :param entries: Maps document ids to (position in order, document) pairs.
+    :param order: The documents in the order they were first written - with None in the places of deleted ones.
+    """
+    self.entries = entries
+    self.order = order
+    self.indexes = indexes if indexes is not None else {}
+    self.target_index = target_index if target_index is not None else _TargetIndex()
+
+  @classmethod
+  def from_dict(cls, docs, indexes=None, target_index=None):
+    """A version with docs (a dict from ids to documents, in the order they were first written)."""
+    if target_index is None:
+      target_index = _TargetIndex.from_docs(docs=docs.items())
+    entries = _PersistentMap.from_dict(dict((doc_id, (position, doc)) for position, (doc_id, doc) in enumerate(docs.items())))
+    return cls(entries=entries, order=_PersistentVector.from_list(list(docs.values())), indexes=indexes, target_index=target_index)
+
+  @property
+  def docs(self):
+    return _DocsView(self)
+
+  def with_doc(self, doc_id, doc, owned=None):
+    """:param doc: The new version of the document, or None if it is deleted.
+    :param owned: See :class:`_PersistentMap`.
+    """
+    entry = self.entries.get(doc_id, None)
+    if doc is None:
+      entries = self.entries.discard(doc_id, owned)
+      order = self.order.set(entry[0], None, owned) if entry is not None else self.order
+    elif entry is None:
+      entries = self.entries.set(doc_id, (len(self.order), doc), owned)
+      order = self.order.append(doc, owned)
+    else:
+      entries = self.entries.set(doc_id, (entry[0], doc), owned)
+      order = self.order.set(entry[0], doc, owned)
+    indexes = dict((name, index.with_doc(doc_id=doc_id, doc=doc, owned=owned)) for name, index in self.indexes.items())
+    return _Version(entries=entries, order=order, indexes=indexes, target_index=self.target_index.with_doc(doc_id=doc_id, doc=doc, owned=owned))
+
+  def with_indexes(self, indexes):
+    return _Version(entries=self.entries, order=self.order, indexes=indexes, target_index=self.target_index)
+
+  def without_gaps(self):
+    """:return: This version - or, if most places in order are those of deleted documents, an equivalent version without them."""
+    num_gaps = len(self.order) - len(self.entries)
+    if num_gaps <= max(len(self.entries), _MAX_ORDER_GAPS):
+      return self
+    return _Version.from_dict(dict((doc_id, self.entries[doc_id][1]) for doc_id in self.docs), indexes=self.indexes, target_index=self.target_index)
+
+  def sort_ids(self, ids):
+    """:return: A list of ids (of documents in this version), in the order the documents were first written."""
+    entries = self.entries
+    return sorted(ids, key=lambda doc_id: entries[doc_id][0])
+
+  def get_ordered_docs(self):
+    return (doc for doc in self.order if doc is not None)
+
+
+class _DocsView(Mapping):
+  """A read only mapping from the ids of documents in a :class:`_Version` to the documents. Like a dict, it iterates in the order the documents were first written."""
+  __slots__ = ("version",)
+
+  def __init__(self, version):
+    self.version = version
+
+  def __len__(self):
+    return len(self.version.entries)
+
+  def __contains__(self, key):
+    return key in self.version.entries
+
+  def __getitem__(self, key):
+    return self.version.entries[key][1]
+
+  def get(self, key, default=None):
+    entry = self.version.entries.get(key, None)
+    return default if entry is None else entry[1]
+
+  def __iter__(self):
+    for doc in self.version.get_ordered_docs():
+      yield doc["_id"]
 
 
 class InMemoryDb(DbInterface):
-  def __init__(self, db_name_frontend, external_file_store=None):
+  def __init__(self, db_name_frontend, external_file_store=None, log_dir=None, sync_writes=True, compact_after_records=100000):
+    """
+
+    :param log_dir: If not None, writes are logged to (and the state is loaded from) this directory.
+    :param sync_writes: With log_dir, whether to fsync the log before writes return.
+    :param compact_after_records: With log_dir, a snapshot is written (in a background thread) once the log grows by these many records.
+    """
     super(InMemoryDb, self).__init__(external_file_store=external_file_store, db_name_frontend=db_name_frontend)
-    self.db = {}
+    self._version = _Version()
+    # Serializes writers. Readers just pick up the current self._version.
+    self._write_lock = threading.Lock()
+    self.log = None
+    self.compact_after_records = compact_after_records
+    self.compaction_thread = None
+    if log_dir is not None:
+      from sanskrit_data.db.write_ahead_log import WriteAheadLog
+      self.log = WriteAheadLog(log_dir=log_dir, sync=sync_writes)
+      with _gc_paused():
+        docs = self.log.load()
+        self._version = _Version.from_dict(docs)
+
+  @property
+  def db(self):
+    """A read only :class:`~collections.abc.Mapping` from ids to documents, as of now - iterating in the order they were first written, like a dict. The documents themselves must not be modified."""
+    return self._version.docs
+
+  @property
+  def indexes(self):
+    return self._version.indexes
+
+  @property
+  def target_index(self):
+    return self._version.target_index
 
   # noinspection PyShadowingBuiltins
   def find_by_id(self, id):
-    return self.db.get(id, None)
+    entry = self._version.entries.get(id, None)
+    return _copy_json(entry[1]) if entry is not None else None
+
+  def find_by_ids(self, ids):
+    entries = self._version.entries
+    return [_copy_json(entries.get(doc_id, (None, None))[1]) for doc_id in ids]
+
+  @staticmethod
+  def _get_indexed_ids(version, path, values):
+    """Ids of documents having one of values at path, or None if that can't be looked up in an index."""
+    for index in version.indexes.values():
+      if index.path == path:
+        ids = {}
+        for value in values:
+          ids.update(dict.fromkeys(index.get_ids(value)))
+        return ids
+    return None
+
+  def _get_candidate_ids(self, find_filter, version=None):
+    """Use indexes to narrow down the documents which could match find_filter.
+
+    :param version: The :class:`_Version` to look in - the current one by default.
+    :return: A (possibly over-inclusive) list of ids, in the order the documents were first written - or None if all documents need to be scanned.
+    """
+    version = version or self._version
+    clause_values = query_matcher.get_indexable_clause_values(find_filter)
+    candidate_id_sets = []
+    if _TargetIndex.PATH in clause_values:
+      candidate_id_sets.append(version.target_index.get_ids(container_ids=clause_values.pop(_TargetIndex.PATH), json_classes=clause_values.pop("jsonClass", None)))
+    for path, values in clause_values.items():
+      ids = self._get_indexed_ids(version=version, path=path, values=values)
+      if ids is not None:
+        candidate_id_sets.append(ids)
+    if not candidate_id_sets:
+      return None
+    candidate_id_sets.sort(key=len)
+    return version.sort_ids(doc_id for doc_id in candidate_id_sets[0] if all(doc_id in ids for ids in candidate_id_sets[1:]))
 
   def find(self, find_filter):
-    for index, key in enumerate(self.db):
-      if JsonObject.make_from_dict(self.db[key]).match_filter(find_filter=find_filter):
-          yield self.db[key]
+    # Not a generator function itself, so that the snapshot is taken right away, rather than when the results are first consumed.
+    version = self._version
+    matches = query_matcher.compile_filter(find_filter)
+    candidate_ids = self._get_candidate_ids(find_filter=find_filter, version=version)
+    return self._find_in_version(version=version, candidate_ids=candidate_ids, matches=matches)
+
+  @staticmethod
+  def _find_in_version(version, candidate_ids, matches):
+    if candidate_ids is None:
+      docs = version.get_ordered_docs()
+    else:
+      docs = (version.entries[doc_id][1] for doc_id in candidate_ids)
+    for doc in docs:
+      if doc is not None and matches(doc):
+        yield _copy_json(doc)
 
   def update_doc(self, doc):
-    if not "_id" in doc:
-      doc["_id"] = get_random_string(8)
-    self.db[doc["_id"]] = doc
-    return doc
+    return self.update_docs(docs=[doc])[0]
+
+  def update_docs(self, docs):
+    """Atomically write docs - concurrent readers see either all or none of them. _id-s are set in (the given) docs which lack them."""
+    docs = list(docs)
+    for doc in docs:
+      if not "_id" in doc:
+        doc["_id"] = get_random_string(8)
+    stored_docs = [_copy_json(doc) for doc in docs]
+    docs_json = json.dumps(stored_docs, ensure_ascii=False) if self.log is not None else None
+    with self._write_lock:
+      version = self._version
+      owned = {} if len(stored_docs) > 1 else None
+      for doc in stored_docs:
+        version = version.with_doc(doc_id=doc["_id"], doc=doc, owned=owned)
+      self._version = version
+      sequence_number = self.log.append(updated_docs_json=docs_json) if self.log is not None else None
+    self._wait_until_logged(sequence_number=sequence_number)
+    self.notify_written(doc_ids=[doc["_id"] for doc in docs])
+    return docs
 
   def delete_doc(self, doc_id):
-    self.db.pop(doc_id)
+    self.delete_docs(doc_ids=[doc_id])
+
+  def delete_docs(self, doc_ids):
+    """Atomically delete documents. Raises KeyError (deleting nothing) if any of them is absent."""
+    doc_ids = list(doc_ids)
+    with self._write_lock:
+      version = self._version
+      owned = {} if len(doc_ids) > 1 else None
+      for doc_id in doc_ids:
+        if doc_id not in version.entries:
+          raise KeyError(doc_id)
+        version = version.with_doc(doc_id=doc_id, doc=None, owned=owned)
+      self._version = version.without_gaps()
+      sequence_number = self.log.append(deleted_ids=doc_ids) if self.log is not None else None
+    self._wait_until_logged(sequence_number=sequence_number)
+    self.notify_written(doc_ids=doc_ids)
+
+  def _wait_until_logged(self, sequence_number):
+    """Wait until a write is durable (sharing disk syncs with concurrent writers), and start a compaction if the log has grown enough."""
+    if self.log is None:
+      return
+    self.log.wait_until_durable(sequence_number=sequence_number)
+    if self.log.num_records_since_snapshot >= self.compact_after_records and not self.log.is_compacting:
+      compaction_thread = threading.Thread(target=self.compact_log, kwargs={"wait": False}, name="InMemoryDb.compact_log", daemon=True)
+      compaction_thread.start()
+      self.compaction_thread = compaction_thread
+
+  def compact_log(self, wait=True):
+    """Write a snapshot of the current state, and drop the log records it covers. Writes may continue meanwhile.
+
+    :param wait: If a compaction is in progress, whether to wait for it and then compact (rather than return right away).
+    """
+    while True:
+      if wait:
+        self.log.wait_for_compaction()
+      with self._write_lock:
+        version = self._version
+        sequence_number = self.log.start_compaction()
+      if sequence_number is not None or not wait:
+        break
+    if sequence_number is not None:
+      # In order, so that the order of find results survives reloading.
+      self.log.finish_compaction(docs=version.get_ordered_docs(), sequence_number=sequence_number)
+
+  def close(self):
+    """Close the log, if any - after waiting for any compaction in progress."""
+    if self.log is not None:
+      compaction_thread = self.compaction_thread
+      if compaction_thread is not None:
+        compaction_thread.join()
+      self.log.close()
+
+  def add_index(self, keys_dict, index_name):
+    """Index documents by the values at the first key in keys_dict.
+
+    Only equality lookups are served by the index, so compound indexes are only indexed by their leading field; other fields are checked while filtering. targets.container_id is always indexed (in target_index).
+    """
+    path = next(iter(keys_dict))
+    with self._write_lock:
+      version = self._version
+      if index_name in version.indexes or path == _TargetIndex.PATH:
+        return
+      with _gc_paused():
+        index = _HashIndex.from_docs(path=path, docs=version.docs.items())
+      indexes = dict(version.indexes)
+      indexes[index_name] = index
+      self._version = version.with_indexes(indexes)
+
+  def update_index(self, name, fields, upsert=False):
+    if upsert:
+      with self._write_lock:
+        version = self._version
+        indexes = dict((index_name, index) for index_name, index in version.indexes.items() if index_name != name)
+        self._version = version.with_indexes(indexes)
+    self.add_index(keys_dict=dict((field, 1) for field in fields), index_name=name)
 
 
 class BookPortionsInMemory(InMemoryDb, ullekhanam_db.BookPortionsInterface):
-    def __init__(self, db_name_frontend, external_file_store=None):
+    def __init__(self, db_name_frontend, external_file_store=None, **kwargs):
         super(BookPortionsInMemory, self).__init__(db_name_frontend=db_name_frontend,
-                                                   external_file_store=external_file_store)
+                                                   external_file_store=external_file_store, **kwargs)
+        from sanskrit_data.schema import books, ullekhanam
+        books.BookPortion.add_indexes(db_interface=self)
+        ullekhanam.TextAnnotation.add_indexes(db_interface=self)
 
 
 class UsersInMemory(InMemoryDb, users_db.UsersInterface):
-    def __init__(self, db_name_frontend, external_file_store=None):
+    def __init__(self, db_name_frontend, external_file_store=None, **kwargs):
         super(UsersInMemory, self).__init__(db_name_frontend=db_name_frontend,
-                                                   external_file_store=external_file_store)
+                                                   external_file_store=external_file_store, **kwargs)
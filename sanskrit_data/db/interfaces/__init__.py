@@ -1,5 +1,6 @@
 import logging
 import string
+import threading
 
 logging.basicConfig(
   level=logging.DEBUG,
@@ -41,6 +42,9 @@ class ClientInterface(object):
     pass
 
 
+_file_handle_pool_lock = threading.Lock()
+
+
 class DbInterface(object):
   """A common interface to a database.
 
@@ -51,6 +55,21 @@ class DbInterface(object):
     self.db_name_frontend = db_name_frontend
     self.external_file_store = external_file_store
     self.init_external_file_store()
+    #: Functions called with lists of ids of documents written (updated or deleted) through this interface.
+    self.write_listeners = []
+    self._thread_state = threading.local()
+
+  def notify_written(self, doc_ids):
+    """Implementations call this after writing (updating or deleting) documents."""
+    for listener in list(self.write_listeners):
+      listener(doc_ids)
+
+  def get_identity_map(self):
+    """The :class:`~sanskrit_data.db.identity_map.IdentityMap` in use with this interface in the current thread, if any."""
+    return getattr(self._thread_state, "identity_map", None)
+
+  def set_identity_map(self, identity_map):
+    self._thread_state.identity_map = identity_map
 
   def init_external_file_store(self):
     # Add filestores for use with the DB.
@@ -59,6 +78,47 @@ class DbInterface(object):
       import os
       # noinspection PyArgumentList
       os.makedirs(name=self.external_file_store, exist_ok=True)
+    from sanskrit_data.db import blob_store
+    #: A :class:`~sanskrit_data.db.blob_store.BlobStore` if external_file_store has the content-addressed layout, else None.
+    self.blob_store = blob_store.BlobStore.get_if_present(root_dir=self.external_file_store)
+    #: A :class:`~sanskrit_data.db.file_listing_cache.FileListingCache`, if in use - see :meth:`use_file_listing_cache`.
+    self.file_listing_cache = None
+    self._file_handle_pool = None
+
+  def use_blob_store(self):
+    """Switch external_file_store to the content-addressed layout - see :py:mod:`~sanskrit_data.db.blob_store`.
+
+    :return: The :class:`~sanskrit_data.db.blob_store.BlobStore`.
+    """
+    if self.external_file_store is None:
+      raise ValueError("No external_file_store to use a blob store in.")
+    from sanskrit_data.db import blob_store
+    self.blob_store = blob_store.BlobStore.create(root_dir=self.external_file_store)
+    return self.blob_store
+
+  def use_file_listing_cache(self, check_mtime=True):
+    """Cache listings of external_file_store directories in this process - see :py:mod:`~sanskrit_data.db.file_listing_cache`.
+
+    :param check_mtime: Whether to notice changes made to the store other than through this library (or this interface), at the cost of a stat call per listing.
+    :return: The :class:`~sanskrit_data.db.file_listing_cache.FileListingCache`.
+    """
+    if self.external_file_store is None:
+      raise ValueError("No external_file_store to cache listings of.")
+    from sanskrit_data.db import file_listing_cache
+    self.file_listing_cache = file_listing_cache.FileListingCache(root_dir=self.external_file_store, check_mtime=check_mtime)
+    return self.file_listing_cache
+
+  def get_file_handle_pool(self, max_open_files=64):
+    """The :class:`~sanskrit_data.db.file_handle_pool.FileHandlePool` through which files in external_file_store are read (see :meth:`~sanskrit_data.schema.common.JsonObject.open_file_view`).
+
+    :param max_open_files: Used when the pool is first created.
+    """
+    if self._file_handle_pool is None:
+      from sanskrit_data.db import file_handle_pool
+      with _file_handle_pool_lock:
+        if self._file_handle_pool is None:
+          self._file_handle_pool = file_handle_pool.FileHandlePool(max_open_files=max_open_files)
+    return self._file_handle_pool
 
   def update_doc(self, doc):
     """ Update or insert a json object, represented as a dict.
@@ -81,6 +141,27 @@ class DbInterface(object):
     """
     pass
 
+  def update_docs(self, docs):
+    """ Update or insert several json objects, represented as dicts.
+
+    Backends override this to write in a single batch (and transaction, where possible). The default just calls :meth:`update_doc` for each doc.
+
+    :param list docs: As with :meth:`update_doc`. These could be modified.
+    :return: List of updated dicts with _id set, in the same order.
+    """
+    return [self.update_doc(doc) for doc in docs]
+
+  def delete_docs(self, doc_ids):
+    """ Delete several documents - see :meth:`delete_doc`.
+
+    Backends override this to delete in a single batch (and transaction, where possible).
+
+    :param list doc_ids:
+    :return: Not used.
+    """
+    for doc_id in doc_ids:
+      self.delete_doc(doc_id)
+
   # noinspection PyShadowingBuiltins
   def find_by_id(self, id):
     """
@@ -90,6 +171,16 @@ class DbInterface(object):
     """
     pass
 
+  def find_by_ids(self, ids):
+    """ Get several documents by id - see :meth:`find_by_id`.
+
+    Backends override this to look the documents up in a single batch.
+
+    :param list ids:
+    :return: A list with, for each id, None if nothing is found, else a python dict representing a JSON object.
+    """
+    return [self.find_by_id(id=doc_id) for doc_id in ids]
+
   def find(self, find_filter):
     """ Find matching objects from the database.
 
@@ -112,15 +203,93 @@ class DbInterface(object):
     """Create or update (if upsert=True) an index over certain fields, with a given name."""
     pass
 
-  def add_index(self, keys_json, index_name):
+  def add_index(self, keys_dict, index_name):
     """Index the database using certain fields.
 
     :param index_name:
-    :param keys_json: A document that contains the field and value pairs where the field is the index key and the value describes the type of index for that field. For an ascending index on a field, specify a value of 1; for descending index, specify a value of -1.
+    :param keys_dict: A document that contains the field and value pairs where the field is the index key and the value describes the type of index for that field. For an ascending index on a field, specify a value of 1; for descending index, specify a value of -1.
     """
     pass
 
 
+class AsyncDbInterface(object):
+  """An asyncio counterpart of :class:`DbInterface`, for use from within event loops (eg. by web services).
+
+  The methods mirror those of :class:`DbInterface`, but are coroutines - except :meth:`find`, which is an async generator (to be used with `async for`). :class:`~sanskrit_data.db.async_adapter.ThreadPoolAsyncDb` adapts any DbInterface to this interface.
+  """
+
+  def __init__(self, db_name_frontend, external_file_store):
+    self.db_name_frontend = db_name_frontend
+    self.external_file_store = external_file_store
+
+  def get_identity_map(self):
+    """Identity maps are per-thread, and so are not used with async interfaces."""
+    return None
+
+  async def run_with_sync_interface(self, fn):
+    """Run fn with a (synchronous) :class:`DbInterface` to the same database, without blocking the event loop.
+
+    This serves code which is only available in synchronous form - like the validation done by :py:meth:`~sanskrit_data.schema.common.JsonObject.prepare_for_update`.
+
+    :param fn: A function taking a DbInterface.
+    :return: Whatever fn returns.
+    """
+    pass
+
+  async def update_doc(self, doc):
+    """See :meth:`DbInterface.update_doc`."""
+    pass
+
+  async def delete_doc(self, doc_id):
+    """See :meth:`DbInterface.delete_doc`."""
+    pass
+
+  async def update_docs(self, docs):
+    """See :meth:`DbInterface.update_docs`."""
+    return [await self.update_doc(doc) for doc in docs]
+
+  async def delete_docs(self, doc_ids):
+    """See :meth:`DbInterface.delete_docs`."""
+    for doc_id in doc_ids:
+      await self.delete_doc(doc_id)
+
+  # noinspection PyShadowingBuiltins
+  async def find_by_id(self, id):
+    """See :meth:`DbInterface.find_by_id`."""
+    pass
+
+  async def find_by_ids(self, ids):
+    """See :meth:`DbInterface.find_by_ids`."""
+    return [await self.find_by_id(id=doc_id) for doc_id in ids]
+
+  async def find(self, find_filter):
+    """ Find matching objects from the database - see :meth:`DbInterface.find`.
+
+    Should be an async generator: ie it should use the yield keyword.
+    """
+    return
+    # noinspection PyUnreachableCode
+    yield
+
+  async def find_one(self, find_filter):
+    """See :meth:`DbInterface.find_one`."""
+    results = self.find(find_filter=find_filter)
+    try:
+      async for doc in results:
+        return doc
+      return None
+    finally:
+      await results.aclose()
+
+  async def update_index(self, name, fields, upsert=False):
+    """See :meth:`DbInterface.update_index`."""
+    pass
+
+  async def add_index(self, keys_dict, index_name):
+    """See :meth:`DbInterface.add_index`."""
+    pass
+
+
 def get_random_string(length):
   letters = string.ascii_lowercase
   import random
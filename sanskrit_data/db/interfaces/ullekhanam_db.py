@@ -1,4 +1,10 @@
+import collections
+import glob
+import itertools
 import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from sanskrit_data.db.interfaces import DbInterface
 from sanskrit_data.schema import books, ullekhanam
@@ -30,41 +36,399 @@ def run_command(cmd):
     raise e
 
 
+def _set_container(obj, container_id):
+  """Make obj target container_id - as in JsonObjectNode._set_updated_contents."""
+  if getattr(obj, "targets", None) is None or len(obj.targets) == 0:
+    obj.targets = [obj.target_class()]
+  assert len(obj.targets) == 1
+  obj.targets[0].container_id = str(container_id)
+
+
+def _parse_book(book_json_path):
+  """Parse and validate a book.json file (without database access) - in a worker process of :meth:`BookPortionsInterface.import_all`.
+
+  :return: A tuple: the (node path, content JSON map) pairs, ordered by depth (None in case of failure); an error message (or None); and the seconds taken.
+  """
+  from sanskrit_data import json_stream_helper
+  start_time = time.perf_counter()
+  try:
+    source = common.DataSource.from_details(source_type="system_inferred", id="book_importer")
+    contents = {}
+    with open(book_json_path, "rb") as fhandle:
+      for node_path, content in json_stream_helper.iter_node_contents(fhandle=fhandle):
+        obj = common.JsonObject.make_from_dict(input_dict=content)
+        obj.source = source
+        contents[node_path] = obj
+    node_paths = sorted(contents, key=lambda node_path: (len(node_path), node_path))
+    for node_path in node_paths:
+      obj = contents[node_path]
+      if node_path:
+        parent = contents[node_path[:-1]]
+        if not common.check_class(parent, obj.get_allowed_target_classes()):
+          raise common.TargetValidationError(targeting_obj=obj, allowed_types=obj.get_allowed_target_classes(), target_obj=parent)
+        # The actual container id is set when writing, in case the parent has no _id yet.
+        _set_container(obj=obj, container_id=getattr(parent, "_id", ""))
+      obj.validate_schema()
+    return [(node_path, contents[node_path].to_json_map()) for node_path in node_paths], None, time.perf_counter() - start_time
+  except Exception as e:
+    return None, "%s: %s" % (e.__class__.__name__, e), time.perf_counter() - start_time
+
+
+class ImportStats(object):
+  """What :meth:`BookPortionsInterface.import_all` did."""
+
+  def __init__(self):
+    self.num_books = 0
+    self.num_nodes = 0
+    self.num_annotations = 0
+    #: Number of books skipped as they had not changed since they were last imported.
+    self.num_unchanged = 0
+    #: Maps the book.json paths of books which could not be imported to error messages.
+    self.failures = {}
+    #: Time spent parsing and validating (summed over worker processes, if any).
+    self.parse_seconds = 0.0
+    self.write_seconds = 0.0
+    self.total_seconds = 0.0
+
+  def __repr__(self):
+    return "%d books (%d nodes, %d annotations), %d unchanged, %d failures; parsing: %.2f s, writing: %.2f s, total: %.2f s" % (
+      self.num_books, self.num_nodes, self.num_annotations, self.num_unchanged, len(self.failures), self.parse_seconds, self.write_seconds, self.total_seconds)
+
+
 class BookPortionsInterface(DbInterface):
   """Operations on BookPortion objects in an Db"""
 
-  def import_all(self, rootdir):
+  def import_all(self, rootdir, num_workers=None, batch_size=1000, incremental=False):
+    """Import books dumped by :meth:`dump_books` - each from a book.json file in a sub-directory of rootdir, along with the annotations in an adjoining annotations.jsonl file (if any).
+
+    A book which fails to import is recorded in the returned stats, and skipped - though it may have been partly written.
+
+    :param num_workers: If more than 1, book.json files are parsed and schema-validated in a pool of so many processes, while this process writes the parsed books (level by level, in batches). Otherwise, each book is streamed into the database by :meth:`import_book`.
+    :param batch_size: The maximum number of nodes per :meth:`~sanskrit_data.db.interfaces.DbInterface.update_docs` call.
+    :param incremental: Whether to skip books whose files have not changed since they were last imported into this database - as recorded in an :class:`~sanskrit_data.db.import_manifest.ImportManifest` at :meth:`get_import_manifest_path`, to which each book is added once written. Documents of a changed book which are no longer in its files are deleted (with their files). An interrupted incremental import, re-run, thus resumes after the last written book - and as the root of each book is recorded before its descendants are written, documents of a book left partly written are deleted when it is imported again.
+    :return: An :class:`ImportStats` object.
+    """
     logging.info("Importing books into database from " + rootdir)
-    nbooks = 0
-    import glob
-    import os
-    for f in glob.glob(os.path.join(rootdir, "*/book.json")):
-      logging.info("    " + f)
-      book_portion_node = common.JsonObject.read_from_file(f)
-      book_portion_node.setup_source(source=common.DataSource.from_details(source_type="system_inferred", id="book_importer"))
-      logging.debug("Importing afresh! %s " % f)
-      from jsonschema import ValidationError
+    from sanskrit_data.db import import_manifest
+    stats = ImportStats()
+    start_time = time.perf_counter()
+    manifest = import_manifest.ImportManifest(manifest_path=self.get_import_manifest_path()) if incremental else None
+
+    def get_book_files(book_json_path):
+      annotations_path = os.path.join(os.path.dirname(book_json_path), "annotations.jsonl")
+      return [book_json_path, annotations_path] if os.path.exists(annotations_path) else [book_json_path]
+
+    # (book.json path, content hash) pairs of the books to be imported.
+    books_to_import = []
+    for book_json_path in sorted(glob.glob(os.path.join(rootdir, "*/book.json"))):
+      content_hash = None
+      if manifest is not None:
+        content_hash = import_manifest.hash_files(get_book_files(book_json_path))
+        entry = manifest.get(book_json_path)
+        # The root's presence guards against manifests which don't describe this database.
+        if entry is not None and entry["hash"] == content_hash and len(entry["ids"]) > 0 and self.find_by_id(entry["ids"][0]) is not None:
+          stats.num_unchanged += 1
+          continue
+      books_to_import.append((book_json_path, content_hash))
+
+    def record_failure(book_json_path, message):
+      logging.error("Could not import %s: %s", book_json_path, message)
+      stats.failures[book_json_path] = message
+
+    def finish_book(book_json_path, content_hash, doc_ids):
+      """Import the annotations of a book whose BookPortions have been written, and note it in the manifest."""
+      for annotations_path in get_book_files(book_json_path)[1:]:
+        stats.num_annotations += self.import_annotations(jsonl_path=annotations_path, doc_ids=doc_ids)
+      if manifest is not None:
+        entry = manifest.get(book_json_path)
+        if entry is not None:
+          self._delete_stale_docs(doc_ids=entry["ids"], root_ids=entry.get("pending_root_ids", []), written_ids=set(doc_ids))
+        manifest.record(path=book_json_path, content_hash=content_hash, doc_ids=doc_ids)
+      stats.num_books += 1
+
+    def get_root_callback(book_json_path):
+      if manifest is None:
+        return None
+      return lambda root_id: manifest.record_pending(path=book_json_path, root_id=root_id)
+
+    def write_parsed_book(book_json_path, content_hash, future):
+      nodes, error_message, parse_seconds = future.result()
+      stats.parse_seconds += parse_seconds
+      if error_message is not None:
+        record_failure(book_json_path, error_message)
+        return
+      write_start_time = time.perf_counter()
+      try:
+        doc_ids = []
+        stats.num_nodes += self._write_parsed_book(nodes=nodes, batch_size=batch_size, doc_ids=doc_ids, on_root_written=get_root_callback(book_json_path))
+        finish_book(book_json_path=book_json_path, content_hash=content_hash, doc_ids=doc_ids)
+      except Exception as e:
+        record_failure(book_json_path, "%s: %s" % (e.__class__.__name__, e))
+      stats.write_seconds += time.perf_counter() - write_start_time
+
+    try:
+      if num_workers is not None and num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+          # Parse a few books ahead of writing - but not all, lest parsed books pile up in memory.
+          pending = collections.deque()
+          for book_json_path, content_hash in books_to_import:
+            pending.append((book_json_path, content_hash, executor.submit(_parse_book, book_json_path)))
+            if len(pending) >= 2 * num_workers:
+              write_parsed_book(*pending.popleft())
+          while pending:
+            write_parsed_book(*pending.popleft())
+      else:
+        for book_json_path, content_hash in books_to_import:
+          logging.info("    " + book_json_path)
+          try:
+            doc_ids = []
+            stats.num_nodes += self.import_book(book_json_path=book_json_path, batch_size=batch_size, stats=stats, doc_ids=doc_ids, on_root_written=get_root_callback(book_json_path))
+            write_start_time = time.perf_counter()
+            finish_book(book_json_path=book_json_path, content_hash=content_hash, doc_ids=doc_ids)
+            stats.write_seconds += time.perf_counter() - write_start_time
+          except Exception as e:
+            record_failure(book_json_path, "%s: %s" % (e.__class__.__name__, e))
+    finally:
+      if manifest is not None:
+        manifest.compact()
+        manifest.close()
+    stats.total_seconds = time.perf_counter() - start_time
+    logging.info("Imported from %s: %s", rootdir, stats)
+    return stats
+
+  def get_import_manifest_path(self):
+    """Where incremental imports (see :meth:`import_all`) keep their manifest: next to the external_file_store directory."""
+    if self.external_file_store is None:
+      raise ValueError("Incremental imports need an external_file_store, next to which the import manifest is kept.")
+    return os.path.normpath(self.external_file_store) + ".import_manifest.jsonl"
+
+  def _delete_stale_docs(self, doc_ids, root_ids, written_ids):
+    """Delete documents of a book, left by an earlier import, which have not been written again - along with their files.
+
+    :param doc_ids: _id-s of documents of the book.
+    :param root_ids: _id-s of the roots of (possibly partly written) trees of the book's documents - deleted along with the entities targetting them, recursively.
+    :param written_ids: A set of _id-s of documents not to be deleted.
+    """
+    stale_objects = {}
+    for doc in self.find_by_ids(ids=[doc_id for doc_id in doc_ids if doc_id not in written_ids]):
+      if doc is not None:
+        stale_objects[doc["_id"]] = common.JsonObject.make_from_dict(input_dict=doc)
+    for root in self.find_by_ids(ids=[root_id for root_id in root_ids if root_id not in written_ids]):
+      if root is not None:
+        node = common.JsonObjectNode.from_details(content=common.JsonObject.make_from_dict(input_dict=root))
+        node.fill_descendents(db_interface=self, depth=None)
+        for content in node.get_contents_post_order():
+          if content._id not in written_ids:
+            stale_objects[content._id] = content
+    if len(stale_objects) == 0:
+      return
+    logging.info("Deleting %d stale documents", len(stale_objects))
+    self.delete_docs(doc_ids=list(stale_objects))
+    for obj in stale_objects.values():
+      obj.delete_files(db_interface=self)
+
+  def _write_parsed_book(self, nodes, batch_size, doc_ids=None, on_root_written=None):
+    """Write the nodes got from :func:`_parse_book`, level by level.
+
+    All nodes are written via :meth:`~sanskrit_data.schema.common.JsonObject.update_collection_in_bulk`, and so validated against the database - nodes with _id-s may overwrite existing documents.
+
+    :param doc_ids: If given, the _id-s of the written documents are appended to it.
+    :param on_root_written: If given, called with the _id of the root once it is written - before the other nodes are.
+    :return: The number of nodes written.
+    """
+    root_path, root_map = nodes[0]
+    assert root_path == ()
+    written_ids = {(): common.JsonObject.make_from_dict(input_dict=root_map).update_collection(db_interface=self)._id}
+    if doc_ids is not None:
+      doc_ids.append(written_ids[()])
+    if on_root_written is not None:
+      on_root_written(written_ids[()])
+    level_start = 1
+    while level_start < len(nodes):
+      depth = len(nodes[level_start][0])
+      level_end = level_start
+      while level_end < len(nodes) and len(nodes[level_end][0]) == depth:
+        level_end += 1
+      level_ids = {}
+      for batch_start in range(level_start, level_end, batch_size):
+        batch = nodes[batch_start:min(batch_start + batch_size, level_end)]
+        for node_path, json_map in batch:
+          json_map["targets"][0]["container_id"] = str(written_ids[node_path[:-1]])
+        objects = [common.JsonObject.make_from_dict(input_dict=json_map) for _, json_map in batch]
+        for (node_path, _), updated_content in zip(batch, common.JsonObject.update_collection_in_bulk(objects=objects, db_interface=self)):
+          level_ids[node_path] = updated_content._id
+      if doc_ids is not None:
+        doc_ids.extend(level_ids.values())
+      written_ids = level_ids
+      level_start = level_end
+    return len(nodes)
+
+  def import_book(self, book_json_path, batch_size=1000, stats=None, doc_ids=None, on_root_written=None):
+    """Import a (JSON serialized) JsonObjectNode tree of BookPortions, writing nodes in batches while the file is being parsed (see :func:`~sanskrit_data.json_stream_helper.iter_node_contents`).
+
+    Nodes are written after their parents, targetting them. Memory use is bounded if each node's content precedes its children in the file (as in files written by :meth:`~sanskrit_data.schema.books.BookPortion.dump_book_portion`); otherwise nodes are held until their parents are written.
+
+    :param ImportStats stats: If given, the time spent writing and parsing is added to it.
+    :param doc_ids: If given, the _id-s of the written documents are appended to it.
+    :param on_root_written: If given, called with the _id of the root once it is written - before the other nodes are.
+    :return: The number of nodes written.
+    """
+    from sanskrit_data import json_stream_helper
+    start_time = time.perf_counter()
+    source = common.DataSource.from_details(source_type="system_inferred", id="book_importer")
+    # Written _id-s of the nodes which may yet get children (by node path).
+    written_ids = {}
+    # Nodes waiting for their parents to be written (by parent node path).
+    waiting_nodes = {}
+    # Nodes whose parents have been written.
+    ready_nodes = collections.deque()
+    batch = []
+    batch_paths = set()
+    state = {"last_path": (), "num_written": 0, "write_seconds": 0.0}
+
+    def write_batch():
+      write_start_time = time.perf_counter()
+      updated_contents = common.JsonObject.update_collection_in_bulk(objects=[obj for _, obj in batch], db_interface=self)
+      written_paths = [node_path for node_path, _ in batch]
+      del batch[:]
+      batch_paths.clear()
+      state["num_written"] += len(written_paths)
+      for node_path, updated_content in zip(written_paths, updated_contents):
+        written_ids[node_path] = updated_content._id
+        if doc_ids is not None:
+          doc_ids.append(updated_content._id)
+        if node_path == () and on_root_written is not None:
+          on_root_written(updated_content._id)
+        for child_path, child in waiting_nodes.pop(node_path, []):
+          _set_container(obj=child, container_id=updated_content._id)
+          ready_nodes.append((child_path, child))
+      # Nodes which are not ancestors of the latest parsed one can get no more children.
+      last_path = state["last_path"]
+      for node_path in list(written_ids):
+        if node_path != last_path[:len(node_path)]:
+          del written_ids[node_path]
+      state["write_seconds"] += time.perf_counter() - write_start_time
+
+    def add_ready_nodes():
+      while ready_nodes:
+        node_path, obj = ready_nodes.popleft()
+        batch.append((node_path, obj))
+        batch_paths.add(node_path)
+        if len(batch) >= batch_size:
+          write_batch()
+
+    with open(book_json_path, "rb") as fhandle:
+      for node_path, content in json_stream_helper.iter_node_contents(fhandle=fhandle):
+        state["last_path"] = node_path
+        obj = common.JsonObject.make_from_dict(input_dict=content)
+        obj.source = source
+        parent_path = node_path[:-1]
+        if node_path and parent_path in batch_paths:
+          write_batch()
+        if node_path and parent_path not in written_ids:
+          waiting_nodes.setdefault(parent_path, []).append((node_path, obj))
+        else:
+          if node_path:
+            _set_container(obj=obj, container_id=written_ids[parent_path])
+          ready_nodes.append((node_path, obj))
+        add_ready_nodes()
+    while batch:
+      write_batch()
+      add_ready_nodes()
+    if waiting_nodes:
+      logging.error("%s: no parents for nodes at %s", book_json_path, sorted(waiting_nodes))
+    if stats is not None:
+      stats.write_seconds += state["write_seconds"]
+      stats.parse_seconds += time.perf_counter() - start_time - state["write_seconds"]
+    logging.info("Imported %d book portions from %s", state["num_written"], book_json_path)
+    return state["num_written"]
+
+  def import_annotations(self, jsonl_path, batch_size=1000, doc_ids=None):
+    """Stream entities from a JSON Lines file (as written by :meth:`dump_annotations`) into the database, in batches.
+
+    An entity is written only after those it targets (if they are in the file at all). Invalid entities are logged and skipped.
+
+    :param doc_ids: If given, the _id-s of the written documents are appended to it.
+    :return: The number of entities written.
+    """
+    from jsonschema import ValidationError
+    written_ids = []
+    batch = []
+    batch_ids = set()
+
+    def write_batch():
       try:
-        book_portion_node.update_collection(self)
-      except ValidationError as e:
-        import traceback
-        logging.error(e)
-        logging.error(traceback.format_exc())
-      # logging.debug(str(book_portion_node))
-      nbooks = nbooks + 1
-    return nbooks
-
-  def dump_books(self, export_dir):
-    books = self.list_books()
-    for book in books:
-      book.dump_book_portion(export_dir=export_dir, db_interface=self)
+        written_ids.extend(obj._id for obj in common.JsonObject.update_collection_in_bulk(objects=batch, db_interface=self))
+      except (ValidationError, common.TargetValidationError):
+        # Find the culprits, writing the rest.
+        for obj in batch:
+          try:
+            written_ids.append(obj.update_collection(db_interface=self)._id)
+          except (ValidationError, common.TargetValidationError) as e:
+            logging.error("Skipping %s from %s: %s", getattr(obj, "_id", None), jsonl_path, e)
+      del batch[:]
+      batch_ids.clear()
+
+    for obj in common.JsonObject.iter_from_jsonl(path=jsonl_path):
+      target_ids = [getattr(target, "container_id", None) for target in (getattr(obj, "targets", None) or [])]
+      if len(batch) >= batch_size or not batch_ids.isdisjoint(target_ids):
+        write_batch()
+      batch.append(obj)
+      if getattr(obj, "_id", None) is not None:
+        batch_ids.add(obj._id)
+    if batch:
+      write_batch()
+    logging.info("Imported %d entities from %s", len(written_ids), jsonl_path)
+    if doc_ids is not None:
+      doc_ids.extend(written_ids)
+    return len(written_ids)
+
+  def dump_books(self, export_dir, dump_annotations=False, num_workers=4, incremental=False):
+    """Export each book to export_dir, in the layout of :meth:`~sanskrit_data.schema.books.BookPortion.dump_book_portion` - see :class:`~sanskrit_data.db.book_exporter.BookExporter`.
+
+    :param dump_annotations: Whether to also write the (non BookPortion) entities targetting each book's portions, transitively, to an annotations.jsonl file in its directory.
+    :param num_workers: The number of books exported concurrently (and of files copied concurrently).
+    :param incremental: Whether to skip files unchanged since the last incremental export to export_dir.
+    :return: An :class:`~sanskrit_data.db.book_exporter.ExportStats` object.
+    """
+    from sanskrit_data.db import book_exporter
+    exporter = book_exporter.BookExporter(db_interface=self, export_dir=export_dir, num_workers=num_workers, incremental=incremental, dump_annotations=dump_annotations)
+    return exporter.export(books=self.list_books())
+
+  def iter_annotation_docs(self, root_id, max_ids_per_query=100):
+    """Lazily get the docs of all entities (other than BookPortions) which target the entity with root_id (or its BookPortion descendents), transitively.
+
+    The search proceeds level by level, so an entity comes after those it targets (if it targets entities of a single level); and only the _id-s of a level are held in memory.
+    """
+    book_portion_classes = set(books.BookPortion.get_wire_typeids_including_subclasses())
+    seen_ids = set([root_id])
+    level_ids = [root_id]
+    while level_ids:
+      next_level_ids = []
+      for start in range(0, len(level_ids), max_ids_per_query):
+        find_filter = common.UllekhanamJsonObject.get_targetting_entities_filter(container_id_condition={"$in": level_ids[start:start + max_ids_per_query]})
+        for doc in self.find(find_filter=find_filter):
+          if doc["_id"] in seen_ids:
+            continue
+          seen_ids.add(doc["_id"])
+          next_level_ids.append(doc["_id"])
+          if doc.get(common.TYPE_FIELD, None) not in book_portion_classes:
+            yield doc
+      level_ids = next_level_ids
+
+  def dump_annotations(self, root_id, jsonl_path, append=False):
+    """Stream :meth:`iter_annotation_docs` to a JSON Lines file, to be read by :meth:`import_annotations`.
+
+    :return: The number of entities written.
+    """
+    return common.JsonObject.dump_to_jsonl(objects=self.iter_annotation_docs(root_id=root_id), path=jsonl_path, append=append)
 
   def list_books(self):
     """ List book objects (not chapters or pages).
 
     :return:
     """
-    return [common.JsonObject.make_from_dict(input_dict=book) for book in self.find(find_filter={"portion_class": "book"})]
+    return [common.JsonObject.make_from_db_dict(input_dict=book, db_interface=self) for book in self.find(find_filter={"portion_class": "book"})]
 
   def get(self, path):
     book = books.BookPortion.from_path(path=path, db_interface=self)
@@ -73,33 +437,118 @@ class BookPortionsInterface(DbInterface):
     return book_node
 
   def update_image_annotations(self, page, page_image):
-    """return the page annotation with id = anno_id"""
-    known_annotations = page.get_targetting_entities(db_interface=self,
-                                                     entity_type=ullekhanam.ImageAnnotation.get_wire_typeid())
-    if len(known_annotations):
-      logging.warning("Annotations exist. Not detecting and merging.")
-      return known_annotations
-      # # TODO: fix the below and get segments.
-      # #
-      # # # Give me all the non-overlapping user-touched segments in this page.
-      # for annotation in known_annotations:
-      #   target = annotation.targets[0]
-      #   if annotation.source.source_type == 'human':
-      #     target['score'] = float(1.0)  # Set the max score for user-identified segments
-      #   # Prevent image matcher from changing user-identified segments
-      #   known_annotation_targets.insert(target)
-
-    # Create segments taking into account known_segments
-    detected_regions = page_image.find_text_regions()
-    logging.info("Matches = " + str(detected_regions))
-
-    new_annotations = []
-    for region in detected_regions:
-      del region.score
-      # noinspection PyProtectedMember
-      target = ullekhanam.ImageTarget.from_details(container_id=page._id, rectangle=region)
-      annotation = ullekhanam.ImageAnnotation.from_details(
-        targets=[target], source=ullekhanam.DataSource.from_details(source_type='system_inferred', id="pyCV2"))
-      annotation = annotation.update_collection(self)
-      new_annotations.append(annotation)
+    """Detect text regions in page_image and store them as ImageAnnotations of page - unless page has ImageAnnotations already.
+
+    :return: The ImageAnnotations of page: existing or new.
+    """
+    return self.update_image_annotations_in_bulk(pages=[page], get_page_image=lambda _: page_image)[page._id]
+
+  def get_image_annotations_by_page(self, page_ids):
+    """:return: A map from each of page_ids to a list of the ImageAnnotations targetting it - looked up with one query."""
+    page_ids = [str(page_id) for page_id in page_ids]
+    annotations_by_page = {page_id: [] for page_id in page_ids}
+    find_filter = common.UllekhanamJsonObject.get_targetting_entities_filter(container_id_condition={"$in": page_ids}, entity_type=ullekhanam.ImageAnnotation.get_wire_typeid())
+    for annotation_dict in self.find(find_filter):
+      annotation = common.JsonObject.make_from_db_dict(annotation_dict, db_interface=self)
+      if not isinstance(annotation, ullekhanam.ImageAnnotation):
+        continue
+      for container_id in {target.container_id for target in annotation.targets}:
+        if container_id in annotations_by_page:
+          annotations_by_page[container_id].append(annotation)
+    return annotations_by_page
+
+  def _write_image_annotations(self, pages_and_regions, source, batch_size):
+    """Write ImageAnnotations of regions upon pages - without looking for existing ones.
+
+    Validation is shared where possible: the source is set up and validated once, and the targets (the pages) are checked with one lookup; each annotation is then just checked against the schema, after its ImageTarget is validated by from_details.
+
+    :return: A map from page _id-s to lists of new ImageAnnotations.
+    """
+    new_annotations = {page._id: [] for page, _ in pages_and_regions}
+    if len(pages_and_regions) == 0:
+      return new_annotations
+    source.setup_source(db_interface=self)
+    source.validate(db_interface=self)
+    template = ullekhanam.ImageAnnotation()
+    template.set_base_details(targets=[common.Target.from_details(container_id=page._id) for page, _ in pages_and_regions], source=source)
+    common.Target.check_target_classes(targets_to_check=template.targets, db_interface=self, allowed_types=ullekhanam.ImageAnnotation.get_allowed_target_classes(), targeting_obj=template)
+
+    validator = ullekhanam.ImageAnnotation.get_schema_validator()
+    source_map = source.to_json_map()
+    docs = []
+
+    def write_docs():
+      for updated_doc in self.update_docs(docs):
+        annotation = common.JsonObject.make_from_db_dict(updated_doc, db_interface=self)
+        new_annotations[annotation.targets[0].container_id].append(annotation)
+      docs.clear()
+
+    for page, regions in pages_and_regions:
+      for region in regions:
+        if hasattr(region, "score"):
+          del region.score
+        target = ullekhanam.ImageTarget.from_details(container_id=str(page._id), rectangle=region)
+        doc = {common.TYPE_FIELD: template.get_wire_typeid(), "targets": [target.to_json_map()], "source": source_map}
+        validator.validate(doc)
+        docs.append(doc)
+        if len(docs) >= batch_size:
+          write_docs()
+    write_docs()
     return new_annotations
+
+  def add_image_annotations_in_bulk(self, pages_and_regions, source=None, batch_size=1000):
+    """Store detected regions as ImageAnnotations of many pages - skipping pages which have ImageAnnotations already.
+
+    :param pages_and_regions: An iterable of (page, list of :class:`~sanskrit_data.schema.ullekhanam.Rectangle`) pairs.
+    :param source: The DataSource shared by the new annotations. Defaults to the pyCV2 detector.
+    :param batch_size: The number of pages looked up (with one query), and the number of annotations written, at a time.
+    :return: A map from page _id-s to lists of their ImageAnnotations: existing or new.
+    """
+    return self._add_image_annotations_in_batches(pages_and_items=pages_and_regions, get_regions=lambda new_pages_and_regions: [regions for _, regions in new_pages_and_regions], source=source, batch_size=batch_size)
+
+  def _add_image_annotations_in_batches(self, pages_and_items, get_regions, source, batch_size):
+    """The stage shared by :meth:`add_image_annotations_in_bulk` and :meth:`update_image_annotations_in_bulk`.
+
+    :param pages_and_items: An iterable of (page, anything) pairs.
+    :param get_regions: Gives lists of regions for a list of such pairs - called only with pairs of pages without ImageAnnotations.
+    """
+    if source is None:
+      source = ullekhanam.DataSource.from_details(source_type='system_inferred', id="pyCV2")
+    annotations_by_page = {}
+    pages_and_items = iter(pages_and_items)
+    while True:
+      chunk = list(itertools.islice(pages_and_items, batch_size))
+      if len(chunk) == 0:
+        return annotations_by_page
+      annotations_by_page.update(self.get_image_annotations_by_page(page_ids=[page._id for page, _ in chunk]))
+      new_pages_and_items = [(page, item) for page, item in chunk if len(annotations_by_page[page._id]) == 0]
+      if len(new_pages_and_items) < len(chunk):
+        logging.warning("Annotations exist for %d pages. Not detecting and merging.", len(chunk) - len(new_pages_and_items))
+      new_pages_and_regions = list(zip([page for page, _ in new_pages_and_items], get_regions(new_pages_and_items)))
+      annotations_by_page.update(self._write_image_annotations(pages_and_regions=new_pages_and_regions, source=source, batch_size=batch_size))
+
+  def update_image_annotations_in_bulk(self, pages, get_page_image, num_workers=None, batch_size=100, source=None):
+    """Like :meth:`update_image_annotations`, for many pages: existing annotations are looked up with one query per batch of pages, and text regions are detected only in pages without them - on a thread pool if num_workers is given.
+
+    :param get_page_image: Gives an object with a find_text_regions method (eg. a docimage.DocumentImage) for a page.
+    :param num_workers: The number of threads detecting regions (image processing libraries like OpenCV mostly release the GIL).
+    :param batch_size: The number of pages handled (and of annotations written) at a time.
+    :param source: See :meth:`add_image_annotations_in_bulk`.
+    :return: A map from page _id-s to lists of their ImageAnnotations: existing or new.
+    """
+    def detect_regions(page):
+      detected_regions = get_page_image(page).find_text_regions()
+      logging.info("Matches = %s", detected_regions)
+      return detected_regions
+
+    executor = None if num_workers is None else ThreadPoolExecutor(max_workers=num_workers)
+
+    def get_regions(new_pages_and_items):
+      new_pages = [page for page, _ in new_pages_and_items]
+      return list(map(detect_regions, new_pages) if executor is None else executor.map(detect_regions, new_pages))
+
+    try:
+      return self._add_image_annotations_in_batches(pages_and_items=((page, None) for page in pages), get_regions=get_regions, source=source, batch_size=batch_size)
+    finally:
+      if executor is not None:
+        executor.shutdown()
@@ -20,7 +20,7 @@ class UsersInterface(DbInterface):
     if user_dict is None:
       return None
     else:
-      user = User.make_from_dict(user_dict)
+      user = User.make_from_db_dict(user_dict, db_interface=self)
       return user
 
   def get_matching_users_by_auth_infos(self, user):
@@ -0,0 +1,271 @@
+"""
+Matching of JSON documents (as stored in databases - ie. dicts, lists and scalars) against mango/ mongo find filters.
+
+A find filter is compiled once into a predicate, which can then be applied to any number of documents without constructing JsonObjects. Compiled predicates are cached by (normalized) filter.
+
+Supported operators: `$eq`, `$ne`, `$in`, `$nin`, `$gt`, `$gte`, `$lt`, `$lte`, `$exists`, `$regex` (with `$options`), `$elemMatch`, `$and` and `$or`. As in mongo, a path like `authentication_infos.auth_user_id` traverses lists along the way, and a condition on a path is satisfied if it holds for any of the values found there (or, for lists, any of their items).
+"""
+import json
+import logging
+import numbers
+import re
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+#: Compiled predicates, keyed by normalized find filter.
+_compiled_filters = {}
+_MAX_COMPILED_FILTERS = 1024
+
+
+class _Missing(object):
+  """Stands for the value at a path which is absent in a document."""
+
+  def __repr__(self):
+    return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def _is_number(value):
+  return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _equals(value, target):
+  if value is MISSING:
+    return target is None
+  # Unlike python, JSON does not regard true as 1.
+  if isinstance(value, bool) or isinstance(target, bool):
+    return isinstance(value, bool) and isinstance(target, bool) and value == target
+  return value == target
+
+
+def _comparable(value, target):
+  return (_is_number(value) and _is_number(target)) or (isinstance(value, str) and isinstance(target, str))
+
+
+def _resolve_path(node, path_parts, values):
+  """Append the values at some path within node to values, traversing lists along the way."""
+  if not path_parts:
+    values.append(node)
+  elif isinstance(node, dict):
+    _resolve_path(node.get(path_parts[0], MISSING), path_parts[1:], values)
+  elif isinstance(node, list):
+    num_values = len(values)
+    if path_parts[0].isdigit() and int(path_parts[0]) < len(node):
+      _resolve_path(node[int(path_parts[0])], path_parts[1:], values)
+    for item in node:
+      if isinstance(item, dict):
+        _resolve_path(item, path_parts, values)
+    if len(values) == num_values:
+      values.append(MISSING)
+  else:
+    values.append(MISSING)
+
+
+def _any_value(values, value_predicate):
+  """Does value_predicate hold for any of the values, or (for values which are lists) any of their items?"""
+  for value in values:
+    if value_predicate(value):
+      return True
+    if isinstance(value, list):
+      for item in value:
+        if value_predicate(item):
+          return True
+  return False
+
+
+def _compile_equality(target):
+  return lambda values: _any_value(values, lambda value: _equals(value, target))
+
+
+def _compile_in(targets):
+  if not isinstance(targets, list):
+    raise ValueError("$in needs an array: " + str(targets))
+  return lambda values: _any_value(values, lambda value: any(_equals(value, target) for target in targets))
+
+
+def _compile_comparison(operator, target):
+  if operator == "$gt":
+    compare = lambda value: value > target
+  elif operator == "$gte":
+    compare = lambda value: value >= target
+  elif operator == "$lt":
+    compare = lambda value: value < target
+  else:
+    compare = lambda value: value <= target
+  return lambda values: _any_value(values, lambda value: _comparable(value, target) and compare(value))
+
+
+def _compile_regex(pattern, options):
+  flags = 0
+  for option in options:
+    flags |= {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}.get(option, 0)
+  regex = re.compile(pattern, flags)
+  return lambda values: _any_value(values, lambda value: isinstance(value, str) and regex.search(value) is not None)
+
+
+def _compile_elem_match(condition):
+  if is_operator_condition(condition):
+    item_predicate = _compile_operator_condition(condition)
+    matches_item = lambda item: item_predicate([item])
+  else:
+    document_predicate = _compile_document_filter(condition)
+    matches_item = lambda item: isinstance(item, dict) and document_predicate(item)
+  return lambda values: any(isinstance(value, list) and any(matches_item(item) for item in value) for value in values)
+
+
+def _compile_operator(operator, argument, condition):
+  if operator == "$eq":
+    return _compile_equality(argument)
+  elif operator == "$ne":
+    equality = _compile_equality(argument)
+    return lambda values: not equality(values)
+  elif operator == "$in":
+    return _compile_in(argument)
+  elif operator == "$nin":
+    membership = _compile_in(argument)
+    return lambda values: not membership(values)
+  elif operator in ("$gt", "$gte", "$lt", "$lte"):
+    return _compile_comparison(operator, argument)
+  elif operator == "$exists":
+    return lambda values: any(value is not MISSING for value in values) == bool(argument)
+  elif operator == "$regex":
+    return _compile_regex(argument, condition.get("$options", ""))
+  elif operator == "$elemMatch":
+    return _compile_elem_match(argument)
+  else:
+    raise ValueError("Unsupported query operator: " + operator)
+
+
+def is_operator_condition(condition):
+  return isinstance(condition, dict) and len(condition) > 0 and all(isinstance(key, str) and key.startswith("$") for key in condition)
+
+
+def _compile_operator_condition(condition):
+  """Compile a condition like {"$gt": 1, "$lt": 5} into a predicate over the list of values at a path."""
+  value_predicates = [_compile_operator(operator, argument, condition) for operator, argument in condition.items() if operator != "$options"]
+  return lambda values: all(value_predicate(values) for value_predicate in value_predicates)
+
+
+def _compile_field_clause(path, condition):
+  path_parts = path.split(".")
+  if is_operator_condition(condition):
+    values_predicate = _compile_operator_condition(condition)
+  else:
+    values_predicate = _compile_equality(condition)
+
+  def predicate(doc):
+    values = []
+    _resolve_path(doc, path_parts, values)
+    return values_predicate(values)
+  return predicate
+
+
+def _compile_document_filter(find_filter):
+  if not isinstance(find_filter, dict):
+    raise ValueError("A find filter must be a dict: " + str(find_filter))
+  predicates = []
+  for key, condition in find_filter.items():
+    if key in ("$and", "$or"):
+      if not isinstance(condition, list):
+        raise ValueError(key + " needs an array: " + str(condition))
+      sub_predicates = [_compile_document_filter(sub_filter) for sub_filter in condition]
+      if key == "$and":
+        predicates.append(lambda doc, sub_predicates=sub_predicates: all(sub_predicate(doc) for sub_predicate in sub_predicates))
+      else:
+        predicates.append(lambda doc, sub_predicates=sub_predicates: any(sub_predicate(doc) for sub_predicate in sub_predicates))
+    elif key.startswith("$"):
+      raise ValueError("Unsupported query operator: " + key)
+    else:
+      predicates.append(_compile_field_clause(key, condition))
+  if len(predicates) == 1:
+    return predicates[0]
+  return lambda doc: all(predicate(doc) for predicate in predicates)
+
+
+#: Types of values which indexes (mapping values at some path to documents) may hold.
+INDEXABLE_TYPES = (str, int, float)
+
+
+def get_indexable_values(doc, path_parts):
+  """Yield the (scalar) values at some path within doc, traversing lists along the way.
+
+  The values yielded include all those for which an equality condition on the path could hold - so they suit indexes used to narrow down the documents to match.
+  """
+  if isinstance(doc, list):
+    if path_parts and path_parts[0].isdigit() and int(path_parts[0]) < len(doc):
+      for value in get_indexable_values(doc[int(path_parts[0])], path_parts[1:]):
+        yield value
+    for item in doc:
+      for value in get_indexable_values(item, path_parts):
+        yield value
+  elif not path_parts:
+    if isinstance(doc, INDEXABLE_TYPES):
+      yield doc
+  elif isinstance(doc, dict):
+    for value in get_indexable_values(doc.get(path_parts[0], None), path_parts[1:]):
+      yield value
+
+
+def _get_clause_values(condition):
+  """The values for which an equality or $in condition holds, or None for other conditions."""
+  if isinstance(condition, dict) and len(condition) == 1:
+    if "$eq" in condition:
+      values = [condition["$eq"]]
+    elif "$in" in condition and isinstance(condition["$in"], list):
+      values = condition["$in"]
+    else:
+      return None
+  else:
+    values = [condition]
+  if all(isinstance(value, INDEXABLE_TYPES) for value in values):
+    return values
+  return None
+
+
+def get_indexable_clause_values(find_filter):
+  """Get the equality (or $in) conditions in find_filter which indexes could serve - including those within $elemMatch.
+
+  Any document matching find_filter has, at each of the paths returned, one of the corresponding values (as yielded by :func:`get_indexable_values`).
+  :return: A dict mapping paths to lists of values.
+  """
+  clauses = []
+  for key, condition in find_filter.items():
+    if isinstance(condition, dict) and isinstance(condition.get("$elemMatch", None), dict):
+      clauses.extend((key + "." + sub_key, sub_condition) for sub_key, sub_condition in condition["$elemMatch"].items())
+    elif not key.startswith("$"):
+      clauses.append((key, condition))
+  clause_values = {}
+  for path, condition in clauses:
+    values = _get_clause_values(condition)
+    if values is not None:
+      clause_values[path] = values
+  return clause_values
+
+
+def compile_filter(find_filter):
+  """Get a predicate telling whether a document (a dict) matches find_filter.
+
+  :param dict find_filter: A mango or mongo query.
+  :return: A function taking a dict and returning a boolean.
+  """
+  try:
+    key = json.dumps(find_filter, sort_keys=True)
+  except (TypeError, ValueError):
+    return _compile_document_filter(find_filter)
+  predicate = _compiled_filters.get(key, None)
+  if predicate is None:
+    predicate = _compile_document_filter(find_filter)
+    if len(_compiled_filters) >= _MAX_COMPILED_FILTERS:
+      _compiled_filters.clear()
+    _compiled_filters[key] = predicate
+  return predicate
+
+
+def matches(find_filter, doc):
+  """Does doc match find_filter?"""
+  return compile_filter(find_filter)(doc)
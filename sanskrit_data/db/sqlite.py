@@ -0,0 +1,420 @@
+"""
+A :class:`~sanskrit_data.db.interfaces.DbInterface` implementation storing documents as JSON in an SQLite database file - a durable store needing no database server.
+
+Documents are queried using SQLite's JSON1 functions:
+
+- :meth:`SqliteDb.add_index` creates an expression index on json_extract(doc, '$.some.path'). Such indexes can't serve paths which traverse arrays (eg. targets.container_id), so values at those paths are additionally kept in an index_entries table (like mongo's multikey indexes). Paths where documents have had arrays are tracked for this purpose.
+- find filters are translated into SQL conditions (using json_each to look into arrays, as with $elemMatch) which select a superset of the matching documents. The selected documents are then checked using :mod:`~sanskrit_data.db.query_matcher`, so that find behaves exactly as with other backends.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import uuid
+
+from sanskrit_data.db import query_matcher
+from sanskrit_data.db.interfaces import ClientInterface, DbInterface, users_db, ullekhanam_db
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+_SCHEMA_STATEMENTS = [
+  "CREATE TABLE IF NOT EXISTS documents (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)",
+  "CREATE TABLE IF NOT EXISTS array_paths (path TEXT PRIMARY KEY)",
+  "CREATE TABLE IF NOT EXISTS indexes (name TEXT PRIMARY KEY, path TEXT NOT NULL, multikey INTEGER NOT NULL DEFAULT 0)",
+  "CREATE TABLE IF NOT EXISTS index_entries (index_name TEXT NOT NULL, value, _id TEXT NOT NULL)",
+  "CREATE INDEX IF NOT EXISTS index_entries_value ON index_entries (index_name, value)",
+  "CREATE INDEX IF NOT EXISTS index_entries_id ON index_entries (_id)",
+]
+
+# Path components which can be used in json paths without quoting.
+_SIMPLE_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+_FETCH_BATCH_SIZE = 256
+
+
+def _get_path_parts(path):
+  """Split a dotted path, or return None if it can't be used in a json path."""
+  parts = path.split(".")
+  if all(_SIMPLE_KEY.match(part) for part in parts):
+    return parts
+  return None
+
+
+def _get_prefixes(parts):
+  return [".".join(parts[:i + 1]) for i in range(len(parts))]
+
+
+def _collect_array_paths(node, path, array_paths):
+  if isinstance(node, dict):
+    for key, value in node.items():
+      _collect_array_paths(value, path + (str(key),), array_paths)
+  elif isinstance(node, list):
+    array_paths.add(".".join(path))
+    for item in node:
+      _collect_array_paths(item, path, array_paths)
+
+
+class _FilterTranslator(object):
+  """Translates a find filter into an SQL condition on the documents table (aliased d), selecting a superset of the documents which match the filter.
+
+  Parts of the filter which can't be translated (eg. $ne, $regex, $exists) are left to be checked in python.
+  """
+
+  def __init__(self, array_paths, multikey_indexes):
+    self.array_paths = array_paths
+    self.multikey_indexes = multikey_indexes
+    self.params = []
+    self.num_aliases = 0
+
+  def _param(self, value):
+    self.params.append(value)
+    return "?%d" % len(self.params)
+
+  def _new_alias(self):
+    self.num_aliases += 1
+    return "e%d" % self.num_aliases
+
+  @staticmethod
+  def _path_sql(base, parts):
+    """SQL for the json path of parts, relative to the json_each row base (or the document, if base is None)."""
+    suffix = "".join("." + part for part in parts)
+    if base is None:
+      return "'$%s'" % suffix
+    elif parts:
+      return "%s.fullkey || '%s'" % (base, suffix)
+    else:
+      return "%s.fullkey" % base
+
+  def _get_leaf_function(self, operator, argument):
+    """A function making an SQL condition on a value expression, or None if operator can't be translated."""
+    if operator == "$eq":
+      if isinstance(argument, query_matcher.INDEXABLE_TYPES):
+        param = self._param(argument)
+        return lambda value_sql: "%s = %s" % (value_sql, param)
+    elif operator == "$in":
+      if isinstance(argument, list) and all(isinstance(item, query_matcher.INDEXABLE_TYPES) for item in argument):
+        params = ", ".join(self._param(item) for item in argument)
+        return lambda value_sql: "%s IN (%s)" % (value_sql, params)
+    elif operator in ("$gt", "$gte", "$lt", "$lte"):
+      if isinstance(argument, query_matcher.INDEXABLE_TYPES) and not isinstance(argument, bool):
+        param = self._param(argument)
+        sql_operator = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[operator]
+        return lambda value_sql: "%s %s %s" % (value_sql, sql_operator, param)
+    return None
+
+  def _path_condition(self, base, base_path, parts, leaf_function, start=0):
+    """An SQL condition holding if leaf_function holds for some value at parts (relative to base), traversing arrays along the way."""
+    for i in range(start, len(parts) - 1):
+      if ".".join(base_path + parts[:i + 1]) in self.array_paths:
+        # The value here may (in some documents) be an array, whose items need to be looked into.
+        direct_condition = self._path_condition(base, base_path, parts, leaf_function, start=i + 1)
+        alias = self._new_alias()
+        item_condition = self._path_condition(alias, base_path + parts[:i + 1], parts[i + 1:], leaf_function)
+        return "(%s OR EXISTS (SELECT 1 FROM json_each(d.doc, %s) AS %s WHERE %s))" % (direct_condition, self._path_sql(base, parts[:i + 1]), alias, item_condition)
+    condition = leaf_function("json_extract(d.doc, %s)" % self._path_sql(base, parts))
+    if ".".join(base_path + parts) in self.array_paths:
+      alias = self._new_alias()
+      condition = "(%s OR EXISTS (SELECT 1 FROM json_each(d.doc, %s) AS %s WHERE %s))" % (condition, self._path_sql(base, parts), alias, leaf_function(alias + ".value"))
+    return condition
+
+  def _multikey_condition(self, path, operator, argument):
+    """Look the values up in index_entries, if there is a multikey index on path."""
+    index_name = self.multikey_indexes.get(path, None)
+    if index_name is None or operator not in ("$eq", "$in"):
+      return None
+    values = [argument] if operator == "$eq" else argument
+    if not isinstance(values, list) or not all(isinstance(value, query_matcher.INDEXABLE_TYPES) for value in values):
+      return None
+    return "d._id IN (SELECT _id FROM index_entries WHERE index_name = %s AND value IN (%s))" % (self._param(index_name), ", ".join(self._param(value) for value in values))
+
+  def _elem_match_condition(self, base, base_path, parts, condition):
+    if any(prefix in self.array_paths for prefix in _get_prefixes(base_path + parts)[len(base_path):-1]):
+      return None
+    alias = self._new_alias()
+    if query_matcher.is_operator_condition(condition):
+      leaf_functions = [self._get_leaf_function(operator, argument) for operator, argument in condition.items()]
+      item_condition = _and([leaf_function(alias + ".value") for leaf_function in leaf_functions if leaf_function is not None])
+    else:
+      item_condition = self.translate(condition, base=alias, base_path=base_path + parts)
+    conditions = []
+    if base is None and not query_matcher.is_operator_condition(condition):
+      for key, sub_condition in condition.items():
+        operator, argument = _get_operator_and_argument(sub_condition)
+        conditions.append(self._multikey_condition(".".join(parts + [key]), operator, argument))
+    if item_condition is not None:
+      conditions.append("EXISTS (SELECT 1 FROM json_each(d.doc, %s) AS %s WHERE %s)" % (self._path_sql(base, parts), alias, item_condition))
+    return _and(conditions)
+
+  def _field_condition(self, base, base_path, path, condition):
+    parts = _get_path_parts(path)
+    if parts is None:
+      return None
+    if query_matcher.is_operator_condition(condition):
+      operators = condition.items()
+    else:
+      operators = [("$eq", condition)]
+    conditions = []
+    for operator, argument in operators:
+      if operator == "$elemMatch":
+        if isinstance(argument, dict):
+          conditions.append(self._elem_match_condition(base, base_path, parts, argument))
+        continue
+      multikey_condition = self._multikey_condition(path, operator, argument) if base is None else None
+      if multikey_condition is not None:
+        conditions.append(multikey_condition)
+        continue
+      leaf_function = self._get_leaf_function(operator, argument)
+      if leaf_function is not None:
+        # Conditions are translated separately, as (like in mongo) each may hold for a different item of an array.
+        conditions.append(self._path_condition(base, base_path, parts, leaf_function))
+    return _and(conditions)
+
+  def translate(self, find_filter, base=None, base_path=()):
+    """:return: An SQL condition, or None if no part of the filter could be translated."""
+    base_path = list(base_path)
+    conditions = []
+    for key, condition in find_filter.items():
+      if key == "$and" and isinstance(condition, list):
+        conditions.append(_and([self.translate(sub_filter, base=base, base_path=base_path) for sub_filter in condition]))
+      elif key == "$or" and isinstance(condition, list):
+        sub_conditions = [self.translate(sub_filter, base=base, base_path=base_path) for sub_filter in condition]
+        if sub_conditions and None not in sub_conditions:
+          conditions.append("(%s)" % " OR ".join(sub_conditions))
+      elif not key.startswith("$"):
+        conditions.append(self._field_condition(base, base_path, key, condition))
+    return _and(conditions)
+
+
+def _and(conditions):
+  conditions = [condition for condition in conditions if condition is not None]
+  if not conditions:
+    return None
+  elif len(conditions) == 1:
+    return conditions[0]
+  return "(%s)" % " AND ".join(conditions)
+
+
+def _get_operator_and_argument(condition):
+  if query_matcher.is_operator_condition(condition) and len(condition) == 1:
+    return next(iter(condition.items()))
+  return "$eq", condition
+
+
+class SqliteDb(DbInterface):
+  """Stores documents in a table (documents) of an SQLite database."""
+
+  def __init__(self, db_path, db_name_frontend, external_file_store=None):
+    """
+
+    :param db_path: Path to the database file (created if necessary), or ":memory:".
+    """
+    super(SqliteDb, self).__init__(db_name_frontend=db_name_frontend, external_file_store=external_file_store)
+    self.db_path = db_path
+    self.lock = threading.RLock()
+    self.connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    if db_path != ":memory:":
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.execute("PRAGMA synchronous=NORMAL")
+    for statement in _SCHEMA_STATEMENTS:
+      self.connection.execute(statement)
+    self.array_paths = set(row[0] for row in self.connection.execute("SELECT path FROM array_paths"))
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
+
+  def _transaction(self):
+    return _Transaction(self)
+
+  def _get_multikey_indexes(self):
+    return dict((path, name) for name, path in self.connection.execute("SELECT name, path FROM indexes WHERE multikey = 1"))
+
+  def _update_index_entries(self, index_name, path, doc_id, doc):
+    self.connection.execute("DELETE FROM index_entries WHERE index_name = ? AND _id = ?", (index_name, doc_id))
+    if doc is not None:
+      values = set(query_matcher.get_indexable_values(doc, path.split(".")))
+      self.connection.executemany("INSERT INTO index_entries (index_name, value, _id) VALUES (?, ?, ?)", [(index_name, value, doc_id) for value in values])
+
+  def _make_multikey(self, index_name, path):
+    """Start maintaining index_entries for an index, since some document has an array along its path."""
+    logging.info("Index %s on %s is now a multikey index.", index_name, path)
+    self.connection.execute("UPDATE indexes SET multikey = 1 WHERE name = ?", (index_name,))
+    for doc_id, doc_json in self.connection.execute("SELECT _id, doc FROM documents").fetchall():
+      self._update_index_entries(index_name=index_name, path=path, doc_id=doc_id, doc=json.loads(doc_json))
+
+  def _update_multikey_indexes(self, new_array_paths):
+    for index_name, path, multikey in self.connection.execute("SELECT name, path, multikey FROM indexes").fetchall():
+      if not multikey and any(prefix in new_array_paths for prefix in _get_prefixes(path.split("."))):
+        self._make_multikey(index_name=index_name, path=path)
+
+  def _write_doc(self, doc):
+    """Insert or update a document. Should be called within a transaction."""
+    if not "_id" in doc:
+      doc["_id"] = uuid.uuid4().hex
+    self.connection.execute("INSERT INTO documents (_id, doc) VALUES (?, ?) ON CONFLICT(_id) DO UPDATE SET doc = excluded.doc", (doc["_id"], json.dumps(doc, ensure_ascii=False)))
+    array_paths = set()
+    _collect_array_paths(doc, (), array_paths)
+    new_array_paths = array_paths - self.array_paths
+    if new_array_paths:
+      self.connection.executemany("INSERT OR IGNORE INTO array_paths (path) VALUES (?)", [(path,) for path in new_array_paths])
+      self.array_paths.update(new_array_paths)
+      self._update_multikey_indexes(new_array_paths=new_array_paths)
+    for path, index_name in self._get_multikey_indexes().items():
+      self._update_index_entries(index_name=index_name, path=path, doc_id=doc["_id"], doc=doc)
+    return doc
+
+  def update_doc(self, doc):
+    return self.update_docs(docs=[doc])[0]
+
+  def update_docs(self, docs):
+    with self._transaction():
+      updated_docs = [self._write_doc(doc) for doc in docs]
+    self.notify_written(doc_ids=[doc["_id"] for doc in updated_docs])
+    return updated_docs
+
+  def delete_doc(self, doc_id):
+    self.delete_docs(doc_ids=[doc_id])
+
+  def delete_docs(self, doc_ids):
+    with self._transaction():
+      self.connection.executemany("DELETE FROM documents WHERE _id = ?", [(doc_id,) for doc_id in doc_ids])
+      self.connection.executemany("DELETE FROM index_entries WHERE _id = ?", [(doc_id,) for doc_id in doc_ids])
+    self.notify_written(doc_ids=list(doc_ids))
+
+  # noinspection PyShadowingBuiltins
+  def find_by_id(self, id):
+    return self.find_by_ids(ids=[id])[0]
+
+  def find_by_ids(self, ids):
+    ids = list(ids)
+    docs = {}
+    with self.lock:
+      for start in range(0, len(ids), _FETCH_BATCH_SIZE):
+        batch_ids = ids[start:start + _FETCH_BATCH_SIZE]
+        sql = "SELECT _id, doc FROM documents WHERE _id IN (%s)" % ", ".join("?" * len(batch_ids))
+        docs.update(self.connection.execute(sql, batch_ids).fetchall())
+    return [json.loads(docs[str(doc_id)]) if str(doc_id) in docs else None for doc_id in ids]
+
+  def get_find_query(self, find_filter):
+    """The SQL query (and parameters) selecting (a superset of) the documents matching find_filter."""
+    with self.lock:
+      translator = _FilterTranslator(array_paths=set(self.array_paths), multikey_indexes=self._get_multikey_indexes())
+    condition = translator.translate(find_filter)
+    sql = "SELECT d.doc FROM documents AS d"
+    if condition is not None:
+      sql += " WHERE " + condition
+    return sql + " ORDER BY d.rowid", translator.params
+
+  def find(self, find_filter):
+    matches = query_matcher.compile_filter(find_filter)
+    sql, params = self.get_find_query(find_filter=find_filter)
+    with self.lock:
+      cursor = self.connection.execute(sql, params)
+    while True:
+      with self.lock:
+        rows = cursor.fetchmany(_FETCH_BATCH_SIZE)
+      if not rows:
+        break
+      for row in rows:
+        doc = json.loads(row[0])
+        if matches(doc):
+          yield doc
+
+  def add_index(self, keys_dict, index_name):
+    """Create an expression index on json_extract of the keys in keys_dict.
+
+    The leading key is also used as a multikey index if documents have arrays along its path.
+    """
+    paths = list(keys_dict)
+    path_parts = [_get_path_parts(path) for path in paths]
+    if None in path_parts:
+      logging.warning("Not indexing %s: only simple dotted paths are supported.", str(paths))
+      return
+    expressions = ", ".join("json_extract(doc, '$.%s')%s" % (path, " DESC" if keys_dict[path] == -1 else "") for path in paths)
+    with self._transaction():
+      self.connection.execute("CREATE INDEX IF NOT EXISTS \"index_%s\" ON documents (%s)" % (re.sub(r"\W", "_", index_name), expressions))
+      if self.connection.execute("SELECT 1 FROM indexes WHERE name = ?", (index_name,)).fetchone() is None:
+        self.connection.execute("INSERT INTO indexes (name, path) VALUES (?, ?)", (index_name, paths[0]))
+        if any(prefix in self.array_paths for prefix in _get_prefixes(path_parts[0])):
+          self._make_multikey(index_name=index_name, path=paths[0])
+
+  def update_index(self, name, fields, upsert=False):
+    if upsert:
+      with self._transaction():
+        self.connection.execute("DROP INDEX IF EXISTS \"index_%s\"" % re.sub(r"\W", "_", name))
+        self.connection.execute("DELETE FROM indexes WHERE name = ?", (name,))
+        self.connection.execute("DELETE FROM index_entries WHERE index_name = ?", (name,))
+    self.add_index(keys_dict=dict((field, 1) for field in fields), index_name=name)
+
+
+class _Transaction(object):
+  """Holds the lock of a :class:`SqliteDb` and wraps statements in a transaction (which may be nested)."""
+
+  def __init__(self, db):
+    self.db = db
+    self.is_outermost = False
+
+  def __enter__(self):
+    self.db.lock.acquire()
+    self.is_outermost = not self.db.connection.in_transaction
+    if self.is_outermost:
+      self.db.connection.execute("BEGIN IMMEDIATE")
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    try:
+      if self.is_outermost:
+        self.db.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+    finally:
+      self.db.lock.release()
+    return False
+
+
+class BookPortionsSqlite(SqliteDb, ullekhanam_db.BookPortionsInterface):
+  def __init__(self, db_path, db_name_frontend, external_file_store=None):
+    super(BookPortionsSqlite, self).__init__(db_path=db_path, db_name_frontend=db_name_frontend,
+                                             external_file_store=external_file_store)
+    from sanskrit_data.schema import books, ullekhanam
+    books.BookPortion.add_indexes(db_interface=self)
+    ullekhanam.TextAnnotation.add_indexes(db_interface=self)
+
+
+class UsersSqlite(SqliteDb, users_db.UsersInterface):
+  def __init__(self, db_path, db_name_frontend, external_file_store=None):
+    super(UsersSqlite, self).__init__(db_path=db_path, db_name_frontend=db_name_frontend,
+                                      external_file_store=external_file_store)
+
+
+class SqliteClient(ClientInterface):
+  """Databases are files named <db_name>.sqlite3 within a directory."""
+
+  def __init__(self, db_dir):
+    self.db_dir = db_dir
+    os.makedirs(db_dir, exist_ok=True)
+
+  def get_database(self, db_name):
+    """:return: The path of the database file, with which a :class:`SqliteDb` can be instantiated."""
+    return os.path.join(self.db_dir, db_name + ".sqlite3")
+
+  def get_database_interface(self, db_name_backend, db_name_frontend=None, external_file_store=None, db_type=None):
+    """
+
+    :param db_type: "ullekhanam_db" for a :class:`BookPortionsSqlite`, "users_db" for a :class:`UsersSqlite`, or None for a plain :class:`SqliteDb`.
+    """
+    db_classes = {"ullekhanam_db": BookPortionsSqlite, "users_db": UsersSqlite, None: SqliteDb}
+    if db_type not in db_classes:
+      raise ValueError("Unknown db_type: " + str(db_type))
+    if db_name_frontend is None:
+      db_name_frontend = db_name_backend
+    return db_classes[db_type](db_path=self.get_database(db_name=db_name_backend), db_name_frontend=db_name_frontend, external_file_store=external_file_store)
+
+  def delete_database(self, db_name):
+    db_path = self.get_database(db_name=db_name)
+    for path in [db_path, db_path + "-wal", db_path + "-shm"]:
+      if os.path.exists(path):
+        os.remove(path)
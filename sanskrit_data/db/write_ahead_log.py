@@ -0,0 +1,219 @@
+"""
+Durability for :class:`~sanskrit_data.db.in_memory.InMemoryDb` (see its log_dir parameter): a JSON Lines write-ahead log, periodically compacted into a snapshot.
+
+A log directory holds:
+
+- snapshot.jsonl: A header line like {"seq": 123}, followed by one line per document - the state after the record with that sequence number.
+- log_<first sequence number>.jsonl segments: One line per write, like {"seq": 124, "update": [<docs>]} or {"seq": 125, "delete": [<ids>]}.
+
+On startup, the snapshot is loaded, and the records following it are replayed. A record partly written when the process died (the last line of a segment) is ignored - its writer had not returned.
+
+Writers append records to an in-memory buffer, and then wait until they are durable. Whichever waiting writer finds no write in progress writes (and fsyncs) all buffered records together - so concurrent writers share disk syncs (group commit).
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+from sanskrit_data.file_helper import fsync_dir
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+SNAPSHOT_FILE_NAME = "snapshot.jsonl"
+_SEGMENT_FILE_PATTERN = re.compile(r"^log_(\d+)\.jsonl$")
+
+
+class WriteAheadLog(object):
+  """Thread-safe; but records must be appended in the order in which their writes take effect (eg. while holding the database's write lock)."""
+
+  def __init__(self, log_dir, sync=True):
+    """
+
+    :param log_dir: Created if it does not exist.
+    :param sync: Whether to fsync records before writers return. Without this, records are just handed to the OS - surviving process crashes, but not power failures.
+    """
+    self.log_dir = log_dir
+    self.sync = sync
+    os.makedirs(log_dir, exist_ok=True)
+    self.condition = threading.Condition()
+    self.pending_lines = []
+    self.is_flushing = False
+    self.next_sequence_number = 1
+    self.durable_sequence_number = 0
+    #: Number of records appended since the last compaction started.
+    self.num_records_since_snapshot = 0
+    self.is_compacting = False
+    self.segment_file = None
+
+  def _get_segment_path(self, first_sequence_number):
+    return os.path.join(self.log_dir, "log_%012d.jsonl" % first_sequence_number)
+
+  def _list_segments(self):
+    """:return: Sorted list of (first sequence number, path) of log segments."""
+    segments = []
+    for file_name in os.listdir(self.log_dir):
+      match = _SEGMENT_FILE_PATTERN.match(file_name)
+      if match is not None:
+        segments.append((int(match.group(1)), os.path.join(self.log_dir, file_name)))
+    return sorted(segments)
+
+  def _open_segment(self, first_sequence_number):
+    segment_file = open(self._get_segment_path(first_sequence_number), "a", encoding="utf-8")
+    fsync_dir(self.log_dir)
+    return segment_file
+
+  def load(self):
+    """Rebuild the state from the snapshot and the log tail, and get ready to append records.
+
+    :return: A dict mapping _id-s to documents.
+    """
+    docs = {}
+    snapshot_sequence_number = 0
+    snapshot_path = os.path.join(self.log_dir, SNAPSHOT_FILE_NAME)
+    if os.path.exists(snapshot_path):
+      with open(snapshot_path, "r", encoding="utf-8") as snapshot_file:
+        snapshot_sequence_number = json.loads(snapshot_file.readline())["seq"]
+        for line in snapshot_file:
+          doc = json.loads(line)
+          docs[doc["_id"]] = doc
+    last_sequence_number = snapshot_sequence_number
+    num_replayed = 0
+    for _, segment_path in self._list_segments():
+      with open(segment_path, "rb") as segment_file:
+        lines = segment_file.readlines()
+      for line_index, line in enumerate(lines):
+        try:
+          if not line.endswith(b"\n"):
+            raise ValueError("Unterminated line")
+          record = json.loads(line)
+        except ValueError:
+          if line_index == len(lines) - 1:
+            logging.warning("Dropping a partly written record at the end of %s", segment_path)
+            # Records may be appended to this segment later.
+            os.truncate(segment_path, sum(len(earlier_line) for earlier_line in lines[:-1]))
+            break
+          raise
+        if record["seq"] <= snapshot_sequence_number:
+          continue
+        for doc in record.get("update", []):
+          docs[doc["_id"]] = doc
+        for doc_id in record.get("delete", []):
+          docs.pop(doc_id, None)
+        last_sequence_number = max(last_sequence_number, record["seq"])
+        num_replayed += 1
+    logging.info("Loaded %d documents from %s, replaying %d log records.", len(docs), self.log_dir, num_replayed)
+    with self.condition:
+      self.next_sequence_number = last_sequence_number + 1
+      self.durable_sequence_number = last_sequence_number
+      self.num_records_since_snapshot = num_replayed
+      self.segment_file = self._open_segment(self.next_sequence_number)
+    return docs
+
+  def append(self, updated_docs_json=None, deleted_ids=None):
+    """Buffer a record of a write.
+
+    :param updated_docs_json: JSON serialization of a list of updated documents.
+    :param deleted_ids: List of ids of deleted documents.
+    :return: The sequence number of the record - to be passed to :meth:`wait_until_durable`.
+    """
+    with self.condition:
+      sequence_number = self.next_sequence_number
+      self.next_sequence_number += 1
+      if updated_docs_json is not None:
+        self.pending_lines.append('{"seq": %d, "update": %s}\n' % (sequence_number, updated_docs_json))
+      else:
+        self.pending_lines.append('{"seq": %d, "delete": %s}\n' % (sequence_number, json.dumps(deleted_ids)))
+      self.num_records_since_snapshot += 1
+      return sequence_number
+
+  def _write_lines(self, segment_file, lines):
+    segment_file.write("".join(lines))
+    segment_file.flush()
+    if self.sync:
+      os.fsync(segment_file.fileno())
+
+  def wait_until_durable(self, sequence_number):
+    """Return once the record with sequence_number (and those before it) are written - writing them, along with any other buffered records, if no other thread is doing so."""
+    with self.condition:
+      while self.durable_sequence_number < sequence_number:
+        if self.is_flushing:
+          self.condition.wait()
+          continue
+        self.is_flushing = True
+        lines, self.pending_lines = self.pending_lines, []
+        last_sequence_number = self.next_sequence_number - 1
+        segment_file = self.segment_file
+        self.condition.release()
+        try:
+          self._write_lines(segment_file, lines)
+        finally:
+          self.condition.acquire()
+          self.is_flushing = False
+          self.condition.notify_all()
+        self.durable_sequence_number = max(self.durable_sequence_number, last_sequence_number)
+
+  def start_compaction(self):
+    """Write out buffered records, and start a new log segment - so that the older segments can be dropped once a snapshot of the current state is written.
+
+    Should be called while the state can't change (eg. holding the database's write lock), to get the current state along with the sequence number.
+    :return: The sequence number of the last record before the new segment, or None if a compaction is already in progress.
+    """
+    with self.condition:
+      if self.is_compacting:
+        return None
+      self.is_compacting = True
+      while self.is_flushing:
+        self.condition.wait()
+      self._write_lines(self.segment_file, self.pending_lines)
+      self.pending_lines = []
+      self.durable_sequence_number = self.next_sequence_number - 1
+      self.condition.notify_all()
+      self.segment_file.close()
+      self.segment_file = self._open_segment(self.next_sequence_number)
+      self.num_records_since_snapshot = 0
+      return self.next_sequence_number - 1
+
+  def wait_for_compaction(self):
+    with self.condition:
+      while self.is_compacting:
+        self.condition.wait()
+
+  def finish_compaction(self, docs, sequence_number):
+    """Write a snapshot, and drop the log segments it makes redundant.
+
+    :param docs: Iterable of the documents at sequence_number (as returned by :meth:`start_compaction`).
+    """
+    try:
+      snapshot_path = os.path.join(self.log_dir, SNAPSHOT_FILE_NAME)
+      temp_path = snapshot_path + ".tmp"
+      with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+        snapshot_file.write(json.dumps({"seq": sequence_number}) + "\n")
+        for doc in docs:
+          snapshot_file.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+      os.replace(temp_path, snapshot_path)
+      fsync_dir(self.log_dir)
+      for first_sequence_number, segment_path in self._list_segments():
+        if first_sequence_number <= sequence_number:
+          os.remove(segment_path)
+    finally:
+      with self.condition:
+        self.is_compacting = False
+        self.condition.notify_all()
+
+  def close(self):
+    """Write out buffered records (waiting for any compaction in progress), and close the log."""
+    with self.condition:
+      while self.is_compacting or self.is_flushing:
+        self.condition.wait()
+      if self.segment_file is not None:
+        self._write_lines(self.segment_file, self.pending_lines)
+        self.pending_lines = []
+        self.durable_sequence_number = self.next_sequence_number - 1
+        self.segment_file.close()
+        self.segment_file = None
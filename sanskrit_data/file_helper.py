@@ -0,0 +1,24 @@
+"""
+Helpers for durable file system operations - shared by the write-ahead log, import manifests and the blob store.
+"""
+import logging
+import os
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def fsync_dir(dir_path):
+  """Make renames and file creations in dir_path durable (where the platform allows that)."""
+  try:
+    dir_fd = os.open(dir_path, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(dir_fd)
+  except OSError:
+    pass
+  finally:
+    os.close(dir_fd)
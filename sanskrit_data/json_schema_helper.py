@@ -0,0 +1,300 @@
+"""
+Compiles JSON schemas (such as the schema member of :py:class:`~sanskrit_data.schema.common.JsonObject` subclasses) into plain python validation functions, in the style of fastjsonschema.
+
+jsonschema.validate re-checks the schema against its metaschema and builds a fresh validator on every call. Here that is done once per schema, and the common case (a valid instance) is decided by generated code. Invalid instances are re-examined by a cached jsonschema validator, so that the raised :py:class:`jsonschema.ValidationError` is exactly what jsonschema.validate would have raised.
+"""
+import logging
+import numbers
+import re
+
+import jsonschema
+from jsonschema.exceptions import best_match
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+#: Keywords which do not affect validation outcome (format is not asserted by jsonschema.validate either). Keywords unknown to the draft are ignored as well, as jsonschema does.
+ANNOTATION_KEYWORDS = frozenset(["$schema", "$id", "$comment", "$defs", "definitions", "title", "description", "default", "examples", "readOnly", "writeOnly", "deprecated", "format"])
+
+#: Drafts whose semantics for the supported keywords are what the generated code implements.
+COMPILABLE_DRAFTS = (jsonschema.Draft6Validator, jsonschema.Draft7Validator, jsonschema.Draft201909Validator, jsonschema.Draft202012Validator)
+
+_TYPE_CHECKS = {
+  "array": "isinstance({0}, list)",
+  "boolean": "isinstance({0}, bool)",
+  "integer": "(not isinstance({0}, bool) and (isinstance({0}, int) or (isinstance({0}, float) and {0}.is_integer())))",
+  "null": "({0} is None)",
+  "number": "(not isinstance({0}, bool) and isinstance({0}, numbers.Number))",
+  "object": "isinstance({0}, dict)",
+  "string": "isinstance({0}, str)",
+}
+
+_OBJECT_KEYWORDS = ("properties", "required", "additionalProperties")
+_ARRAY_KEYWORDS = ("items", "minItems", "maxItems")
+_STRING_KEYWORDS = ("minLength", "maxLength", "pattern")
+_NUMBER_KEYWORDS = ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum")
+_APPLICATOR_KEYWORDS = ("$ref", "allOf", "anyOf", "oneOf", "not")
+SUPPORTED_KEYWORDS = frozenset(("type", "enum") + _OBJECT_KEYWORDS + _ARRAY_KEYWORDS + _STRING_KEYWORDS + _NUMBER_KEYWORDS + _APPLICATOR_KEYWORDS) | ANNOTATION_KEYWORDS
+
+
+class UnsupportedSchemaError(Exception):
+  """Raised when a schema uses keywords which :func:`compile_schema` does not translate."""
+
+
+def _unbool(element, true=object(), false=object()):
+  # Mirrors jsonschema: True and 1 (False and 0) are distinct enum members.
+  if element is True:
+    return true
+  elif element is False:
+    return false
+  return element
+
+
+def _descend(function, value, node_ids, skipping_nodes):
+  # See compile_schema regarding node_ids.
+  if node_ids is not None and id(value) in node_ids:
+    return skipping_nodes or function(value, node_ids, True)
+  return function(value, node_ids, skipping_nodes)
+
+
+def _enum_contains(instance, enums):
+  if instance == 0 or instance == 1:
+    unbooled = _unbool(instance)
+    return any(unbooled == _unbool(each) for each in enums)
+  return instance in enums
+
+
+class _SchemaCompiler(object):
+  def __init__(self, root_schema, validator_class):
+    self.root_schema = root_schema
+    # Keywords which the draft acts upon, but which we do not translate.
+    self.unsupported_keywords = (set(validator_class.VALIDATORS.keys()) | {"$ref"}) - SUPPORTED_KEYWORDS - ANNOTATION_KEYWORDS
+    self.function_names = {}
+    self.sources = []
+    self.namespace = {"numbers": numbers, "_enum_contains": _enum_contains, "_descend": _descend}
+    self.schemas_by_id = {}
+    self._collect_ids(root_schema)
+
+  def _collect_ids(self, schema):
+    if isinstance(schema, dict):
+      if isinstance(schema.get("$id", None), str):
+        self.schemas_by_id.setdefault(schema["$id"], schema)
+      for value in schema.values():
+        self._collect_ids(value)
+    elif isinstance(schema, list):
+      for value in schema:
+        self._collect_ids(value)
+
+  def compile(self):
+    function_name = self.function_for(self.root_schema)
+    # The generated source is only ever built from the schema structure; constants are passed in through the namespace.
+    exec("\n\n".join(self.sources), self.namespace)
+    return self.namespace[function_name]
+
+  def constant(self, value):
+    name = "_c%d" % len(self.namespace)
+    self.namespace[name] = value
+    return name
+
+  def resolve_ref(self, ref):
+    if ref == "#":
+      return self.root_schema
+    if ref.startswith("#/"):
+      schema = self.root_schema
+      for segment in ref[2:].split("/"):
+        segment = segment.replace("~1", "/").replace("~0", "~")
+        schema = schema[int(segment)] if isinstance(schema, list) else schema[segment]
+      return schema
+    if ref in self.schemas_by_id:
+      return self.schemas_by_id[ref]
+    raise UnsupportedSchemaError("Unresolvable $ref " + ref)
+
+  def function_for(self, schema):
+    if id(schema) in self.function_names:
+      return self.function_names[id(schema)]
+    function_name = "_v%d" % len(self.function_names)
+    self.function_names[id(schema)] = function_name
+    lines = ["def %s(data, node_ids, skipping_nodes):" % function_name]
+    lines.extend("  " + line for line in self.checks(schema=schema, var="data"))
+    lines.append("  return True")
+    self.sources.append("\n".join(lines))
+    return function_name
+
+  def is_inlinable(self, schema):
+    return isinstance(schema, bool) or (isinstance(schema, dict) and not (SUPPORTED_KEYWORDS | self.unsupported_keywords).difference(["type", "enum"]).intersection(schema.keys()))
+
+  def expression_for(self, schema, var, descending=False):
+    """A boolean python expression telling whether var satisfies schema.
+
+    :param descending: Is var a value within the data being checked (rather than the data itself)?
+    """
+    if schema is True:
+      return "True"
+    if schema is False:
+      return "False"
+    if not self.is_inlinable(schema):
+      if descending:
+        return "_descend(%s, %s, node_ids, skipping_nodes)" % (self.function_for(schema), var)
+      return "%s(%s, node_ids, skipping_nodes)" % (self.function_for(schema), var)
+    conditions = []
+    if "type" in schema:
+      conditions.append(self.type_expression(schema["type"], var))
+    if "enum" in schema:
+      conditions.append(self.enum_expression(schema["enum"], var))
+    return "(" + " and ".join(conditions) + ")" if len(conditions) > 0 else "True"
+
+  def type_expression(self, schema_type, var):
+    types = schema_type if isinstance(schema_type, list) else [schema_type]
+    for some_type in types:
+      if some_type not in _TYPE_CHECKS:
+        raise UnsupportedSchemaError("type " + str(some_type))
+    return "(" + " or ".join(_TYPE_CHECKS[some_type].format(var) for some_type in types) + ")"
+
+  def enum_expression(self, enums, var):
+    if all(isinstance(item, str) for item in enums):
+      return "(isinstance(%s, str) and %s in %s)" % (var, var, self.constant(frozenset(enums)))
+    return "_enum_contains(%s, %s)" % (var, self.constant(list(enums)))
+
+  def checks(self, schema, var):
+    """Lines of code which return False if var does not satisfy schema."""
+    if schema is True:
+      return []
+    if schema is False:
+      return ["return False"]
+    if not isinstance(schema, dict):
+      raise UnsupportedSchemaError(str(schema))
+    unsupported_keywords = self.unsupported_keywords.intersection(schema.keys())
+    if len(unsupported_keywords) > 0:
+      raise UnsupportedSchemaError(str(sorted(unsupported_keywords)))
+    lines = []
+    if "type" in schema:
+      lines += ["if not %s:" % self.type_expression(schema["type"], var), "  return False"]
+    if "enum" in schema:
+      lines += ["if not %s:" % self.enum_expression(schema["enum"], var), "  return False"]
+    lines += self.applicator_checks(schema, var)
+    lines += self.object_checks(schema, var)
+    lines += self.array_checks(schema, var)
+    lines += self.string_checks(schema, var)
+    lines += self.number_checks(schema, var)
+    return lines
+
+  def applicator_checks(self, schema, var):
+    lines = []
+    if "$ref" in schema:
+      lines += ["if not %s(%s, node_ids, skipping_nodes):" % (self.function_for(self.resolve_ref(schema["$ref"])), var), "  return False"]
+    for subschema in schema.get("allOf", []):
+      lines += ["if not %s:" % self.expression_for(subschema, var), "  return False"]
+    if "anyOf" in schema:
+      lines += ["if not (%s):" % " or ".join(self.expression_for(subschema, var) for subschema in schema["anyOf"]), "  return False"]
+    if "oneOf" in schema:
+      lines += ["if [%s].count(True) != 1:" % ", ".join("bool(%s)" % self.expression_for(subschema, var) for subschema in schema["oneOf"]), "  return False"]
+    if "not" in schema:
+      lines += ["if %s:" % self.expression_for(schema["not"], var), "  return False"]
+    return lines
+
+  def object_checks(self, schema, var):
+    body = []
+    for key in sorted(schema.get("required", [])):
+      body += ["if %r not in %s:" % (key, var), "  return False"]
+    properties = schema.get("properties", {})
+    for key, subschema in properties.items():
+      if subschema is True or (isinstance(subschema, dict) and not (SUPPORTED_KEYWORDS | self.unsupported_keywords).difference(ANNOTATION_KEYWORDS).intersection(subschema.keys())):
+        continue
+      body += ["if %r in %s and not %s:" % (key, var, self.expression_for(subschema, "%s[%r]" % (var, key), descending=True))]
+      body += ["  return False"]
+    additional_properties = schema.get("additionalProperties", True)
+    if additional_properties is not True:
+      known_keys = self.constant(frozenset(properties.keys()))
+      body += ["for key in %s:" % var, "  if key not in %s and not %s:" % (known_keys, self.expression_for(additional_properties, "%s[key]" % var, descending=True)), "    return False"]
+    if len(body) == 0:
+      return []
+    return ["if isinstance(%s, dict):" % var] + ["  " + line for line in body]
+
+  def array_checks(self, schema, var):
+    body = []
+    if "minItems" in schema:
+      body += ["if len(%s) < %d:" % (var, schema["minItems"]), "  return False"]
+    if "maxItems" in schema:
+      body += ["if len(%s) > %d:" % (var, schema["maxItems"]), "  return False"]
+    if "items" in schema:
+      if isinstance(schema["items"], list):
+        raise UnsupportedSchemaError("tuple-style items")
+      if schema["items"] is not True:
+        body += ["for item in %s:" % var, "  if not %s:" % self.expression_for(schema["items"], "item", descending=True), "    return False"]
+    if len(body) == 0:
+      return []
+    return ["if isinstance(%s, list):" % var] + ["  " + line for line in body]
+
+  def string_checks(self, schema, var):
+    body = []
+    if "minLength" in schema:
+      body += ["if len(%s) < %d:" % (var, schema["minLength"]), "  return False"]
+    if "maxLength" in schema:
+      body += ["if len(%s) > %d:" % (var, schema["maxLength"]), "  return False"]
+    if "pattern" in schema:
+      body += ["if not %s.search(%s):" % (self.constant(re.compile(schema["pattern"])), var), "  return False"]
+    if len(body) == 0:
+      return []
+    return ["if isinstance(%s, str):" % var] + ["  " + line for line in body]
+
+  def number_checks(self, schema, var):
+    body = []
+    for keyword, failing_comparison in [("minimum", "<"), ("maximum", ">"), ("exclusiveMinimum", "<="), ("exclusiveMaximum", ">=")]:
+      if keyword in schema:
+        body += ["if %s %s %s:" % (var, failing_comparison, self.constant(schema[keyword])), "  return False"]
+    if len(body) == 0:
+      return []
+    return ["if not isinstance(%s, bool) and isinstance(%s, numbers.Number):" % (var, var)] + ["  " + line for line in body]
+
+
+def compile_schema(schema, validator_class=None):
+  """Translate a JSON schema into a python function which returns a boolean telling whether an instance is valid.
+
+  The function is called as function(instance, node_ids, False). node_ids is None, or a set of id()s of dicts within the instance which are validated separately (against their own schemas).
+  Such dicts are checked only at their top level (their own values are checked, but node_ids dicts within them are skipped). This lets a tree of nested objects be validated with each node visited a bounded number of times.
+
+  :param validator_class: The jsonschema validator class for the schema's draft. Inferred from $schema if not provided.
+  :raises UnsupportedSchemaError: if the schema uses keywords (or a draft) not handled here.
+  """
+  if validator_class is None:
+    validator_class = jsonschema.validators.validator_for(schema)
+  if validator_class not in COMPILABLE_DRAFTS:
+    raise UnsupportedSchemaError(validator_class.__name__)
+  return _SchemaCompiler(root_schema=schema, validator_class=validator_class).compile()
+
+
+class CompiledSchemaValidator(object):
+  """Validates instances against a given schema - using generated code where possible, and a (cached) jsonschema validator otherwise.
+
+  The schema is checked against its metaschema once, upon construction (which raises :py:class:`jsonschema.SchemaError` if need be).
+  """
+
+  def __init__(self, schema):
+    self.schema = schema
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    self.jsonschema_validator = validator_class(schema)
+    try:
+      self.compiled_function = compile_schema(schema, validator_class=validator_class)
+    except UnsupportedSchemaError as e:
+      logging.info("Falling back to jsonschema for a schema with %s", str(e))
+      self.compiled_function = None
+
+  def is_valid(self, instance, node_ids=None):
+    """
+
+    :param node_ids: ids of dicts within instance to be checked only at their top level - see :func:`compile_schema`. Ignored (ie. everything is checked) when falling back to jsonschema.
+    """
+    if self.compiled_function is None:
+      return self.jsonschema_validator.is_valid(instance)
+    return self.compiled_function(instance, node_ids, False)
+
+  def validate(self, instance, node_ids=None):
+    """Equivalent to jsonschema.validate(instance, self.schema) when node_ids is None."""
+    if self.is_valid(instance, node_ids=node_ids):
+      return
+    error = best_match(self.jsonschema_validator.iter_errors(instance))
+    if error is not None:
+      raise error
@@ -0,0 +1,218 @@
+"""
+Incremental (event driven) parsing of large JSON files - in particular, of :class:`~sanskrit_data.schema.common.JsonObjectNode` trees such as book.json dumps.
+
+The events are those of `ijson <https://pypi.org/project/ijson/>`_'s basic_parse: (event, value) pairs where event is one of start_map, map_key, end_map, start_array, end_array, string, number, boolean and null. ijson (with its C backend) is used if installed; otherwise a pure python tokenizer.
+"""
+import codecs
+import json
+import logging
+import re
+from json.decoder import scanstring
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = re.compile(r"-?[0-9][0-9.eE+\-]*")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+_LITERALS = {"true": ("boolean", True), "false": ("boolean", False), "null": ("null", None)}
+_NODE_CLASS = "JsonObjectNode"
+
+
+def basic_parse(fhandle, buffer_size=65536):
+  """Parse a JSON document lazily.
+
+  :param fhandle: A file opened in binary mode.
+  :return: A generator of (event, value) pairs. Numbers are ints or floats.
+  """
+  try:
+    import ijson
+  except ImportError:
+    return _basic_parse(fhandle=fhandle, buffer_size=buffer_size)
+  return ijson.basic_parse(fhandle, buf_size=buffer_size, use_float=True)
+
+
+def _basic_parse(fhandle, buffer_size=65536):
+  """A pure python equivalent of ijson.basic_parse."""
+  decoder = codecs.getincrementaldecoder("utf-8")()
+  buffer = ""
+  position = 0
+  eof = False
+  # For each open container: whether it is a map.
+  containers = []
+  expect_key = False
+  while True:
+    position = _WHITESPACE.match(buffer, position).end()
+    if position < len(buffer):
+      char = buffer[position]
+      token_complete = True
+      if char == "{":
+        containers.append(True)
+        expect_key = True
+        position += 1
+        yield "start_map", None
+      elif char == "}":
+        containers.pop()
+        expect_key = False
+        position += 1
+        yield "end_map", None
+      elif char == "[":
+        containers.append(False)
+        expect_key = False
+        position += 1
+        yield "start_array", None
+      elif char == "]":
+        containers.pop()
+        position += 1
+        yield "end_array", None
+      elif char == ",":
+        expect_key = containers[-1]
+        position += 1
+      elif char == ":":
+        position += 1
+      elif char == '"':
+        try:
+          value, end = scanstring(buffer, position + 1, True)
+        except ValueError:
+          if eof:
+            raise
+          token_complete = False
+        else:
+          position = end
+          if expect_key:
+            expect_key = False
+            yield "map_key", value
+          else:
+            yield "string", value
+      else:
+        match = _NUMBER_CHARS.match(buffer, position)
+        literal = next((literal for literal in _LITERALS if buffer.startswith(literal, position)), None)
+        if match is not None:
+          # A number at the end of the buffer may continue in the next read.
+          if match.end() < len(buffer) or eof:
+            text = match.group()
+            number_match = _NUMBER.fullmatch(text)
+            if number_match is None:
+              raise ValueError("Invalid number: %r" % text)
+            position = match.end()
+            yield "number", float(text) if (number_match.group(1) or number_match.group(2)) else int(text)
+          else:
+            token_complete = False
+        elif literal is not None:
+          position += len(literal)
+          yield _LITERALS[literal]
+        elif not eof and len(buffer) - position < len("false"):
+          token_complete = False
+        else:
+          raise ValueError("Unexpected %r at: %r" % (char, buffer[position:position + 20]))
+      if token_complete:
+        continue
+    elif eof:
+      if containers:
+        raise ValueError("Incomplete JSON document")
+      return
+    # Read more - at least as much as is buffered, so that long tokens are scanned a bounded number of times.
+    data = fhandle.read(max(buffer_size, len(buffer) - position))
+    eof = not data
+    buffer = buffer[position:] + decoder.decode(data, final=eof)
+    position = 0
+
+
+class _ValueBuilder(object):
+  """Builds a value from the events of :func:`basic_parse`."""
+
+  def __init__(self):
+    self.containers = []
+    self.keys = []
+    self.value = None
+
+  def _add(self, value):
+    if not self.containers:
+      self.value = value
+    elif isinstance(self.containers[-1], list):
+      self.containers[-1].append(value)
+    else:
+      self.containers[-1][self.keys[-1]] = value
+
+  def event(self, event, value):
+    """:return: Whether the value is complete."""
+    if event == "map_key":
+      self.keys[-1] = value
+    elif event == "start_map" or event == "start_array":
+      container = {} if event == "start_map" else []
+      self._add(container)
+      self.containers.append(container)
+      self.keys.append(None)
+    elif event == "end_map" or event == "end_array":
+      self.containers.pop()
+      self.keys.pop()
+    else:
+      self._add(value)
+    return not self.containers
+
+
+class _Frame(object):
+  def __init__(self, is_node=False, node_path=None, is_children=False):
+    self.is_node = is_node
+    self.is_children = is_children
+    self.node_path = node_path
+    self.key = None
+    self.num_items = 0
+
+
+def iter_node_contents(fhandle, buffer_size=65536):
+  """Walk a (JSON serialized) JsonObjectNode tree, yielding the content of each node as soon as it is parsed - so that memory use is bounded by the size of the largest content, rather than that of the tree.
+
+  Contents come in the order in which they appear in the file: parents before their children if "content" precedes "children" in the node maps (as written by :func:`content_first`).
+
+  :param fhandle: A file opened in binary mode.
+  :return: A generator of (node_path, content) pairs. node_path is the tuple of child indices leading to the node from the root (so that the parent's path is node_path[:-1]); and content is a JSON map.
+  """
+  frames = []
+  builder = None
+  for event, value in basic_parse(fhandle=fhandle, buffer_size=buffer_size):
+    if builder is not None:
+      if builder.event(event, value):
+        yield frames[-1].node_path, builder.value
+        builder = None
+      continue
+    frame = frames[-1] if frames else None
+    if event == "map_key":
+      frame.key = value
+    elif event == "start_map" or event == "start_array":
+      if frame is None:
+        frames.append(_Frame(is_node=event == "start_map", node_path=()))
+      elif frame.is_node and frame.key == "content" and event == "start_map":
+        builder = _ValueBuilder()
+        builder.event(event, value)
+      elif frame.is_node and frame.key == "children" and event == "start_array":
+        frames.append(_Frame(is_children=True, node_path=frame.node_path))
+      elif frame.is_children and event == "start_map":
+        frames.append(_Frame(is_node=True, node_path=frame.node_path + (frame.num_items,)))
+        frame.num_items += 1
+      else:
+        frames.append(_Frame())
+    elif event == "end_map" or event == "end_array":
+      frames.pop()
+
+
+def content_first(json_map):
+  """Order the keys of (nested) maps as in json.dumps(sort_keys=True) - except that in JsonObjectNode maps, "content" precedes "children". A tree so ordered can be imported by :func:`iter_node_contents` in bounded memory."""
+  if isinstance(json_map, dict):
+    keys = sorted(json_map)
+    if json_map.get("jsonClass", None) == _NODE_CLASS and "content" in json_map:
+      keys.remove("content")
+      keys.insert(0, "content")
+    return dict((key, content_first(json_map[key])) for key in keys)
+  elif isinstance(json_map, list):
+    return [content_first(item) for item in json_map]
+  else:
+    return json_map
+
+
+def dump_content_first(json_map, filename):
+  """Write json_map, ordered by :func:`content_first`, as indented JSON."""
+  with open(filename, "w", encoding="utf-8") as fhandle:
+    json.dump(content_first(json_map), fhandle, ensure_ascii=False, indent=2)
@@ -181,12 +181,15 @@ class BookPortion(UllekhanamJsonObject):
     if book_portion_dict is None:
       return None
     else:
-      book_portion = JsonObject.make_from_dict(book_portion_dict)
+      book_portion = JsonObject.make_from_db_dict(book_portion_dict, db_interface=db_interface)
       return book_portion
 
   @classmethod
   def add_indexes(cls, db_interface):
     super(BookPortion, cls).add_indexes(db_interface=db_interface)
+    db_interface.add_index(keys_dict={
+      "path": 1
+    }, index_name="path")
     db_interface.add_index(keys_dict={
       "creation_details.names.script_renderings.text": 1
     }, index_name="creation_details_names_script_renderings_text")
@@ -225,7 +228,10 @@ class BookPortion(UllekhanamJsonObject):
       import copy
       copied_node = copy.deepcopy(book_node)
       copied_node.recursively_delete_attr(field_name="path")
-      copied_node.dump_to_file(filename=os.path.join(export_dir_destination, "book.json"))
+      # Contents precede children, so that BookPortionsInterface.import_book can write nodes while parsing.
+      from sanskrit_data import json_stream_helper
+      os.makedirs(name=export_dir_destination, exist_ok=True)
+      json_stream_helper.dump_content_first(json_map=copied_node.to_json_map(), filename=os.path.join(export_dir_destination, "book.json"))
     elif self.portion_class == "page":
       # Just dump the file.
       import shutil
@@ -239,7 +245,11 @@ class BookPortion(UllekhanamJsonObject):
         for f in self.list_files(db_interface=db_interface):
           # noinspection PyArgumentList
           os.makedirs(name=export_dir_destination, exist_ok=True)
-          shutil.copyfile(os.path.join(self.get_external_storage_path(db_interface=db_interface), f), os.path.join(export_dir_destination, os.path.basename(f)))
+          if getattr(db_interface, "blob_store", None) is not None:
+            # Blobs are never modified, so exported files can be hardlinks to them.
+            db_interface.blob_store.link_file(obj_id=self._id, file_name=f, dest_path=os.path.join(export_dir_destination, f))
+          else:
+            shutil.copyfile(os.path.join(self.get_external_storage_path(db_interface=db_interface), f), os.path.join(export_dir_destination, os.path.basename(f)))
 
     for sub_portion in book_node.children:
       sub_portion.content.dump_book_portion(export_dir=export_dir, db_interface=db_interface)
@@ -4,13 +4,15 @@ A module containing some data container base classes.
 
 from __future__ import absolute_import
 
+import itertools
 import json
 import logging
 import sys
+import threading
+from collections import Counter
 from copy import deepcopy
 
 import jsonpickle
-import jsonschema
 import toml
 from jsonschema import SchemaError
 from jsonschema import ValidationError
@@ -18,8 +20,8 @@ from jsonschema.exceptions import best_match
 from six import string_types
 from toml.decoder import TomlDecodeError
 
-from sanskrit_data import collection_helper
-from sanskrit_data.collection_helper import round_floats, tuples_to_lists, _set_jsonpickle_type_recursively
+from sanskrit_data.collection_helper import _set_jsonpickle_type_recursively
+from sanskrit_data.json_schema_helper import CompiledSchemaValidator
 from sanskrit_data.toml_helper import MultilinePreferringTomlEncoder
 
 logging.basicConfig(
@@ -59,6 +61,198 @@ def check_list_item_types(some_list, allowed_types):
   return not (False in check_class_results)
 
 
+class _NativeDecodingUnsupported(Exception):
+  """Raised by the native decoder for inputs which only jsonpickle knows how to reconstruct."""
+
+
+_JSON_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+_object_setattr = object.__setattr__
+
+
+def _decode_json_value(value):
+  value_type = type(value)
+  if value_type in _JSON_SCALAR_TYPES:
+    return value
+  elif value_type is dict:
+    return _decode_json_dict(input_dict=value)
+  elif value_type is list or value_type is tuple:
+    return [_decode_json_value(item) for item in value]
+  else:
+    # Subclasses of the above, sets, already decoded objects etc..
+    raise _NativeDecodingUnsupported(value_type)
+
+
+def _decode_json_dict(input_dict, omitted_key=None):
+  """Construct a JsonObject (or a plain dict) from a json-like dict in a single walk, using :py:data:`json_class_index`.
+
+  Mirrors what jsonpickle does with our dicts (after jsonClass is translated to py/object): the constructor is not called, attributes are set directly, tuples become lists.
+  """
+  wire_type = input_dict.get(TYPE_FIELD, None)
+  state = {}
+  for key, value in input_dict.items():
+    if type(key) is not str or key[:3] == "py/" or (key[:2] == "__" and wire_type):
+      raise _NativeDecodingUnsupported(key)
+    if key == TYPE_FIELD or key == omitted_key:
+      continue
+    state[key] = value if type(value) in _JSON_SCALAR_TYPES else _decode_json_value(value)
+  if not wire_type:
+    return state
+  obj_class = json_class_index[wire_type]
+  obj = obj_class.__new__(obj_class)
+  if obj_class.__setattr__ is _object_setattr:
+    obj.__dict__ = state
+  else:
+    for key, value in state.items():
+      setattr(obj, key, value)
+  return obj
+
+
+def _decode_via_jsonpickle(input_dict):
+  """The original (slower) deserialization route - a fallback for values the native decoder does not handle."""
+  dict_without_id = deepcopy(input_dict)
+  dict_without_id.pop("_id", None)
+  _set_jsonpickle_type_recursively(obj=dict_without_id, json_class_index=json_class_index)
+  return jsonpickle.decode(json.dumps(dict_without_id))
+
+
+#: JsonObject subclass -> function emitting its json map. Populated lazily by :func:`_get_json_map_encoder`.
+_json_map_encoders = {}
+
+
+def _get_json_map_encoder(obj_class):
+  encoder = _json_map_encoders.get(obj_class, None)
+  if encoder is None:
+    encoder = _make_json_map_encoder(obj_class)
+    _json_map_encoders[obj_class] = encoder
+  return encoder
+
+
+def _make_json_map_encoder(obj_class):
+  """Produce a function which emits the final wire dict for an obj_class instance in one traversal of its attributes, with the wire type id looked up just once per class.
+
+  None-valued entries are elided (when asked), tuples become lists, keys are stringified and floats are rounded (when a precision is given) - all inline.
+  """
+  wire_typeid = obj_class.get_wire_typeid()
+
+  def encode(obj, omit_none_values, floating_point_precision):
+    json_map = _encode_json_dict(obj.__dict__, omit_none_values, floating_point_precision)
+    json_map[TYPE_FIELD] = wire_typeid
+    return json_map
+
+  return encode
+
+
+def _encode_json_dict(input_dict, omit_none_values, floating_point_precision):
+  json_map = {}
+  for key, value in input_dict.items():
+    if key is None:
+      continue
+    # Protected attributes (other than _id) are not serialized.
+    if key.startswith("_") and key != "_id":
+      continue
+    if value is None and omit_none_values:
+      continue
+    if type(key) is not str:
+      key = str(key)
+    value_type = type(value)
+    if value_type is str or value_type is int or value_type is bool or value is None:
+      json_map[key] = value
+    else:
+      json_map[key] = _encode_json_value(value, omit_none_values, floating_point_precision)
+  return json_map
+
+
+def _encode_json_value(value, omit_none_values, floating_point_precision):
+  value_type = type(value)
+  if value_type is str or value_type is int or value_type is bool or value is None:
+    return value
+  elif value_type is float:
+    return value if floating_point_precision is None else round(value, floating_point_precision)
+  elif isinstance(value, dict):
+    return _encode_json_dict(value, omit_none_values, floating_point_precision)
+  elif isinstance(value, (tuple, list)):
+    return [_encode_json_value(item, omit_none_values, floating_point_precision) for item in value]
+  elif isinstance(value, JsonObject):
+    return _get_json_map_encoder(value.__class__)(value, omit_none_values, floating_point_precision)
+  elif floating_point_precision is not None and isinstance(value, float):
+    return round(value, floating_point_precision)
+  else:
+    return value
+
+
+#: Counts of validation passes and of JsonObject nodes checked against their schemas by :meth:`JsonObject.validate_schema`.
+schema_validation_stats = Counter()
+
+_validation_context = threading.local()
+
+
+def _get_active_validation_node_ids():
+  """ids of objects whose schemas are checked by validation passes in progress (in this thread)."""
+  if getattr(_validation_context, "node_ids", None) is None:
+    _validation_context.node_ids = set()
+  return _validation_context.node_ids
+
+
+class _SchemaValidationPass(object):
+  """Validates a JsonObject and the JsonObjects nested in its attributes, visiting each node once.
+
+  The root is serialized once. Every node's map is then checked against its own class's schema - nested node maps being checked only at their top level, as they get their own turn. So, each map is examined at most twice (as a node and as a child), rather than once per ancestor.
+  """
+
+  def __init__(self, root):
+    self.root = root
+    self.root_map = root.to_json_map()
+    self.root_map.pop("_id", None)
+    # (obj, json_map) pairs in pre-order.
+    self.nodes = []
+    # (obj, is_detached) pairs in post-order. Detached objects are not part of root_map (eg. protected attributes), and get their own pass.
+    self.post_order_nodes = []
+
+  def _collect(self, obj, obj_map):
+    self.nodes.append((obj, obj_map))
+    for key, value in obj.__dict__.items():
+      if not isinstance(value, (JsonObject, list)):
+        continue
+      value_map = obj_map.get(key, None) if isinstance(key, str) and (not key.startswith("_") or key == "_id") else None
+      for index, child in enumerate(value if isinstance(value, list) else [value]):
+        if not isinstance(child, JsonObject):
+          continue
+        child_map = value_map[index] if isinstance(value, list) and isinstance(value_map, list) else value_map
+        if isinstance(child_map, dict):
+          self._collect(child, child_map)
+        else:
+          self.post_order_nodes.append((child, True))
+    if obj is not self.root:
+      self.post_order_nodes.append((obj, False))
+
+  def _raise_validation_error(self, obj, obj_map):
+    # Prefer the error which validating the entire root map would produce (as used to be done).
+    error = best_match(self.root.get_schema_validator().jsonschema_validator.iter_errors(self.root_map))
+    if error is not None:
+      raise error
+    obj.get_schema_validator().validate(obj_map)
+
+  def run(self):
+    self._collect(self.root, self.root_map)
+    node_ids = set(id(obj_map) for _, obj_map in self.nodes)
+    for obj, obj_map in self.nodes:
+      if not obj.get_schema_validator().is_valid(obj_map, node_ids=node_ids):
+        self._raise_validation_error(obj=obj, obj_map=obj_map)
+      schema_validation_stats["nodes"] += 1
+    schema_validation_stats["passes"] += 1
+
+    # Subobjects could have specialized validation rules, specified using validate_schema overrides. Hence we specially call those methods.
+    active_node_ids = _get_active_validation_node_ids()
+    newly_active_node_ids = set(id(obj) for obj, _ in self.nodes) - active_node_ids
+    active_node_ids.update(newly_active_node_ids)
+    try:
+      for obj, is_detached in self.post_order_nodes:
+        if is_detached or obj.__class__.validate_schema is not JsonObject.validate_schema:
+          obj.validate_schema()
+    finally:
+      active_node_ids.difference_update(newly_active_node_ids)
+
+
 def recursively_merge_json_schemas(a, b, json_path=""):
   assert a.__class__ == b.__class__, str(a.__class__) + " vs " + str(b.__class__)
 
@@ -125,6 +319,7 @@ class JsonObject(object):
     All other deserialization methods should use this.
     Note that this assumes that json_class_index is populated properly!
     Note that constructor is NOT called and variable initializations therein won't take effect.
+    The dict is walked once and objects are built directly; jsonpickle is only used as a fallback for values the native decoder does not understand (eg. py/ tags, non-string keys).
 
     - ``from sanskrit_data.schema import *`` before using this should take care of it.
 
@@ -136,12 +331,11 @@ class JsonObject(object):
     if TYPE_FIELD not in input_dict:
       logging.error("no type field: " + str(input_dict))
       raise ValueError(str(input_dict))
-    dict_without_id = deepcopy(input_dict)
-    _id = dict_without_id.pop("_id", None)
-
-    _set_jsonpickle_type_recursively(obj=dict_without_id, json_class_index=json_class_index)
-
-    new_obj = jsonpickle.decode(json.dumps(dict_without_id))
+    _id = input_dict.get("_id", None)
+    try:
+      new_obj = _decode_json_dict(input_dict=input_dict, omitted_key="_id")
+    except _NativeDecodingUnsupported:
+      new_obj = _decode_via_jsonpickle(input_dict=input_dict)
     for key, value in kwargs.items():
       setattr(new_obj, key, value)
     # logging.debug(new_obj.__class__)
@@ -149,6 +343,16 @@ class JsonObject(object):
       new_obj._id = str(_id)
     return new_obj
 
+  @staticmethod
+  def make_from_db_dict(input_dict, db_interface):
+    """Like :meth:`make_from_dict`, for dicts got from db_interface - but reusing objects already decoded in its :class:`~sanskrit_data.db.identity_map.IdentityMap`, if one is in use."""
+    if input_dict is None:
+      return None
+    identity_map = db_interface.get_identity_map() if db_interface is not None else None
+    if identity_map is None:
+      return JsonObject.make_from_dict(input_dict)
+    return identity_map.get_or_decode(input_dict=input_dict, decode=JsonObject.make_from_dict)
+
   @classmethod
   def make_from_dict_list(cls, input_dict_list):
     assert isinstance(input_dict_list, list)
@@ -177,39 +381,77 @@ class JsonObject(object):
   def read_from_file(cls, filename, name_to_json_class_index_extra=None, **kwargs):
     """
     
-    :param filename: the file which should be read.
+    :param filename: the file which should be read. A JSON Lines (.jsonl) file is read whole, into a list - use :meth:`iter_from_jsonl` to stream large ones.
     :param name_to_json_class_index_extra: An optional dictionary mapping names to class objects. For example: {"Panchangam": annual.Panchangam}  
     :return: 
     """
     if name_to_json_class_index_extra is not None:
       json_class_index.update(name_to_json_class_index_extra)
+    if filename.endswith(".jsonl"):
+      return list(cls.iter_from_jsonl(path=filename))
     try:
       with open(filename) as fhandle:
-        format = ".".join(filename.split(".")[1:])
         data = fhandle.read()
-        if "json" in format:
-          input_dict = jsonpickle.decode(data)
-        elif "toml" in format:
-          try:
-            input_dict = toml.loads(data)
-            # Many bugs above.
-          except TomlDecodeError as e:
-            import qtoml
-            input_dict = qtoml.loads(data)
-        obj = cls.make_from_dict(input_dict=input_dict, **kwargs)
-        obj.post_load_ops()
-        return obj
+      format = ".".join(filename.split(".")[1:])
+      if "toml" in format:
+        try:
+          input_dict = toml.loads(data)
+          # Many bugs above.
+        except TomlDecodeError as e:
+          import qtoml
+          input_dict = qtoml.loads(data)
+      else:
+        input_dict = jsonpickle.decode(data)
+      if isinstance(input_dict, list):
+        return cls.make_from_dict_list(input_dict)
+      obj = cls.make_from_dict(input_dict=input_dict, **kwargs)
+      obj.post_load_ops()
+      return obj
     except Exception as e:
-      try:
-        import traceback
-        traceback.print_exc()
-        logging.info("Could not load as a dict. May be a list of dicts. Trying..")
-        with open(filename) as fhandle:
-          obj = cls.make_from_dict_list(jsonpickle.decode(fhandle.read()))
-          return obj
-      except Exception as e:
-        logging.error("Error reading " + filename + " : ".format(e))
-        raise e
+      logging.error("Error reading %s : %s", filename, e)
+      raise e
+
+  @classmethod
+  def iter_from_jsonl(cls, path, name_to_json_class_index_extra=None):
+    """Lazily read a JSON Lines file (as written by :meth:`dump_to_jsonl`) - one object per line, so that memory use does not grow with the file.
+
+    :param path: the file which should be read. Blank lines are skipped.
+    :param name_to_json_class_index_extra: As in :meth:`read_from_file`.
+    :return: A generator of JsonObjects.
+    """
+    if name_to_json_class_index_extra is not None:
+      json_class_index.update(name_to_json_class_index_extra)
+    with open(path, encoding="utf-8") as fhandle:
+      for line_number, line in enumerate(fhandle, 1):
+        if not line.strip():
+          continue
+        try:
+          obj = cls.make_from_dict(input_dict=json.loads(line))
+        except ValueError as e:
+          raise ValueError("Error reading %s line %d: %s" % (path, line_number, e))
+        obj.post_load_ops()
+        yield obj
+
+  @staticmethod
+  def dump_to_jsonl(objects, path, append=False, floating_point_precision=None, sort_keys=True):
+    """Write objects to a JSON Lines file, one compact JSON map per line - streaming, so objects may be a generator.
+
+    :param objects: JsonObjects, or JSON maps (eg. docs got from a db).
+    :param path: The file to be written.
+    :param append: Whether to add to the end of an existing file, rather than overwriting it.
+    :return: The number of objects written.
+    """
+    import os
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    num_objects = 0
+    with open(path, "a" if append else "w", encoding="utf-8") as fhandle:
+      for obj in objects:
+        json_map = obj.to_json_map(floating_point_precision=floating_point_precision) if isinstance(obj, JsonObject) else obj
+        fhandle.write(json.dumps(json_map, ensure_ascii=False, sort_keys=sort_keys, separators=(",", ":")))
+        fhandle.write("\n")
+        num_objects += 1
+    return num_objects
 
   def dump_to_file(self, filename: str, floating_point_precision: int = None, sort_keys: bool = True) -> None:
     try:
@@ -226,6 +468,11 @@ class JsonObject(object):
   def get_wire_typeid(cls):
     return cls.__name__
 
+  @classmethod
+  def get_wire_typeids_including_subclasses(cls):
+    """Wire typeids of this class and of its subclasses known to :py:data:`json_class_index`."""
+    return sorted(set([cls.get_wire_typeid()] + [obj_class.get_wire_typeid() for obj_class in json_class_index.values() if isinstance(obj_class, type) and issubclass(obj_class, cls)]))
+
   @classmethod
   def get_jsonpickle_typeid(cls):
     return cls.__module__ + "." + cls.__name__
@@ -240,11 +487,83 @@ class JsonObject(object):
     return os.path.join(db_interface.external_file_store, self._id)
 
   def list_files(self, db_interface, suffix_pattern="*"):
+    blob_store = getattr(db_interface, "blob_store", None)
+    if blob_store is not None:
+      return blob_store.list_files(obj_id=self._id, suffix_pattern=suffix_pattern)
+    file_listing_cache = getattr(db_interface, "file_listing_cache", None)
+    if file_listing_cache is not None:
+      return file_listing_cache.list_files(dir_name=self._id, suffix_pattern=suffix_pattern)
     import glob
     import os
     file_list = glob.glob(pathname=os.path.join(self.get_external_storage_path(db_interface=db_interface), suffix_pattern))
     return [os.path.basename(f) for f in file_list]
 
+  @staticmethod
+  def list_files_many(objects, db_interface, suffix_pattern="*"):
+    """See :meth:`list_files`.
+
+    :return: A map from the _id of each of objects to the names of its files - listed in one pass over the store, if a file listing cache is in use (see :meth:`~sanskrit_data.db.interfaces.DbInterface.use_file_listing_cache`).
+    """
+    file_listing_cache = getattr(db_interface, "file_listing_cache", None)
+    if file_listing_cache is not None and getattr(db_interface, "blob_store", None) is None:
+      return file_listing_cache.list_files_many(dir_names=[obj._id for obj in objects], suffix_pattern=suffix_pattern)
+    return {obj._id: obj.list_files(db_interface=db_interface, suffix_pattern=suffix_pattern) for obj in objects}
+
+  def get_file_path(self, db_interface, file_name):
+    """Get the path of a file associated with this object (see :meth:`list_files`) - not to be modified in place."""
+    blob_store = getattr(db_interface, "blob_store", None)
+    if blob_store is not None:
+      return blob_store.get_file_path(obj_id=self._id, file_name=file_name)
+    import os
+    return os.path.join(self.get_external_storage_path(db_interface=db_interface), file_name)
+
+  def store_file(self, db_interface, source_path, file_name=None):
+    """Associate a copy of the file at source_path with this object.
+
+    :param file_name: Defaults to the base name of source_path.
+    """
+    import os
+    file_name = file_name or os.path.basename(source_path)
+    blob_store = getattr(db_interface, "blob_store", None)
+    if blob_store is not None:
+      blob_store.add_file(obj_id=self._id, source_path=source_path, file_name=file_name)
+      return
+    import shutil
+    os.makedirs(name=self.get_external_storage_path(db_interface=db_interface), exist_ok=True)
+    dest_path = os.path.join(self.get_external_storage_path(db_interface=db_interface), file_name)
+    # Replaced rather than rewritten in place, since the old file may be memory mapped (see open_file_view).
+    shutil.copyfile(source_path, dest_path + ".tmp")
+    os.replace(dest_path + ".tmp", dest_path)
+    if getattr(db_interface, "file_listing_cache", None) is not None:
+      db_interface.file_listing_cache.invalidate(dir_name=self._id)
+
+  def open_file_view(self, db_interface, file_name, offset=0, length=None):
+    """A context manager giving a read only memoryview of a byte range of a file associated with this object (see :meth:`list_files`) - memory mapped, rather than read. See :meth:`~sanskrit_data.db.file_handle_pool.FileHandlePool.open_view`.
+
+    :param length: Defaults to the rest of the file.
+    """
+    file_path = self.get_file_path(db_interface=db_interface, file_name=file_name)
+    if file_path is None:
+      raise FileNotFoundError("%s has no file %s" % (self._id, file_name))
+    return db_interface.get_file_handle_pool().open_view(path=file_path, offset=offset, length=length)
+
+  def read_file_range(self, db_interface, file_name, offset=0, length=None):
+    """:return: A byte range of a file associated with this object (see :meth:`open_file_view`), as a bytes object."""
+    with self.open_file_view(db_interface=db_interface, file_name=file_name, offset=offset, length=length) as view:
+      return view.tobytes()
+
+  def delete_files(self, db_interface):
+    """Delete the files associated with this object."""
+    blob_store = getattr(db_interface, "blob_store", None)
+    if blob_store is not None:
+      # The blobs are reclaimed by BlobStore.gc.
+      blob_store.remove_files(obj_id=self._id)
+    if db_interface.external_file_store is not None:
+      import shutil
+      shutil.rmtree(path=self.get_external_storage_path(db_interface=db_interface), ignore_errors=True)
+      if getattr(db_interface, "file_listing_cache", None) is not None:
+        db_interface.file_listing_cache.invalidate(dir_name=self._id)
+
   def set_type(self):
     # self.class_type = str(self.__class__.__name__)
     setattr(self, TYPE_FIELD, self.__class__.get_wire_typeid())
@@ -282,18 +601,9 @@ class JsonObject(object):
     So, the type must be properly set.
     Many functions accept such json maps, just as they accept strings.
     """
-    json_map = collection_helper.dictify(self, omit_none_values=self._default_to_none)
-    if self._default_to_none:
-      json_map = collection_helper.remove_dict_none_values(json_map)
-    json_map = tuples_to_lists(json_map)
-    # Sometimes values may be ugly dicts.
-    json_map = collection_helper.remove_none_keys(json_map)
-    json_map = collection_helper.stringify_keys(json_map)
-    if floating_point_precision is not None:
-      rounded = round_floats(json_map, floating_point_precision=floating_point_precision)
-      return rounded
-    else:
-      return json_map
+    # The output is what collection_helper.dictify followed by remove_dict_none_values, tuples_to_lists, remove_none_keys, stringify_keys and round_floats would produce - but built in a single traversal.
+    encoder = _get_json_map_encoder(self.__class__)
+    return encoder(self, bool(self._default_to_none), floating_point_precision)
 
 
   def __eq__(self, other):
@@ -323,27 +633,46 @@ class JsonObject(object):
     return dict1 == dict2
 
   def match_filter(self, find_filter):
-    flat_json_map = collection_helper.flatten_dict(self.to_json_map())
-    for key, value in iter(find_filter.items()):
-      value_at_key = flat_json_map.get(key, None)
-      if isinstance(value_at_key, list) and isinstance(value, dict) and value.get("$elemMatch", None) is not None:
-        jo_values = [JsonObject.make_from_dict(item) for item in value_at_key]
-        filtered_values = [item for item in jo_values if item.match_filter(value.get("$elemMatch", None))]
-        if len(filtered_values) == 0:
-          return False
-      elif value_at_key != value:
-        return False
-    return True
+    """Does the JSON serialization of this object match find_filter (a mango or mongo query)? See :py:mod:`~sanskrit_data.db.query_matcher`."""
+    from sanskrit_data.db import query_matcher
+    return query_matcher.compile_filter(find_filter)(self.to_json_map())
 
+  def prepare_for_update(self, db_interface, user=None):
+    """Do JSON validation (and any other setup needed) before writing to database.
 
-  def update_collection(self, db_interface, user=None):
-    """Do JSON validation and write to database."""
+    :return: The JSON map to be written.
+    """
     if getattr(self, "schema", None) is not None:
       self.validate(db_interface=db_interface, user=user)
-    updated_doc = db_interface.update_doc(self.to_json_map())
-    updated_obj = JsonObject.make_from_dict(updated_doc)
+    return self.to_json_map()
+
+  def update_collection(self, db_interface, user=None):
+    """Do JSON validation and write to database."""
+    updated_doc = db_interface.update_doc(self.prepare_for_update(db_interface=db_interface, user=user))
+    updated_obj = JsonObject.make_from_db_dict(updated_doc, db_interface=db_interface)
     return updated_obj
 
+  @staticmethod
+  def update_collection_in_bulk(objects, db_interface, user=None):
+    """Like :meth:`update_collection`, for several objects - all validated before being written using a single :meth:`~sanskrit_data.db.interfaces.DbInterface.update_docs` call.
+
+    :return: The updated objects, in the same order.
+    """
+    docs = [obj.prepare_for_update(db_interface=db_interface, user=user) for obj in objects]
+    return [JsonObject.make_from_db_dict(updated_doc, db_interface=db_interface) for updated_doc in db_interface.update_docs(docs)]
+
+  async def update_collection_async(self, db_interface, user=None):
+    """Like :meth:`update_collection`, with an :class:`~sanskrit_data.db.interfaces.AsyncDbInterface`. Validation runs via its run_with_sync_interface."""
+    doc = await db_interface.run_with_sync_interface(lambda sync_db_interface: self.prepare_for_update(db_interface=sync_db_interface, user=user))
+    updated_doc = await db_interface.update_doc(doc)
+    return JsonObject.make_from_db_dict(updated_doc, db_interface=db_interface)
+
+  @staticmethod
+  async def update_collection_in_bulk_async(objects, db_interface, user=None):
+    """Like :meth:`update_collection_in_bulk`, with an :class:`~sanskrit_data.db.interfaces.AsyncDbInterface`."""
+    docs = await db_interface.run_with_sync_interface(lambda sync_db_interface: [obj.prepare_for_update(db_interface=sync_db_interface, user=user) for obj in objects])
+    return [JsonObject.make_from_db_dict(updated_doc, db_interface=db_interface) for updated_doc in await db_interface.update_docs(docs)]
+
   def validate_deletion(self, db_interface, user=None):
     if getattr(self, "_id", None) is None:
       raise ValidationError("_id not present!")
@@ -357,9 +686,8 @@ class JsonObject(object):
     :return:
     """
     self.validate_deletion(db_interface=db_interface, user=user)
-    import shutil
     db_interface.delete_doc(self._id)
-    shutil.rmtree(path=self.get_external_storage_path(db_interface=db_interface), ignore_errors=True)
+    self.delete_files(db_interface=db_interface)
 
   def validate(self, db_interface=None, user=None):
     """Validate the JSON serialization of this object using the schema member. Called before database writes.
@@ -372,23 +700,27 @@ class JsonObject(object):
     """
     self.validate_schema()
 
+  @classmethod
+  def get_schema_validator(cls):
+    """Get a validator for cls.schema - compiled upon first use and cached on the class."""
+    validator = getattr(cls, "_schema_validator", None)
+    if validator is None or validator.schema is not cls.schema:
+      validator = CompiledSchemaValidator(schema=cls.schema)
+      cls._schema_validator = validator
+    return validator
+
   # Override and call this method to add extra validations.
   def validate_schema(self):
-    json_map = self.to_json_map()
-    json_map.pop("_id", None)
-    # logging.debug(str(self))
+    """Validate this object, and the JsonObjects in its attributes (directly or within lists), against their schemas.
+
+    The object is serialized once, and each nested object is visited once (see :class:`_SchemaValidationPass`).
+    validate_schema overrides of nested objects are called too (children before parents) - within them, the super() call returns immediately as the schema check is already done.
+    """
+    if id(self) in _get_active_validation_node_ids():
+      return
+    validation_pass = _SchemaValidationPass(root=self)
     try:
-      jsonschema.validate(json_map, self.schema)
-
-      # Subobjects could have specialized validation rules, specified using validate_schema overrides. Hence we specially call those methods.
-      for key, value in iter(self.__dict__.items()):
-        # logging.debug("%s %s", key, value)
-        if isinstance(value, JsonObject):
-          value.validate_schema()
-        elif isinstance(value, list):
-          json_map[key] = [item.validate_schema() if isinstance(item, JsonObject) else item for item in value]
-        else:
-          pass
+      validation_pass.run()
     except SchemaError as e:
       logging.error("Exception message: " + e.message)
       logging.error("Schema is: " + jsonpickle.dumps(self.schema))
@@ -401,7 +733,7 @@ class JsonObject(object):
       logging.error("Schema is: " + jsonpickle.dumps(self.schema))
       logging.error("Context is: " + str(e.context))
       logging.error("Best match is: " + str(best_match(errors=[e])))
-      logging.error("json_map is: " + jsonpickle.dumps(json_map))
+      logging.error("json_map is: " + jsonpickle.dumps(validation_pass.root_map))
       raise e
 
   # noinspection PyShadowingBuiltins
@@ -411,9 +743,16 @@ class JsonObject(object):
     item_dict = db_interface.find_by_id(id=id)
     item = None
     if item_dict is not None:
-      item = cls.make_from_dict(item_dict)
+      item = cls.make_from_db_dict(item_dict, db_interface=db_interface)
     return item
 
+  # noinspection PyShadowingBuiltins
+  @classmethod
+  async def from_id_async(cls, id, db_interface):
+    """Like :meth:`from_id`, with an :class:`~sanskrit_data.db.interfaces.AsyncDbInterface`."""
+    item_dict = await db_interface.find_by_id(id=id)
+    return cls.make_from_db_dict(item_dict, db_interface=db_interface)
+
   @classmethod
   def add_indexes(cls, db_interface):
     db_interface.add_index(keys_dict={
@@ -464,8 +803,15 @@ class Target(JsonObject):
 
   @classmethod
   def check_target_classes(cls, targets_to_check, db_interface, allowed_types, targeting_obj):
-    for target in targets_to_check:
-      target.check_target_class(db_interface=db_interface, allowed_types=allowed_types, targeting_obj=targeting_obj)
+    """Like :meth:`check_target_class` for each target, but looking all the target entities up together."""
+    if db_interface is None or len(targets_to_check) == 0:
+      return
+    target_dicts = db_interface.find_by_ids(ids=[target.container_id for target in targets_to_check])
+    for target_dict in target_dicts:
+      target_entity = JsonObject.make_from_db_dict(target_dict, db_interface=db_interface)
+      if not check_class(obj=target_entity, allowed_types=allowed_types):
+        raise TargetValidationError(allowed_types=allowed_types, targeting_obj=targeting_obj,
+                                    target_obj=target_entity)
 
   @classmethod
   def from_details(cls, container_id):
@@ -607,9 +953,9 @@ class UllekhanamJsonObject(JsonObject):
           if user is not None and not user.is_admin(service=db_interface.db_name_frontend):
             raise ValidationError("{} cannot take over {}'s annotation for editing or deleting under a non-admin user {}'s authority".format(self.source.id, old_obj.source.id, user.get_first_user_id_or_none))
 
-  def update_collection(self, db_interface, user=None):
+  def prepare_for_update(self, db_interface, user=None):
     self.source.setup_source(db_interface=db_interface, user=user)
-    return super(UllekhanamJsonObject, self).update_collection(db_interface=db_interface, user=user)
+    return super(UllekhanamJsonObject, self).prepare_for_update(db_interface=db_interface, user=user)
 
   def validate_deletion_ignoring_targetters(self, db_interface, user=None):
     super(UllekhanamJsonObject, self).validate_deletion(db_interface=db_interface, user=user)
@@ -640,23 +986,35 @@ class UllekhanamJsonObject(JsonObject):
     self.source.validate(db_interface=db_interface, user=user)
     self.detect_illegal_takeover(db_interface=db_interface, user=user)
 
-  # noinspection PyTypeHints
-  def get_targetting_entities(self, db_interface, entity_type=None):
-    """
+  @staticmethod
+  def get_targetting_entities_filter(container_id_condition, entity_type=None):
+    """A find filter for entities targetting some container(s).
 
-    :type entity_type: str
+    :param container_id_condition: A container id, or a condition like {"$in": [...]}.
+    :param str entity_type: If not None, only entities of this type (or its subclasses) are matched.
     """
-    # Alas, the below shows that no index is used:
+    # Alas, the below shows that no index is used by CouchDB (InMemoryDb does use its target_index):
     # curl -sg vedavaapi.org:5984/vedavaapi_ullekhanam_db/_explain -H content-type:application/json -d '{"selector": {"targets": {"$elemMatch": {"container_id": "4b9f454f5aa5414e82506525d015ac68"}}}}'|jq
-    # TODO: Use index.
     find_filter = {
       "targets": {
         "$elemMatch": {
-          "container_id": str(self._id)
+          "container_id": container_id_condition
         }
       }
     }
-    targetting_objs = [JsonObject.make_from_dict(item) for item in db_interface.find(find_filter)]
+    if entity_type is not None:
+      # Filter by class within the database, rather than after decoding.
+      find_filter["jsonClass"] = {"$in": json_class_index[entity_type].get_wire_typeids_including_subclasses()}
+    return find_filter
+
+  # noinspection PyTypeHints
+  def get_targetting_entities(self, db_interface, entity_type=None):
+    """
+
+    :type entity_type: str
+    """
+    find_filter = UllekhanamJsonObject.get_targetting_entities_filter(container_id_condition=str(self._id), entity_type=entity_type)
+    targetting_objs = [JsonObject.make_from_db_dict(item, db_interface=db_interface) for item in db_interface.find(find_filter)]
     if entity_type is not None:
       targetting_objs = list(filter(lambda obj: isinstance(obj, json_class_index[entity_type]), targetting_objs))
     return targetting_objs
@@ -728,19 +1086,44 @@ class JsonObjectNode(JsonObject):
     return node
 
   def update_collection(self, db_interface, user=None):
-    """Special info: Mutates this object."""
+    """Special info: Mutates this object.
+
+    The tree is written level by level, with one :meth:`~sanskrit_data.db.interfaces.DbInterface.update_docs` call per level.
+    """
     # But we don't call self.validate() as child.content.targets (required of Annotations) mayn't be set.
     self.validate_children_types()
-    # The content is validated within the below call.
-    self.content = self.content.update_collection(db_interface=db_interface, user=user)
-    for child in self.children:
-      # Initialize the target array if it does not already exist.
-      if (getattr(child.content, "targets", None) is None) or child.content.targets is None or len(child.content.targets) == 0:
-        child.content.targets = [child.content.target_class()]
+    level_nodes = [self]
+    while len(level_nodes) > 0:
+      # The contents are validated within the below call.
+      updated_contents = JsonObject.update_collection_in_bulk(objects=[node.content for node in level_nodes], db_interface=db_interface, user=user)
+      level_nodes = JsonObjectNode._set_updated_contents(nodes=level_nodes, updated_contents=updated_contents)
+
+  async def update_collection_async(self, db_interface, user=None):
+    """Like :meth:`update_collection`, with an :class:`~sanskrit_data.db.interfaces.AsyncDbInterface`."""
+    self.validate_children_types()
+    level_nodes = [self]
+    while len(level_nodes) > 0:
+      updated_contents = await JsonObject.update_collection_in_bulk_async(objects=[node.content for node in level_nodes], db_interface=db_interface, user=user)
+      level_nodes = JsonObjectNode._set_updated_contents(nodes=level_nodes, updated_contents=updated_contents)
 
-      assert len(child.content.targets) == 1
-      child.content.targets[0].container_id = str(self.content._id)
-      child.update_collection(db_interface=db_interface, user=user)
+  @staticmethod
+  def _set_updated_contents(nodes, updated_contents):
+    """Set the written contents of nodes, and make their children target them.
+
+    :return: The children, to be written next.
+    """
+    next_level_nodes = []
+    for node, updated_content in zip(nodes, updated_contents):
+      node.content = updated_content
+      for child in node.children:
+        # Initialize the target array if it does not already exist.
+        if (getattr(child.content, "targets", None) is None) or child.content.targets is None or len(child.content.targets) == 0:
+          child.content.targets = [child.content.target_class()]
+
+        assert len(child.content.targets) == 1
+        child.content.targets[0].container_id = str(node.content._id)
+        next_level_nodes.append(child)
+    return next_level_nodes
 
   def affected_user_ids(self):
     if getattr(self, "content", None) is None:
@@ -752,35 +1135,116 @@ class JsonObjectNode(JsonObject):
       user_ids = user_ids + child.affected_user_ids()
     return user_ids
 
-  def validate_deletion(self, db_interface, user=None):
-    # Deliberately not calling super.validate_deletion - the node does not exist in the database.
+  def _validate_contents_deletion(self, db_interface, user=None):
+    """Validate deletion of the contents of this node and its descendents - ignoring entities targetting them, which are expected to be deleted along with them."""
     if getattr(self, "content", None) is None:
       raise ValidationError("This is a node with no content! Not allowed.")
-    self.content.validate_deletion_ignoring_targetters(db_interface=db_interface, user=user)
+    if isinstance(self.content, UllekhanamJsonObject):
+      self.content.validate_deletion_ignoring_targetters(db_interface=db_interface, user=user)
+    else:
+      self.content.validate_deletion(db_interface=db_interface, user=user)
     for child in self.children:
-      child.validate_deletion(db_interface=db_interface, user=user)
+      child._validate_contents_deletion(db_interface=db_interface, user=user)
     self.content = JsonObject.from_id(id = self.content._id, db_interface=db_interface)
+
+  def validate_deletion(self, db_interface, user=None):
+    # Deliberately not calling super.validate_deletion - the node does not exist in the database.
+    self._validate_contents_deletion(db_interface=db_interface, user=user)
     affected_users = self.affected_user_ids()
     # logging.debug(affected_users)
-    if len(set(affected_users)) > 2 and not user.is_admin(service=db_interface.db_name_frontend):
+    if len(set(affected_users)) > 2 and user is not None and not user.is_admin(service=db_interface.db_name_frontend):
       raise ValidationError("This deletion affects more than 2 other users. Only admins can do that.")
 
+  def get_contents_post_order(self):
+    """Contents of the descendents of this node (children before their parents), followed by this node's content."""
+    contents = []
+    for child in self.children:
+      contents.extend(child.get_contents_post_order())
+    contents.append(self.content)
+    return contents
+
   def delete_in_collection(self, db_interface, user=None):
+    if getattr(self, "content", None) is None:
+      raise ValidationError("This is a node with no content! Not allowed.")
+    self.fill_descendents(db_interface=db_interface, depth=None)
+    # The whole tree is validated before anything is deleted.
     self.validate_deletion(db_interface=db_interface, user=user)
-    self.fill_descendents(db_interface=db_interface, depth=100)
-    for child in self.children:
-      child.delete_in_collection(db_interface=db_interface, user=user)
-    # Delete or disconnect children before deleting oneself.
-    self.content.delete_in_collection(db_interface=db_interface, user=user)
+    # Delete or disconnect children before deleting oneself - all with one delete_docs call. (Entities targetting several nodes are in the tree more than once.)
+    contents = self.get_contents_post_order()
+    db_interface.delete_docs(doc_ids=list(dict.fromkeys(content._id for content in contents)))
+    for content in contents:
+      content.delete_files(db_interface=db_interface)
 
   def fill_descendents(self, db_interface, depth=10, entity_type=None):
-    targetting_objs = self.content.get_targetting_entities(db_interface=db_interface, entity_type=entity_type)
+    """Set children to nodes of entities targetting this node's content - recursively, upto depth levels (or all the way down, if depth is None).
+
+    The tree is filled breadth-first, using one find query per level. Entities already in the tree (say, targetting one another in a cycle) are not looked under again.
+    """
+    self.children = []
+    level_nodes = [self]
+    expanded_ids = set()
+    for _ in (itertools.count() if depth is None else range(depth)):
+      nodes_by_content_id = JsonObjectNode._get_nodes_by_content_id(nodes=level_nodes, excluded_ids=expanded_ids)
+      if not nodes_by_content_id:
+        break
+      find_filter = UllekhanamJsonObject.get_targetting_entities_filter(container_id_condition={"$in": list(nodes_by_content_id)}, entity_type=entity_type)
+      level_nodes = JsonObjectNode._add_targetting_children(nodes_by_content_id=nodes_by_content_id, items=db_interface.find(find_filter), db_interface=db_interface, entity_type=entity_type)
+
+  async def fill_descendents_async(self, db_interface, depth=10, entity_type=None, max_ids_per_query=100):
+    """Like :meth:`fill_descendents`, with an :class:`~sanskrit_data.db.interfaces.AsyncDbInterface`.
+
+    Each level is filled using find queries for upto max_ids_per_query of its nodes, run concurrently - so that (many) sibling subtrees are fetched concurrently.
+    """
+    import asyncio
+
+    async def find_all(find_filter):
+      return [item async for item in db_interface.find(find_filter)]
+
     self.children = []
-    if depth > 0:
-      for targetting_obj in targetting_objs:
-        child = JsonObjectNode.from_details(content=targetting_obj)
-        child.fill_descendents(db_interface=db_interface, depth=depth - 1, entity_type=entity_type)
-        self.children.append(child)
+    level_nodes = [self]
+    expanded_ids = set()
+    for _ in (itertools.count() if depth is None else range(depth)):
+      nodes_by_content_id = JsonObjectNode._get_nodes_by_content_id(nodes=level_nodes, excluded_ids=expanded_ids)
+      if not nodes_by_content_id:
+        break
+      content_ids = list(nodes_by_content_id)
+      item_lists = await asyncio.gather(*[
+        find_all(UllekhanamJsonObject.get_targetting_entities_filter(container_id_condition={"$in": content_ids[start:start + max_ids_per_query]}, entity_type=entity_type))
+        for start in range(0, len(content_ids), max_ids_per_query)])
+      # An item targetting nodes covered by different queries is found more than once.
+      items = dict((item["_id"], item) for item_list in item_lists for item in item_list)
+      level_nodes = JsonObjectNode._add_targetting_children(nodes_by_content_id=nodes_by_content_id, items=items.values(), db_interface=db_interface, entity_type=entity_type)
+
+  @staticmethod
+  def _get_nodes_by_content_id(nodes, excluded_ids):
+    """:return: A map from the content _id-s of nodes (but for excluded_ids) to the nodes - after adding those _id-s to excluded_ids."""
+    nodes_by_content_id = {}
+    for node in nodes:
+      content_id = str(node.content._id)
+      if content_id not in excluded_ids:
+        nodes_by_content_id.setdefault(content_id, []).append(node)
+    excluded_ids.update(nodes_by_content_id)
+    return nodes_by_content_id
+
+  @staticmethod
+  def _add_targetting_children(nodes_by_content_id, items, db_interface, entity_type=None):
+    """Add nodes for items (dicts of entities targetting the contents of some nodes) as children of the nodes they target.
+
+    :return: The added nodes.
+    """
+    child_nodes = []
+    for item in items:
+      container_ids = dict.fromkeys(str(target.get("container_id", None)) for target in item.get("targets", []) if isinstance(target, dict))
+      for container_id in container_ids:
+        for parent in nodes_by_content_id.get(container_id, []):
+          # Each parent gets its own copy of the content, as when they were fetched separately (unless an identity map is in use).
+          targetting_obj = JsonObject.make_from_db_dict(item, db_interface=db_interface)
+          if entity_type is not None and not isinstance(targetting_obj, json_class_index[entity_type]):
+            continue
+          child = JsonObjectNode.from_details(content=targetting_obj)
+          parent.children.append(child)
+          child_nodes.append(child)
+    return child_nodes
 
   def recursively_delete_attr(self, field_name):
     """Rarely useful method: example when the schema of a Class changes to omit a field.
@@ -97,6 +97,8 @@ setup(
   extras_require={
       # 'dev': ['check-manifest'],
       'test': ['pytest'],
+      # Faster incremental JSON parsing in sanskrit_data.json_stream_helper.
+      'streaming': ['ijson'],
   },
 
   # If there are data files included in your packages that need to be
@@ -0,0 +1,34 @@
+"""
+Standalone benchmark scripts (not collected by pytest). Run them like: ``python -m tests.benchmarks.decode_benchmark``.
+"""
+import time
+
+from sanskrit_data.schema import books, common, ullekhanam
+
+
+def make_annotation_corpus(num_annotations, num_pages=100):
+  """Produce json maps (as would be stored in a database) of a book, its pages and TextAnnotations upon those pages."""
+  book = books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha", portion_class="book")
+  book_map = book.to_json_map()
+  book_map["_id"] = "book"
+  corpus = [book_map]
+  for page_index in range(num_pages):
+    page = books.BookPortion.from_details(title="page_%d" % page_index, portion_class="page", targets=[books.BookPositionTarget.from_details(container_id="book", position=page_index)])
+    page_map = page.to_json_map()
+    page_map["_id"] = "page_%d" % page_index
+    corpus.append(page_map)
+  source = common.DataSource.from_details(source_type="system_inferred", id="benchmark")
+  for annotation_index in range(num_annotations):
+    content = common.Text.from_details(script_renderings=[common.ScriptRendering.from_details(text="rAmaH %d" % annotation_index, encoding_scheme="slp1")], language_code="sa")
+    target = common.Target.from_details(container_id="page_%d" % (annotation_index % num_pages))
+    annotation = ullekhanam.TextAnnotation.from_details(targets=[target], source=source, content=content)
+    annotation_map = annotation.to_json_map()
+    annotation_map["_id"] = "annotation_%d" % annotation_index
+    corpus.append(annotation_map)
+  return corpus
+
+
+def time_it(fn, *args, **kwargs):
+  start = time.perf_counter()
+  result = fn(*args, **kwargs)
+  return result, time.perf_counter() - start
@@ -0,0 +1,87 @@
+"""
+Read throughput of :py:class:`~sanskrit_data.db.in_memory.BookPortionsInMemory` with several reader threads and one writer thread, compared with guarding every call with a global lock.
+
+Under CPython's global interpreter lock, pure python readers can't run in parallel, so total throughput stays roughly flat as threads are added - what snapshot isolation buys there is that readers never wait for (or break because of) writers. With a free-threaded python build, reads scale with the number of threads.
+
+Usage: ``python -m tests.benchmarks.concurrent_read_benchmark [num_annotations] [seconds_per_run]``
+"""
+import logging
+import sys
+import threading
+import time
+
+from sanskrit_data.db import in_memory
+from tests.benchmarks import make_annotation_corpus
+
+
+class _GloballyLockedDb(in_memory.BookPortionsInMemory):
+  """Serializes all reads and writes, including the consumption of find results."""
+
+  def __init__(self, db_name_frontend):
+    self.global_lock = threading.RLock()
+    super(_GloballyLockedDb, self).__init__(db_name_frontend=db_name_frontend)
+
+  # noinspection PyShadowingBuiltins
+  def find_by_id(self, id):
+    with self.global_lock:
+      return super(_GloballyLockedDb, self).find_by_id(id)
+
+  def find(self, find_filter):
+    with self.global_lock:
+      return iter(list(super(_GloballyLockedDb, self).find(find_filter)))
+
+  def update_docs(self, docs):
+    with self.global_lock:
+      return super(_GloballyLockedDb, self).update_docs(docs)
+
+
+def measure_reads(db, num_readers, seconds, num_pages=100):
+  """:return: Reads per second by num_readers threads, while another thread keeps updating annotations."""
+  read_counts = [0] * num_readers
+  is_running = [True]
+
+  def read(reader_index):
+    page_index = reader_index
+    while is_running[0]:
+      page_id = "page_%d" % (page_index % num_pages)
+      db.find_by_id(page_id)
+      list(db.find({"targets": {"$elemMatch": {"container_id": page_id}}, "jsonClass": "TextAnnotation"}))
+      read_counts[reader_index] += 2
+      page_index += 1
+
+  def write():
+    annotation_index = 0
+    while is_running[0]:
+      doc = db.find_by_id("annotation_%d" % annotation_index)
+      if doc is None:
+        annotation_index = 0
+        continue
+      db.update_doc(doc)
+      annotation_index += 1
+
+  threads = [threading.Thread(target=read, args=(reader_index,)) for reader_index in range(num_readers)] + [threading.Thread(target=write)]
+  start = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  time.sleep(seconds)
+  is_running[0] = False
+  for thread in threads:
+    thread.join()
+  return sum(read_counts) / (time.perf_counter() - start)
+
+
+def main(num_annotations=20000, seconds_per_run=2):
+  logging.getLogger().setLevel(logging.WARNING)
+  corpus = make_annotation_corpus(num_annotations=num_annotations)
+  snapshot_db = in_memory.BookPortionsInMemory(db_name_frontend="snapshots")
+  locked_db = _GloballyLockedDb(db_name_frontend="locked")
+  for db in (snapshot_db, locked_db):
+    db.update_docs([dict(doc) for doc in corpus])
+  print("documents: %d" % len(corpus))
+  print("%8s %20s %20s" % ("readers", "snapshots reads/s", "global lock reads/s"))
+  for num_readers in (1, 2, 4, 8):
+    print("%8d %20.0f %20.0f" % (num_readers, measure_reads(snapshot_db, num_readers, seconds_per_run), measure_reads(locked_db, num_readers, seconds_per_run)))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,25 @@
+"""
+Decode throughput of :py:meth:`~sanskrit_data.schema.common.JsonObject.make_from_dict` versus the jsonpickle round trip it replaced.
+
+Usage: ``python -m tests.benchmarks.decode_benchmark [num_annotations]``
+"""
+import logging
+import sys
+
+from sanskrit_data.schema import common
+from tests.benchmarks import make_annotation_corpus, time_it
+
+
+def main(num_annotations=20000):
+  logging.getLogger().setLevel(logging.WARNING)
+  corpus = make_annotation_corpus(num_annotations=num_annotations)
+  _, native_seconds = time_it(lambda: [common.JsonObject.make_from_dict(item) for item in corpus])
+  _, legacy_seconds = time_it(lambda: [common._decode_via_jsonpickle(item) for item in corpus])
+  print("objects: %d" % len(corpus))
+  print("native decoder:      %10.0f objects/sec" % (len(corpus) / native_seconds))
+  print("jsonpickle decoding: %10.0f objects/sec" % (len(corpus) / legacy_seconds))
+  print("speedup: %.1fx" % (legacy_seconds / native_seconds))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,47 @@
+"""
+Time taken by :py:meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.dump_books` with various numbers of workers, by an incremental export when nothing has changed, and with a content-addressed store (hardlinks rather than copies).
+
+Usage: ``python -m tests.benchmarks.export_books_benchmark [num_books] [num_pages_per_book]``
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from sanskrit_data import json_stream_helper
+from sanskrit_data.db import in_memory
+from tests.benchmarks.import_book_benchmark import make_book_map
+
+
+def main(num_books=8, num_pages_per_book=200):
+  logging.getLogger().setLevel(logging.WARNING)
+  work_dir = tempfile.mkdtemp()
+  try:
+    store = os.path.join(work_dir, "store")
+    book_map = make_book_map(num_pages=num_pages_per_book, num_chapters=10)
+    for book_index in range(num_books):
+      os.makedirs(os.path.join(store, "book_%d" % book_index))
+      json_stream_helper.dump_content_first(json_map=book_map, filename=os.path.join(store, "book_%d" % book_index, "book.json"))
+    db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark", external_file_store=store)
+    db.import_all(rootdir=store)
+    for page_dict in db.find(find_filter={"jsonClass": "BookPortion", "portion_class": "page"}):
+      os.makedirs(os.path.join(store, page_dict["_id"]))
+      with open(os.path.join(store, page_dict["_id"], "page.png"), "wb") as page_file:
+        page_file.write(os.urandom(100000))
+    for num_workers in (1, 2, 4, 8):
+      stats = db.dump_books(export_dir=os.path.join(work_dir, "export_%d" % num_workers), num_workers=num_workers)
+      print("workers: %-4s %s" % (num_workers, stats))
+    export_dir = os.path.join(work_dir, "export_incremental")
+    for run in ("first", "unchanged"):
+      stats = db.dump_books(export_dir=export_dir, incremental=True)
+      print("incremental, %-9s %s" % (run, stats))
+    db.use_blob_store().migrate_object_dirs()
+    stats = db.dump_books(export_dir=os.path.join(work_dir, "export_blobs"))
+    print("blob store:            %s" % stats)
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""
+Time taken to list the files of many objects in an external file store - by globbing (the default), and with a :py:class:`~sanskrit_data.db.file_listing_cache.FileListingCache`.
+
+Usage: ``python -m tests.benchmarks.file_listing_benchmark [num_objects]``
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from sanskrit_data.db import in_memory
+from sanskrit_data.schema import books, common
+from tests.benchmarks import time_it
+
+
+def main(num_objects=20000):
+  logging.getLogger().setLevel(logging.WARNING)
+  work_dir = tempfile.mkdtemp()
+  try:
+    pages = []
+    for index in range(num_objects):
+      page = books.BookPortion.from_details(title="page_%d" % index, portion_class="page")
+      page._id = "page_%d" % index
+      os.makedirs(os.path.join(work_dir, page._id))
+      open(os.path.join(work_dir, page._id, "page.png"), "wb").close()
+      # As in a store of pages added a while ago (recently modified directories are always listed afresh).
+      os.utime(os.path.join(work_dir, page._id), (0, 0))
+      pages.append(page)
+    db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark", external_file_store=work_dir)
+    _, seconds = time_it(lambda: [page.list_files(db_interface=db) for page in pages])
+    print("glob:                         %.3f s" % seconds)
+    for check_mtime in (True, False):
+      db.use_file_listing_cache(check_mtime=check_mtime)
+      _, seconds = time_it(common.JsonObject.list_files_many, objects=pages, db_interface=db)
+      print("list_files_many (check_mtime=%-5s), cold: %.3f s" % (check_mtime, seconds))
+      _, seconds = time_it(lambda: [page.list_files(db_interface=db) for page in pages])
+      print("list_files      (check_mtime=%-5s), warm: %.3f s" % (check_mtime, seconds))
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
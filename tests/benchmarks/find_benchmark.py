@@ -0,0 +1,44 @@
+"""
+Latency of indexed versus scanning lookups in :py:class:`~sanskrit_data.db.in_memory.BookPortionsInMemory`.
+
+Usage: ``python -m tests.benchmarks.find_benchmark [num_annotations]``
+"""
+import logging
+import sys
+
+from sanskrit_data.db import in_memory
+from sanskrit_data.schema import books, common
+from tests.benchmarks import make_annotation_corpus, time_it
+
+
+class _ScanningDb(in_memory.InMemoryDb):
+  """Ignores indexes, as InMemoryDb used to."""
+
+  def _get_candidate_ids(self, find_filter, version=None):
+    return None
+
+
+def main(num_annotations=20000, num_lookups=100):
+  logging.getLogger().setLevel(logging.WARNING)
+  corpus = make_annotation_corpus(num_annotations=num_annotations)
+  indexed_db = in_memory.BookPortionsInMemory(db_name_frontend="indexed")
+  scanning_db = _ScanningDb(db_name_frontend="scanning")
+  for doc in corpus:
+    indexed_db.update_doc(dict(doc))
+    scanning_db.update_doc(dict(doc))
+  page = common.JsonObject.make_from_dict(indexed_db.find_by_id("page_7"))
+
+  def lookups(db):
+    for _ in range(num_lookups):
+      books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=db)
+      page.get_targetting_entities(db_interface=db)
+
+  _, indexed_seconds = time_it(lookups, indexed_db)
+  _, scanning_seconds = time_it(lookups, scanning_db)
+  print("documents: %d" % len(corpus))
+  print("indexed lookups:  %10.2f ms" % (indexed_seconds * 1000 / num_lookups))
+  print("scanning lookups: %10.2f ms" % (scanning_seconds * 1000 / num_lookups))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
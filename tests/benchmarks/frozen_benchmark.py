@@ -0,0 +1,52 @@
+"""
+Opening time and lookup latency of a :py:class:`~sanskrit_data.db.frozen.FrozenBookPortionsDb` image, compared with :py:class:`~sanskrit_data.db.in_memory.BookPortionsInMemory`.
+
+Usage: ``python -m tests.benchmarks.frozen_benchmark [num_annotations]``
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from sanskrit_data.db import frozen, in_memory
+from sanskrit_data.schema import books, common
+from tests.benchmarks import make_annotation_corpus, time_it
+
+
+def main(num_annotations=100000, num_lookups=1000):
+  logging.getLogger().setLevel(logging.WARNING)
+  in_memory_db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark")
+  _, loading_seconds = time_it(in_memory_db.update_docs, make_annotation_corpus(num_annotations=num_annotations))
+  work_dir = tempfile.mkdtemp()
+  try:
+    image_path = os.path.join(work_dir, "corpus.img")
+    num_docs, freezing_seconds = time_it(frozen.freeze, db_interface=in_memory_db, image_path=image_path)
+    frozen_db, opening_seconds = time_it(frozen.FrozenBookPortionsDb, image_path=image_path, db_name_frontend="benchmark")
+    print("documents: %d, image size: %.1f MB" % (num_docs, os.path.getsize(image_path) / 1e6))
+    print("loading into InMemoryDb:  %10.2f s" % loading_seconds)
+    print("freezing:                 %10.2f s" % freezing_seconds)
+    print("opening the image:        %10.2f ms" % (opening_seconds * 1000))
+
+    page = common.JsonObject.make_from_dict(in_memory_db.find_by_id("page_7"))
+
+    def find_by_ids(db):
+      for lookup_index in range(num_lookups):
+        db.find_by_id("annotation_%d" % (lookup_index * 7919 % num_annotations))
+
+    def lookups(db):
+      for _ in range(num_lookups // 10):
+        books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=db)
+        page.get_targetting_entities(db_interface=db)
+
+    for name, db in (("in memory", in_memory_db), ("frozen", frozen_db)):
+      _, id_seconds = time_it(find_by_ids, db)
+      _, lookup_seconds = time_it(lookups, db)
+      print("%-10s find_by_id: %8.1f us, path and targetting entity lookups: %8.2f ms" % (name, id_seconds * 1e6 / num_lookups, lookup_seconds * 1000 / (num_lookups // 10)))
+    frozen_db.close()
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
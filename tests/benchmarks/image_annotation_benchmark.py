@@ -0,0 +1,51 @@
+"""
+Time taken to store detected text regions of a book's pages as ImageAnnotations - creating and writing each annotation with update_collection (as update_image_annotations used to), page by page with :py:meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.update_image_annotations`, and with :py:meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.update_image_annotations_in_bulk`.
+
+Usage: ``python -m tests.benchmarks.image_annotation_benchmark [num_pages] [num_regions_per_page]``
+"""
+import logging
+import sys
+
+from sanskrit_data.db import in_memory
+from sanskrit_data.schema import books, common, ullekhanam
+from tests.benchmarks import time_it
+
+
+class PageImage(object):
+  def __init__(self, num_regions):
+    self.num_regions = num_regions
+
+  def find_text_regions(self):
+    return [ullekhanam.Rectangle.from_details(x=index, y=index, w=10, h=10, score=0.5) for index in range(self.num_regions)]
+
+
+def make_db(num_pages):
+  db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark")
+  book = books.BookPortion.from_details(title="halAyudhakoshaH", portion_class="book").update_collection(db)
+  pages = [books.BookPortion.from_details(title="page_%d" % index, portion_class="page", targets=[books.BookPositionTarget.from_details(container_id=book._id, position=index)]) for index in range(num_pages)]
+  return db, common.JsonObject.update_collection_in_bulk(objects=pages, db_interface=db)
+
+
+def annotate_one_by_one(db, pages, page_image):
+  for page in pages:
+    page.get_targetting_entities(db_interface=db, entity_type=ullekhanam.ImageAnnotation.get_wire_typeid())
+    for region in page_image.find_text_regions():
+      del region.score
+      target = ullekhanam.ImageTarget.from_details(container_id=page._id, rectangle=region)
+      ullekhanam.ImageAnnotation.from_details(targets=[target], source=ullekhanam.DataSource.from_details(source_type='system_inferred', id="pyCV2")).update_collection(db)
+
+
+def main(num_pages=500, num_regions_per_page=20):
+  logging.getLogger().setLevel(logging.WARNING)
+  page_image = PageImage(num_regions=num_regions_per_page)
+  for name, annotate in (
+      ("one by one", annotate_one_by_one),
+      ("per page", lambda db, pages, page_image: [db.update_image_annotations(page=page, page_image=page_image) for page in pages]),
+      ("in bulk", lambda db, pages, page_image: db.update_image_annotations_in_bulk(pages=pages, get_page_image=lambda _: page_image))):
+    db, pages = make_db(num_pages=num_pages)
+    _, seconds = time_it(annotate, db, pages, page_image)
+    print("%-10s %.2f s" % (name, seconds))
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
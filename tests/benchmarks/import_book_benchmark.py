@@ -0,0 +1,62 @@
+"""
+Time and peak (python heap) memory of importing a large book.json - by reading the whole JsonObjectNode tree (as import_all used to), and by :py:meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.import_book`.
+
+Usage: ``python -m tests.benchmarks.import_book_benchmark [num_pages] [num_chapters]``
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+from sanskrit_data import json_stream_helper
+from sanskrit_data.db import in_memory
+from sanskrit_data.schema import books, common
+from tests.benchmarks import time_it
+
+
+def make_book_map(num_pages, num_chapters):
+  def make_node_map(content, children):
+    return {"jsonClass": "JsonObjectNode", "content": content.to_json_map(), "children": children}
+
+  chapters = []
+  for chapter_index in range(num_chapters):
+    pages = [make_node_map(books.BookPortion.from_details(title="page_%d_%d" % (chapter_index, page_index), portion_class="page", base_data="image"), []) for page_index in range(num_pages // num_chapters)]
+    chapters.append(make_node_map(books.BookPortion.from_details(title="chapter_%d" % chapter_index, portion_class="chapter"), pages))
+  return make_node_map(books.BookPortion.from_details(title="halAyudhakoshaH", portion_class="book"), chapters)
+
+
+def import_whole_tree(db, book_json_path):
+  book_node = common.JsonObject.read_from_file(book_json_path)
+  book_node.setup_source(source=common.DataSource.from_details(source_type="system_inferred", id="book_importer"))
+  book_node.update_collection(db)
+
+
+def measure(import_fn, book_json_path):
+  db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark")
+  tracemalloc.start()
+  _, seconds = time_it(import_fn, db, book_json_path)
+  database_size = tracemalloc.get_traced_memory()[0]
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  assert len(db.db) > 0
+  return seconds, (peak - database_size) / 1e6
+
+
+def main(num_pages=100000, num_chapters=100):
+  logging.getLogger().setLevel(logging.WARNING)
+  work_dir = tempfile.mkdtemp()
+  try:
+    book_json_path = os.path.join(work_dir, "book.json")
+    json_stream_helper.dump_content_first(json_map=make_book_map(num_pages=num_pages, num_chapters=num_chapters), filename=book_json_path)
+    print("book.json: %.1f MB" % (os.path.getsize(book_json_path) / 1e6))
+    for name, import_fn in (("whole tree", import_whole_tree), ("streaming", lambda db, path: db.import_book(book_json_path=path))):
+      seconds, peak_mb = measure(import_fn, book_json_path)
+      print("%-10s %8.2f s, peak memory beyond the database: %8.1f MB" % (name, seconds, peak_mb))
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,34 @@
+"""
+Time taken by :py:meth:`~sanskrit_data.db.interfaces.ullekhanam_db.BookPortionsInterface.import_all` with various numbers of worker processes.
+
+Usage: ``python -m tests.benchmarks.parallel_import_benchmark [num_books] [num_pages_per_book]``
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from sanskrit_data import json_stream_helper
+from sanskrit_data.db import in_memory
+from tests.benchmarks.import_book_benchmark import make_book_map
+
+
+def main(num_books=16, num_pages_per_book=5000):
+  logging.getLogger().setLevel(logging.WARNING)
+  work_dir = tempfile.mkdtemp()
+  try:
+    book_map = make_book_map(num_pages=num_pages_per_book, num_chapters=10)
+    for book_index in range(num_books):
+      os.makedirs(os.path.join(work_dir, "book_%d" % book_index))
+      json_stream_helper.dump_content_first(json_map=book_map, filename=os.path.join(work_dir, "book_%d" % book_index, "book.json"))
+    for num_workers in (None, 2, 4, os.cpu_count()):
+      db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark")
+      stats = db.import_all(rootdir=work_dir, num_workers=num_workers)
+      print("workers: %-4s %s" % (num_workers, stats))
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+"""
+Write throughput and restart time of :py:class:`~sanskrit_data.db.in_memory.BookPortionsInMemory` persisting to a write-ahead log (see :py:mod:`~sanskrit_data.db.write_ahead_log`).
+
+Usage: ``python -m tests.benchmarks.persistence_benchmark [num_annotations] [num_tail_records]``
+"""
+import logging
+import shutil
+import sys
+import tempfile
+import threading
+
+from sanskrit_data.db import in_memory
+from tests.benchmarks import make_annotation_corpus, time_it
+
+
+def make_large_corpus(num_annotations):
+  """Like make_annotation_corpus, but cloning a template annotation - to quickly get millions of documents."""
+  corpus = make_annotation_corpus(num_annotations=1)
+  template = corpus.pop()
+  num_pages = len(corpus) - 1
+  for annotation_index in range(num_annotations):
+    annotation_map = in_memory._copy_json(template)
+    annotation_map["_id"] = "annotation_%d" % annotation_index
+    annotation_map["targets"][0]["container_id"] = "page_%d" % (annotation_index % num_pages)
+    annotation_map["content"]["script_renderings"][0]["text"] = "rAmaH %d" % annotation_index
+    corpus.append(annotation_map)
+  return corpus
+
+
+def measure_writes(log_dir, docs, sync_writes, num_threads=1, batch_size=1):
+  """:return: Documents written per second."""
+  db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark", log_dir=log_dir, sync_writes=sync_writes)
+
+  def write(thread_index):
+    thread_docs = docs[thread_index::num_threads]
+    for start in range(0, len(thread_docs), batch_size):
+      db.update_docs([dict(doc) for doc in thread_docs[start:start + batch_size]])
+
+  def write_concurrently():
+    threads = [threading.Thread(target=write, args=(thread_index,)) for thread_index in range(num_threads)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  _, seconds = time_it(write_concurrently)
+  db.close()
+  shutil.rmtree(log_dir)
+  return len(docs) / seconds
+
+
+def main(num_annotations=1000000, num_tail_records=10000):
+  logging.getLogger().setLevel(logging.WARNING)
+  corpus = make_large_corpus(num_annotations=num_annotations)
+  work_dir = tempfile.mkdtemp()
+  try:
+    log_dir = work_dir + "/log"
+    sample = corpus[:2000]
+    print("documents: %d" % len(corpus))
+    print("single writer, fsync:             %10.0f docs/s" % measure_writes(log_dir, sample, sync_writes=True))
+    print("8 writers, fsync (group commit):  %10.0f docs/s" % measure_writes(log_dir, sample, sync_writes=True, num_threads=8))
+    print("single writer, no fsync:          %10.0f docs/s" % measure_writes(log_dir, sample, sync_writes=False))
+    print("batches of 1000, fsync:           %10.0f docs/s" % measure_writes(log_dir, corpus, sync_writes=True, batch_size=1000))
+
+    db = in_memory.BookPortionsInMemory(db_name_frontend="benchmark", log_dir=log_dir, compact_after_records=len(corpus))
+    for start in range(0, len(corpus), 1000):
+      db.update_docs(corpus[start:start + 1000])
+    _, compaction_seconds = time_it(db.compact_log)
+    for record_index in range(num_tail_records):
+      db.update_doc(dict(corpus[record_index % len(corpus)]))
+    db.close()
+    print("snapshot writing:                 %10.2f s" % compaction_seconds)
+
+    restarted_db, restart_seconds = time_it(in_memory.BookPortionsInMemory, db_name_frontend="benchmark", log_dir=log_dir)
+    print("restart (snapshot + %d records): %10.2f s" % (restarted_db.log.num_records_since_snapshot, restart_seconds))
+    restarted_db.close()
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
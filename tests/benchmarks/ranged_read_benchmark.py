@@ -0,0 +1,57 @@
+"""
+Time taken to serve random byte ranges (as tiles of a large page image) of files - reading whole files, opening and seeking per range, and through a :py:class:`~sanskrit_data.db.file_handle_pool.FileHandlePool`.
+
+Usage: ``python -m tests.benchmarks.ranged_read_benchmark [num_files] [file_size_mb] [num_reads]``
+"""
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from sanskrit_data.db import file_handle_pool
+from tests.benchmarks import time_it
+
+_TILE_SIZE = 65536
+
+
+def read_whole(path, offset):
+  with open(path, "rb") as fhandle:
+    return fhandle.read()[offset:offset + _TILE_SIZE]
+
+
+def read_seeking(path, offset):
+  with open(path, "rb") as fhandle:
+    fhandle.seek(offset)
+    return fhandle.read(_TILE_SIZE)
+
+
+def main(num_files=8, file_size_mb=20, num_reads=2000):
+  logging.getLogger().setLevel(logging.WARNING)
+  work_dir = tempfile.mkdtemp()
+  try:
+    paths = []
+    for index in range(num_files):
+      paths.append(os.path.join(work_dir, "page_%d.tif" % index))
+      with open(paths[-1], "wb") as out_file:
+        out_file.write(os.urandom(file_size_mb * 1000000))
+    random.seed(0)
+    reads = [(random.choice(paths), random.randrange(file_size_mb * 1000000 - _TILE_SIZE)) for _ in range(num_reads)]
+    pool = file_handle_pool.FileHandlePool(max_open_files=num_files)
+
+    def read_view(path, offset):
+      with pool.open_view(path=path, offset=offset, length=_TILE_SIZE) as view:
+        return len(view)
+    # Reading whole files is slow - it is timed on a tenth of the reads, and extrapolated.
+    _, seconds = time_it(lambda: [read_whole(path, offset) for path, offset in reads[:num_reads // 10]])
+    print("%-14s %.3f s (extrapolated)" % ("whole file", seconds * 10))
+    for name, read_fn in (("open and seek", read_seeking), ("pool, bytes", lambda path, offset: pool.read_range(path=path, offset=offset, length=_TILE_SIZE)), ("pool, view", read_view)):
+      _, seconds = time_it(lambda: [read_fn(path, offset) for path, offset in reads])
+      print("%-14s %.3f s" % (name, seconds))
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,8 +1,35 @@
 import logging
 import os
+import shutil
 
 from sanskrit_data.db import in_memory
 
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+#: The example book in textract-example-repo/books, and its pages (each with a page image).
+BOOK_ID = "5a3dfa6f751d5d9780b4c6ca"
+PAGE_IDS = ["5a3dfa6f751d5d9780b4c6cd", "5a3dfa6f751d5d9780b4c6d0", "5a3dfa6f751d5d9780b4c6d3"]
+EXAMPLE_BOOKS_DIR = os.path.join(os.path.dirname(__file__), "textract-example-repo/books")
+
+
+def write_file(path, content=b""):
+    """Write content to path - replacing any file there, rather than rewriting it (as it may be memory mapped)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "wb") as out_file:
+        out_file.write(content)
+    os.replace(path + ".tmp", path)
+
+
+def example_store_db(store_dir):
+    """A database with the example book imported, using a copy of textract-example-repo/books at store_dir as its external file store."""
+    shutil.copytree(EXAMPLE_BOOKS_DIR, store_dir)
+    db = in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=store_dir)
+    db.import_all(rootdir=store_dir)
+    return db
+
 
 def ullekhanam_db_fixture(request):
     test_db = in_memory.BookPortionsInMemory(db_name_frontend="ullekhanam", external_file_store=os.path.join(os.path.dirname(__file__),  "textract-example-repo/books"))
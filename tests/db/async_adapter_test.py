@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+
+from sanskrit_data.db import in_memory
+from sanskrit_data.db.async_adapter import ThreadPoolAsyncDb
+from sanskrit_data.schema import books, common, ullekhanam
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+class _SlowDb(in_memory.InMemoryDb):
+  """Tracks the number of concurrent find_by_id calls, and the closing of find generators."""
+
+  def __init__(self, db_name_frontend):
+    super(_SlowDb, self).__init__(db_name_frontend=db_name_frontend)
+    self.lock = threading.Lock()
+    self.num_running = 0
+    self.max_running = 0
+    self.num_finds_closed = 0
+
+  # noinspection PyShadowingBuiltins
+  def find_by_id(self, id):
+    with self.lock:
+      self.num_running += 1
+      self.max_running = max(self.max_running, self.num_running)
+    time.sleep(0.05)
+    with self.lock:
+      self.num_running -= 1
+    return super(_SlowDb, self).find_by_id(id)
+
+  def find(self, find_filter):
+    try:
+      for doc in super(_SlowDb, self).find(find_filter):
+        yield doc
+    finally:
+      self.num_finds_closed += 1
+
+
+@pytest.fixture()
+def async_db():
+  async_db = ThreadPoolAsyncDb(db_interface=_SlowDb(db_name_frontend="test"), max_workers=3, find_batch_size=4)
+  yield async_db
+  async_db.close()
+
+
+def test_basic_operations(async_db):
+  async def run():
+    docs = await async_db.update_docs([{"_id": "doc_%d" % i, "group": i % 2} for i in range(10)])
+    assert len(docs) == 10
+    assert (await async_db.find_by_id("doc_3"))["group"] == 1
+    assert [doc["_id"] if doc else None for doc in await async_db.find_by_ids(["doc_1", "missing"])] == ["doc_1", None]
+    assert sorted([doc["_id"] async for doc in async_db.find({"group": 0})]) == ["doc_%d" % i for i in range(0, 10, 2)]
+    assert (await async_db.find_one({"group": 1}))["group"] == 1
+    assert await async_db.find_one({"group": 2}) is None
+    await async_db.delete_docs(["doc_0", "doc_2"])
+    assert len([doc async for doc in async_db.find({"group": 0})]) == 3
+  asyncio.run(run())
+  # Each find generator got closed - including the one find_one did not exhaust.
+  assert async_db.db_interface.num_finds_closed == 4
+
+
+def test_calls_run_concurrently_on_bounded_pool(async_db):
+  async def run():
+    await async_db.update_docs([{"_id": "doc_%d" % i} for i in range(9)])
+    start = time.perf_counter()
+    docs = await asyncio.gather(*[async_db.find_by_id("doc_%d" % i) for i in range(9)])
+    return docs, time.perf_counter() - start
+  docs, seconds = asyncio.run(run())
+  assert [doc["_id"] for doc in docs] == ["doc_%d" % i for i in range(9)]
+  assert async_db.db_interface.max_running == 3
+  assert seconds < 9 * 0.05
+
+
+def test_json_object_round_trip():
+  async_db = ThreadPoolAsyncDb(db_interface=in_memory.BookPortionsInMemory(db_name_frontend="test"))
+
+  async def run():
+    book = await books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha").update_collection_async(db_interface=async_db)
+    assert (await common.JsonObject.from_id_async(id=book._id, db_interface=async_db)).title == "halAyudhakoshaH"
+    assert await common.JsonObject.from_id_async(id="missing", db_interface=async_db) is None
+    # Validation (which checks targets in the database) runs too.
+    annotation = ullekhanam.TextAnnotation.from_details(targets=[common.Target.from_details(container_id="missing")], source=common.DataSource.from_details(source_type="system_inferred", id="test"), content=common.Text.from_text_string("rAmaH"))
+    with pytest.raises(common.TargetValidationError):
+      await annotation.update_collection_async(db_interface=async_db)
+
+    node = common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="root"), children=[
+      common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="c%d" % i), children=[
+        common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="c%dv%d" % (i, j))) for j in range(3)])
+      for i in range(5)])
+    await node.update_collection_async(db_interface=async_db)
+    filled_node = common.JsonObjectNode.from_details(content=node.content)
+    await filled_node.fill_descendents_async(db_interface=async_db, max_ids_per_query=2)
+    return node, filled_node
+
+  node, filled_node = asyncio.run(run())
+  async_db.close()
+  expected_node = common.JsonObjectNode.from_details(content=node.content)
+  expected_node.fill_descendents(db_interface=async_db.db_interface)
+  assert len(filled_node.children) == 5
+  assert sorted(len(child.children) for child in filled_node.children) == [3] * 5
+
+  def get_titles(tree):
+    return sorted(content.title for content in tree.get_contents_post_order())
+  assert get_titles(filled_node) == get_titles(expected_node) == get_titles(node)
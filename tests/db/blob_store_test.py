@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+
+from sanskrit_data.db import blob_store, in_memory
+from sanskrit_data.schema import books
+from tests.db import BOOK_ID, PAGE_IDS, example_store_db, write_file
+
+
+def test_blob_store(tmpdir):
+  store = blob_store.BlobStore.create(root_dir=str(tmpdir.join("store")))
+  assert blob_store.BlobStore.get_if_present(root_dir=str(tmpdir.join("store"))) is not None
+  assert blob_store.BlobStore.get_if_present(root_dir=str(tmpdir)) is None
+  write_file(str(tmpdir.join("scan.png")), b"scan")
+  write_file(str(tmpdir.join("other.png")), b"other")
+  content_hash = store.add_file(obj_id="a", source_path=str(tmpdir.join("scan.png")))
+  assert store.add_file(obj_id="b", source_path=str(tmpdir.join("scan.png")), file_name="page.png") == content_hash
+  store.add_file(obj_id="b", source_path=str(tmpdir.join("other.png")), file_name="page.txt")
+  assert len(os.listdir(os.path.join(store.blobs_dir, content_hash[:2]))) == 1
+  assert store.list_files(obj_id="b") == ["page.png", "page.txt"]
+  assert store.list_files(obj_id="b", suffix_pattern="*.png") == ["page.png"]
+  assert store.list_files(obj_id="c") == []
+  assert store.get_file_path(obj_id="a", file_name="scan.png") == store.get_file_path(obj_id="b", file_name="page.png")
+  assert store.get_file_path(obj_id="a", file_name="page.png") is None
+
+  dest_path = str(tmpdir.join("export", "b", "page.png"))
+  assert store.link_file(obj_id="b", file_name="page.png", dest_path=dest_path)
+  assert store.link_file(obj_id="b", file_name="page.png", dest_path=dest_path)
+  assert os.path.samefile(dest_path, store.get_file_path(obj_id="b", file_name="page.png"))
+
+  # Blobs are reclaimed once no manifest refers to them - and not when recently written.
+  store.remove_files(obj_id="b")
+  assert store.gc() == (0, 0)
+  assert store.gc(min_age_seconds=0) == (1, len(b"other"))
+  store.remove_files(obj_id="a", file_names=["scan.png"])
+  assert store.gc(min_age_seconds=0) == (1, len(b"scan"))
+  with open(dest_path, "rb") as exported_file:
+    assert exported_file.read() == b"scan"
+
+
+def test_migrate_and_export(tmpdir):
+  store_dir = str(tmpdir.join("store"))
+  db = example_store_db(store_dir=store_dir)
+  # The same scan, for two pages.
+  shutil.copyfile(os.path.join(store_dir, PAGE_IDS[1], "page.png"), os.path.join(store_dir, PAGE_IDS[2], "page.png"))
+  shutil.rmtree(os.path.join(store_dir, BOOK_ID))
+  assert db.blob_store is None
+  db.use_blob_store().migrate_object_dirs()
+  assert sorted(os.listdir(store_dir)) == [blob_store.BLOBS_DIR, blob_store.MANIFESTS_DIR]
+  assert in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=store_dir).blob_store is not None
+
+  pages = [books.BookPortion.from_id(id=page_id, db_interface=db) for page_id in PAGE_IDS]
+  assert pages[0].list_files(db_interface=db) == ["page.jpg"]
+  assert pages[1].get_file_path(db_interface=db, file_name="page.png") == pages[2].get_file_path(db_interface=db, file_name="page.png")
+
+  export_dir = str(tmpdir.join("export"))
+  stats = db.dump_books(export_dir=export_dir, incremental=True)
+  assert (stats.num_files_linked, stats.num_files_copied) == (3, 1)
+  for page in pages:
+    file_name = page.list_files(db_interface=db)[0]
+    assert os.path.samefile(os.path.join(export_dir, page._id, file_name), page.get_file_path(db_interface=db, file_name=file_name))
+  stats = db.dump_books(export_dir=export_dir, incremental=True)
+  assert (stats.num_files_linked, stats.num_files_copied, stats.num_files_skipped) == (0, 0, 4)
+  books.BookPortion.from_id(id=BOOK_ID, db_interface=db).dump_book_portion(export_dir=str(tmpdir.join("export_serial")), db_interface=db)
+  assert os.path.samefile(os.path.join(str(tmpdir.join("export_serial")), PAGE_IDS[0], "page.jpg"), pages[0].get_file_path(db_interface=db, file_name="page.jpg"))
+
+  # Files of deleted objects, added through store_file.
+  pages[0].store_file(db_interface=db, source_path=pages[1].get_file_path(db_interface=db, file_name="page.png"), file_name="page.png")
+  assert pages[0].list_files(db_interface=db) == ["page.jpg", "page.png"]
+  pages[0].delete_in_collection(db_interface=db)
+  assert pages[0].list_files(db_interface=db) == []
+  pages[1].delete_in_collection(db_interface=db)
+  assert db.blob_store.gc(min_age_seconds=0)[0] == 1
+  assert db.blob_store.gc(min_age_seconds=0)[0] == 0
+  db.delete_doc(PAGE_IDS[2])
+  assert db.blob_store.gc(db_interface=db, min_age_seconds=0)[0] == 1
@@ -0,0 +1,107 @@
+from __future__ import absolute_import
+
+import logging
+import os
+import shutil
+
+import pytest
+
+import tests.db
+from sanskrit_data.db import book_exporter, in_memory
+from sanskrit_data.schema import books
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+BOOK_ID = "5a3dfa6f751d5d9780b4c6ca"
+PAGE_ID = "5a3dfa6f751d5d9780b4c6cd"
+
+
+@pytest.fixture()
+def db(tmpdir):
+  store = str(tmpdir.join("store"))
+  shutil.copytree(os.path.join(os.path.dirname(tests.db.__file__), "textract-example-repo/books"), store)
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=store)
+  db.import_all(rootdir=store)
+  return db
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_export(db, tmpdir, num_workers):
+  export_dir = str(tmpdir.join("export"))
+  stats = db.dump_books(export_dir=export_dir, num_workers=num_workers)
+  assert (stats.num_books, stats.num_files_copied, stats.num_files_skipped) == (1, 4, 0)
+  assert stats.books[BOOK_ID].num_files_copied == 4
+  assert stats.bytes_copied == sum(entry.stat().st_size for dir_entry in os.scandir(export_dir) for entry in os.scandir(dir_entry.path))
+  with open(os.path.join(db.external_file_store, PAGE_ID, "page.jpg"), "rb") as source_file, open(os.path.join(export_dir, PAGE_ID, "page.jpg"), "rb") as exported_file:
+    assert source_file.read() == exported_file.read()
+
+  imported_db = in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=export_dir)
+  assert imported_db.import_all(rootdir=export_dir).num_books == 1
+  assert imported_db.find_by_id(PAGE_ID) == db.find_by_id(PAGE_ID)
+
+  # Without incremental, everything is written again.
+  assert db.dump_books(export_dir=export_dir).num_files_copied == 4
+
+
+def test_incremental_export(db, tmpdir):
+  export_dir = str(tmpdir.join("export"))
+  stats = db.dump_books(export_dir=export_dir, incremental=True)
+  assert (stats.num_files_copied, stats.num_files_skipped) == (4, 0)
+  assert os.path.exists(os.path.join(export_dir, book_exporter.MANIFEST_FILE_NAME))
+  stats = db.dump_books(export_dir=export_dir, incremental=True)
+  assert (stats.num_files_copied, stats.num_files_skipped, stats.bytes_copied) == (0, 4, 0)
+
+  # A page file touched without changes is hashed, but not copied.
+  page_path = os.path.join(db.external_file_store, PAGE_ID, "page.jpg")
+  os.utime(page_path, ns=(0, 0))
+  assert db.dump_books(export_dir=export_dir, incremental=True).num_files_copied == 0
+
+  # Changed and damaged files are written again.
+  with open(page_path, "ab") as page_file:
+    page_file.write(b"\0")
+  page = books.BookPortion.from_id(id=PAGE_ID, db_interface=db)
+  page.title = "changed title"
+  page.update_collection(db)
+  os.remove(os.path.join(export_dir, "5a3dfa6f751d5d9780b4c6d0", "page.png"))
+  stats = db.dump_books(export_dir=export_dir, incremental=True)
+  assert (stats.num_files_copied, stats.num_files_skipped) == (3, 1)
+  with open(page_path, "rb") as source_file, open(os.path.join(export_dir, PAGE_ID, "page.jpg"), "rb") as exported_file:
+    assert source_file.read() == exported_file.read()
+  assert os.path.exists(os.path.join(export_dir, "5a3dfa6f751d5d9780b4c6d0", "page.png"))
+
+
+def test_failures(db, tmpdir):
+  os.remove(os.path.join(db.external_file_store, PAGE_ID, "page.jpg"))
+  os.rmdir(os.path.join(db.external_file_store, PAGE_ID))
+  stats = db.dump_books(export_dir=str(tmpdir.join("export")))
+  assert stats.num_books == 1
+
+  shutil.rmtree(os.path.join(db.external_file_store, "5a3dfa6f751d5d9780b4c6d0"))
+  os.makedirs(os.path.join(db.external_file_store, "5a3dfa6f751d5d9780b4c6d0", "page.png"))
+  stats = db.dump_books(export_dir=str(tmpdir.join("export")))
+  assert (stats.num_books, list(stats.failures)) == (0, [BOOK_ID])
+
+
+def test_legacy_page_paths_with_blob_store(db, tmpdir):
+  # Files of pages with a path attribute are not blobs, even with a blob store in use.
+  legacy_path = os.path.join(db.external_file_store, "legacy", "scan.png")
+  os.makedirs(os.path.dirname(legacy_path))
+  with open(legacy_path, "wb") as legacy_file:
+    legacy_file.write(b"aaaa")
+  page = books.BookPortion.from_id(id=PAGE_ID, db_interface=db)
+  page.path = "legacy/scan.png"
+  page.update_collection(db)
+  db.use_blob_store()
+  export_dir = str(tmpdir.join("export"))
+  assert db.dump_books(export_dir=export_dir, incremental=True).num_files_copied == 2
+
+  with open(legacy_path, "wb") as legacy_file:
+    legacy_file.write(b"bbbb")
+  os.utime(legacy_path, ns=(0, 0))
+  stats = db.dump_books(export_dir=export_dir, incremental=True)
+  assert (stats.num_files_copied, stats.num_files_linked, stats.num_files_skipped) == (1, 0, 1)
+  with open(os.path.join(export_dir, PAGE_ID, "content.png"), "rb") as exported_file:
+    assert exported_file.read() == b"bbbb"
@@ -0,0 +1,150 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from sanskrit_data.db import caching, in_memory
+from sanskrit_data.schema import books
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def make_db(**kwargs):
+  backend = in_memory.BookPortionsInMemory(db_name_frontend="test")
+  return backend, caching.CachingBookPortionsDb(db_interface=backend, **kwargs)
+
+
+def test_find_by_id_cached():
+  backend, db = make_db()
+  doc = db.update_doc({"jsonClass": "JsonObject", "xyz": 1})
+  assert db.find_by_id(doc["_id"]) == doc
+  fetched_doc = db.find_by_id(doc["_id"])
+  assert db.get_stats()["hits"] == 1
+  # Callers get copies.
+  fetched_doc["xyz"] = 2
+  assert db.find_by_id(doc["_id"])["xyz"] == 1
+
+  db.update_doc(fetched_doc)
+  assert db.find_by_id(doc["_id"])["xyz"] == 2
+  db.delete_doc(doc["_id"])
+  assert db.find_by_id(doc["_id"]) is None
+  assert db.find_by_ids([doc["_id"], "missing"]) == [None, None]
+
+
+def test_find_cached_and_invalidated():
+  backend, db = make_db()
+  book = books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha", portion_class="book").update_collection(db)
+  assert books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=db)._id == book._id
+  assert books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=db)._id == book._id
+  assert db.get_stats()["hits"] == 1
+
+  # A newly inserted matching document invalidates the cached results.
+  other_book = books.BookPortion.from_details(title="other", path="myrepo/other", portion_class="book").update_collection(db)
+  assert len(db.list_books()) == 2
+  db.delete_doc(other_book._id)
+  assert [found_book._id for found_book in db.list_books()] == [book._id]
+
+  # Writes which bypass the wrapper are not seen until the cache is cleared.
+  backend.delete_doc(book._id)
+  assert len(db.list_books()) == 1
+  db.clear_cache()
+  assert len(db.list_books()) == 0
+
+
+def test_eviction_and_expiry():
+  backend, db = make_db(max_docs=2, ttl_seconds=None)
+  docs = db.update_docs([{"value": i} for i in range(3)])
+  db.find_by_ids([doc["_id"] for doc in docs])
+  assert db.get_stats()["evictions"] == 1
+
+  backend, db = make_db(ttl_seconds=0)
+  doc = db.update_doc({"value": 1})
+  db.find_by_id(doc["_id"])
+  db.find_by_id(doc["_id"])
+  assert db.get_stats()["expirations"] == 1 and db.get_stats().get("hits", 0) == 0
+
+
+def test_concurrent_use():
+  backend, db = make_db(max_docs=50)
+  doc_ids = [doc["_id"] for doc in db.update_docs([{"value": i} for i in range(100)])]
+  errors = []
+
+  def work(offset):
+    try:
+      for i in range(500):
+        doc_id = doc_ids[(offset + i) % len(doc_ids)]
+        doc = db.find_by_id(doc_id)
+        doc["value"] += 1
+        db.update_doc(doc)
+    except Exception as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=work, args=(offset * 25,)) for offset in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert errors == []
+  # The cache is consistent with the backend.
+  assert db.find_by_ids(doc_ids) == backend.find_by_ids(doc_ids)
+
+
+def test_invalidation_by_id():
+  backend, db = make_db(max_find_filters=2)
+  docs = db.update_docs([{"value": i} for i in range(3)])
+  assert len(list(db.find({"value": 0}))) == 1
+  assert len(list(db.find({"value": {"$gte": 1}}))) == 2
+  assert set(db.find_keys_by_id) == {doc["_id"] for doc in docs}
+
+  # Only results including a deleted document are forgotten.
+  db.delete_docs([docs[1]["_id"], docs[2]["_id"]])
+  assert db.get_stats()["invalidations"] == 1
+  assert list(db.find({"value": {"$gte": 1}})) == []
+  assert db.find_keys_by_id.keys() == {docs[0]["_id"]}
+
+  # Results including an updated document are forgotten, even if its new version still matches.
+  docs[0]["note"] = "updated"
+  db.update_doc(docs[0])
+  assert [doc["note"] for doc in db.find({"value": 0})] == ["updated"]
+
+  # As are results of evicted filters.
+  list(db.find({"value": 1}))
+  list(db.find({"value": 2}))
+  assert db.get_stats()["evictions"] == 2 and db.find_keys_by_id == {}
+  db.clear_cache()
+  assert db.find_keys_by_id == {}
+
+
+def test_find_streams_results():
+  backend, db = make_db(max_find_results=2)
+  db.update_docs([{"value": i} for i in range(5)])
+  consumed = []
+  backend_find = backend.find
+
+  def counting_find(find_filter):
+    for doc in backend_find(find_filter):
+      consumed.append(doc["_id"])
+      yield doc
+
+  backend.find = counting_find
+  results = db.find({"value": {"$gte": 0}})
+  next(results)
+  assert len(consumed) == 1
+  assert len(list(results)) == 4
+  # Too many results to be cached.
+  assert len(list(db.find({"value": {"$gte": 0}}))) == 5 and len(consumed) == 10
+  assert len(list(db.find({"value": {"$gte": 3}}))) == 2
+  assert len(list(db.find({"value": {"$gte": 3}}))) == 2 and len(consumed) == 12
+  # Results of finds closed early are cached, if there are not too many of them.
+  results = db.find({"value": {"$gte": 2}})
+  next(results)
+  results.close()
+  assert len(consumed) == 15
+  assert len(list(db.find({"value": {"$gte": 2}}))) == 3 and len(consumed) == 18
+  results = db.find({"value": {"$gte": 4}})
+  next(results)
+  results.close()
+  assert len(list(db.find({"value": {"$gte": 4}}))) == 1 and len(consumed) == 19
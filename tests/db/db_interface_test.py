@@ -1,7 +1,9 @@
 from __future__ import absolute_import
 
 import logging
+import threading
 import unittest
+from collections.abc import Mapping
 
 import tests
 from sanskrit_data.db import in_memory
@@ -58,6 +60,204 @@ class TestDBRoundTrip(unittest.TestCase):
     found_doc = self.test_db.find_one(find_filter={"xyz": "xyzvalue"})
     self.assertTrue(JsonObject.make_from_dict(updated_doc).equals_ignore_id(JsonObject.make_from_dict(found_doc)))
 
+  def test_bulk_operations(self):
+    docs = self.test_db.update_docs([{"xyz": "value_%d" % i} for i in range(3)])
+    doc_ids = [doc["_id"] for doc in docs]
+    self.assertEqual(self.test_db.find_by_ids(doc_ids + ["missing"]), docs + [None])
+    self.test_db.delete_docs(doc_ids[:2])
+    self.assertEqual(self.test_db.find_by_ids(doc_ids), [None, None, docs[2]])
+
+
+class TestInMemoryIndexes(unittest.TestCase):
+
+  def setUp(self):
+    self.test_db = in_memory.InMemoryDb(db_name_frontend="dummy")
+    self.test_db.add_index(keys_dict={"targets.container_id": 1}, index_name="targets_container_id")
+    self.test_db.add_index(keys_dict={"path": 1, "portion_class": 1}, index_name="path")
+    for i in range(10):
+      self.test_db.update_doc({"_id": "doc_%d" % i, "jsonClass": "JsonObject", "path": "books/%d" % (i % 3), "targets": [{"jsonClass": "Target", "container_id": "container_%d" % (i % 2)}, {"jsonClass": "Target", "container_id": "common"}]})
+
+  def assert_find_agrees_with_scan(self, find_filter):
+    scan_ids = [doc["_id"] for doc in self.test_db.db.values() if JsonObject.make_from_dict(doc).match_filter(find_filter)]
+    self.assertIsNotNone(self.test_db._get_candidate_ids(find_filter))
+    self.assertEqual(sorted(doc["_id"] for doc in self.test_db.find(find_filter)), sorted(scan_ids))
+    return scan_ids
+
+  def test_indexed_find(self):
+    self.assertEqual(len(self.assert_find_agrees_with_scan({"path": "books/1"})), 3)
+    self.assertEqual(len(self.assert_find_agrees_with_scan({"path": "books/1", "portion_class": "book"})), 0)
+    self.assertEqual(len(self.assert_find_agrees_with_scan({"targets": {"$elemMatch": {"container_id": "container_1"}}})), 5)
+    self.assertEqual(len(self.assert_find_agrees_with_scan({"targets": {"$elemMatch": {"container_id": "common"}}, "path": "books/0"})), 4)
+    self.assertEqual(len(self.test_db._get_candidate_ids({"path": "books/1"})), 3)
+
+  def test_index_maintained_on_updates(self):
+    doc = self.test_db.find_by_id("doc_1")
+    # Modify the fetched document, and write it back.
+    doc["path"] = "books/elsewhere"
+    doc["targets"].pop(0)
+    self.test_db.update_doc(doc)
+    self.assertEqual(self.assert_find_agrees_with_scan({"path": "books/elsewhere"}), ["doc_1"])
+    self.assertNotIn("doc_1", self.assert_find_agrees_with_scan({"targets": {"$elemMatch": {"container_id": "container_1"}}}))
+    self.test_db.delete_doc("doc_1")
+    self.assertEqual(self.assert_find_agrees_with_scan({"path": "books/elsewhere"}), [])
+    self.assertEqual(len(self.assert_find_agrees_with_scan({"targets": {"$elemMatch": {"container_id": "common"}}})), 9)
+
+  def test_index_added_after_inserts(self):
+    self.test_db.update_index(name="jsonClass", fields=["jsonClass"])
+    self.assertEqual(len(self.assert_find_agrees_with_scan({"jsonClass": "JsonObject"})), 10)
+
+  def test_target_index(self):
+    self.test_db.update_doc({"_id": "annotation", "jsonClass": "TextAnnotation", "targets": [{"jsonClass": "Target", "container_id": "container_1"}]})
+    find_filter = {"targets": {"$elemMatch": {"container_id": {"$in": ["container_1", "missing"]}}}, "jsonClass": "TextAnnotation"}
+    self.assertEqual(self.test_db._get_candidate_ids(find_filter), ["annotation"])
+    self.assertEqual(self.assert_find_agrees_with_scan(find_filter), ["annotation"])
+    self.test_db.update_doc({"_id": "annotation", "jsonClass": "ImageAnnotation", "targets": [{"jsonClass": "Target", "container_id": "container_1"}]})
+    self.assertEqual(self.test_db._get_candidate_ids(find_filter), [])
+    self.test_db.delete_doc("annotation")
+    self.assertEqual(self.test_db.target_index.get_ids(container_ids=["container_1"], json_classes=["ImageAnnotation"]), {})
+
+  def test_find_order(self):
+    # Documents are found in the order they were first written - whether found through an index or by scanning.
+    doc = self.test_db.find_by_id("doc_3")
+    doc["version"] = 2
+    self.test_db.update_doc(doc)
+    self.test_db.delete_doc("doc_6")
+    self.test_db.update_doc({"_id": "doc_6", "jsonClass": "JsonObject", "path": "books/0"})
+    expected_ids = ["doc_0", "doc_3", "doc_9", "doc_6"]
+    self.assertEqual([doc["_id"] for doc in self.test_db.find({"path": "books/0"})], expected_ids)
+    self.assertEqual([doc["_id"] for doc in self.test_db.find({"jsonClass": "JsonObject", "path": {"$in": ["books/0"]}})], expected_ids)
+    self.assertEqual([doc["_id"] for doc in self.test_db.find({"targets": {"$elemMatch": {"container_id": "container_1"}}})], ["doc_1", "doc_3", "doc_5", "doc_7", "doc_9"])
+    self.assertEqual([doc["_id"] for doc in self.test_db.find({})], ["doc_%d" % i for i in (0, 1, 2, 3, 4, 5, 7, 8, 9, 6)])
+
+
+
+class _CollidingKey(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __hash__(self):
+    return 42
+
+  def __eq__(self, other):
+    return isinstance(other, _CollidingKey) and other.name == self.name
+
+
+class TestInMemorySnapshots(unittest.TestCase):
+
+  def setUp(self):
+    self.test_db = in_memory.InMemoryDb(db_name_frontend="dummy")
+    self.test_db.add_index(keys_dict={"path": 1}, index_name="path")
+    self.test_db.update_docs([{"_id": "doc_%d" % i, "path": "books/%d" % (i % 3)} for i in range(10)])
+
+  def test_persistent_map(self):
+    maps = [in_memory._PersistentMap()]
+    keys = list(range(500)) + ["key_%d" % i for i in range(500)] + [_CollidingKey(i) for i in range(20)]
+    for key in keys:
+      maps.append(maps[-1].set(key, str(key)))
+    for num_keys in (0, 10, 520, len(keys)):
+      self.assertEqual(len(maps[num_keys]), num_keys)
+      self.assertEqual(len(list(maps[num_keys].items())), num_keys)
+    self.assertEqual(maps[-1][keys[-1]], str(keys[-1]))
+    self.assertNotIn(keys[-1], maps[-2])
+    smaller_map = maps[-1]
+    for key in keys[::2]:
+      smaller_map = smaller_map.discard(key)
+    self.assertEqual(sorted(map(str, smaller_map.keys())), sorted(str(key) for key in keys[1::2]))
+    self.assertIs(smaller_map.discard("missing"), smaller_map)
+    self.assertEqual(len(maps[-1]), len(keys))
+    built_map = in_memory._PersistentMap.from_dict(dict((key, str(key)) for key in keys))
+    self.assertEqual(built_map.root, maps[-1].root)
+    self.assertEqual(built_map.discard(keys[0]).set(keys[0], "x")[keys[0]], "x")
+
+  def test_persistent_vector(self):
+    vectors = [in_memory._PersistentVector()]
+    for i in range(1100):
+      vectors.append(vectors[-1].append(i))
+    for size in (0, 1, 32, 33, 1024, 1056, 1057, 1100):
+      self.assertEqual(list(vectors[size]), list(range(size)))
+      self.assertEqual([vectors[size][i] for i in range(size)], list(range(size)))
+      built_vector = in_memory._PersistentVector.from_list(list(range(size)))
+      self.assertEqual((built_vector.root, built_vector.tail, built_vector.shift), (vectors[size].root, vectors[size].tail, vectors[size].shift))
+    self.assertRaises(IndexError, vectors[-1].__getitem__, 1100)
+    changed_vector = vectors[-1].set(5, "x").set(1099, "y")
+    self.assertEqual((changed_vector[5], changed_vector[1099], vectors[-1][5], vectors[-1][1099]), ("x", "y", 5, 1099))
+    # Changes in a batch are made in place, once copied.
+    owned = {}
+    batch_vector = vectors[500]
+    expected_items = list(range(500))
+    for i in range(500, 1100):
+      batch_vector = batch_vector.append(i, owned).set(i // 2, -i, owned)
+      expected_items.append(i)
+      expected_items[i // 2] = -i
+    self.assertEqual(list(batch_vector), expected_items)
+    self.assertEqual(list(vectors[500]), list(range(500)))
+
+  def test_db_mapping(self):
+    self.test_db.update_doc({"_id": "doc_3", "path": "books/new"})
+    self.test_db.delete_doc("doc_5")
+    self.assertIsInstance(self.test_db.db, Mapping)
+    self.assertEqual(list(self.test_db.db), ["doc_%d" % i for i in (0, 1, 2, 3, 4, 6, 7, 8, 9)])
+    self.assertEqual(self.test_db.db["doc_3"]["path"], "books/new")
+    self.assertNotIn("doc_5", self.test_db.db)
+    self.assertEqual(dict(self.test_db.db), dict((doc["_id"], doc) for doc in self.test_db.find({})))
+    # Deleting most documents leaves the order of the rest.
+    self.test_db.update_docs([{"_id": "new_%d" % i} for i in range(100)])
+    self.test_db.delete_docs(["new_%d" % i for i in range(100) if i != 50] + ["doc_%d" % i for i in (0, 1, 2, 4, 6, 7, 8)])
+    self.test_db.update_doc({"_id": "doc_0"})
+    self.assertEqual(len(self.test_db._version.order), 4)
+    self.assertEqual([doc["_id"] for doc in self.test_db.find({})], ["doc_3", "doc_9", "new_50", "doc_0"])
+
+  def test_find_iterates_a_snapshot(self):
+    results = self.test_db.find({"path": {"$exists": True}})
+    next(results)
+    self.test_db.update_docs([{"_id": "doc_%d" % i, "path": "books/new"} for i in range(10, 20)])
+    self.test_db.delete_doc("doc_0")
+    self.assertEqual(len(list(results)), 9)
+    self.assertEqual(len(list(self.test_db.find({"path": {"$exists": True}}))), 19)
+    self.assertEqual(len(list(self.test_db.find({"path": "books/new"}))), 10)
+
+  def test_stored_docs_are_not_shared(self):
+    doc = {"path": "books/shared", "targets": [{"container_id": "a"}]}
+    self.test_db.update_doc(doc)
+    doc["targets"].append({"container_id": "b"})
+    found_doc = self.test_db.find_by_id(doc["_id"])
+    self.assertEqual(len(found_doc["targets"]), 1)
+    found_doc["path"] = "books/modified"
+    self.assertEqual(self.test_db.find_by_id(doc["_id"])["path"], "books/shared")
+    self.assertEqual(list(self.test_db.find({"path": "books/modified"})), [])
+
+  def test_delete_docs_is_atomic(self):
+    self.assertRaises(KeyError, self.test_db.delete_docs, ["doc_1", "missing"])
+    self.assertIsNotNone(self.test_db.find_by_id("doc_1"))
+
+  def test_concurrent_reads_and_writes(self):
+    errors = []
+    is_writing = [True]
+
+    def write():
+      for i in range(200):
+        # Both documents of a pair are always written together.
+        self.test_db.update_docs([{"_id": "pair_%d_a" % i, "path": "pairs", "pair": i}, {"_id": "pair_%d_b" % i, "path": "pairs", "pair": i}])
+        if i % 2:
+          self.test_db.delete_docs(["pair_%d_a" % (i - 1), "pair_%d_b" % (i - 1)])
+      is_writing[0] = False
+
+    def read():
+      try:
+        while is_writing[0]:
+          pairs = [doc["pair"] for doc in self.test_db.find({"path": "pairs"})]
+          self.assertTrue(all(pairs.count(pair) == 2 for pair in pairs))
+          self.assertEqual(len(list(self.test_db.find({"path": {"$exists": True}}))) % 2, 0)
+      except Exception as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(4)] + [threading.Thread(target=write)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(errors, [])
+    self.assertEqual(len(list(self.test_db.find({"path": "pairs"}))), 200)
 
 
 if __name__ == '__main__':
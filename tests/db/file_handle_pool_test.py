@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+import os
+
+import pytest
+
+from sanskrit_data.db import file_handle_pool
+from sanskrit_data.schema import books
+from tests.db import PAGE_IDS, example_store_db, write_file
+
+PAGE_ID = PAGE_IDS[0]
+
+
+def test_file_handle_pool(tmpdir):
+  pool = file_handle_pool.FileHandlePool(max_open_files=2)
+  paths = [str(tmpdir.join("file_%d" % index)) for index in range(3)]
+  for index, path in enumerate(paths):
+    write_file(path, b"%d" % index * 10)
+  assert pool.read_range(paths[0], offset=2, length=3) == b"000"
+  assert pool.read_range(paths[0], offset=8, length=5) == b"00"
+  assert pool.read_range(paths[0], offset=20) == b""
+  assert pool.get_size(paths[1]) == 10
+  with pytest.raises(ValueError):
+    pool.read_range(paths[0], offset=-1)
+
+  # Files in use outlive their eviction.
+  with pool.open_view(paths[0]) as view:
+    assert isinstance(view, memoryview) and view.readonly
+    pool.read_range(paths[1])
+    pool.read_range(paths[2])
+    assert list(pool.files) == [os.path.abspath(paths[1]), os.path.abspath(paths[2])]
+    assert view[:2].tobytes() == b"00"
+  with pytest.raises(ValueError):
+    view.tobytes()
+
+  # Replaced files are mapped afresh.
+  write_file(paths[1], b"replaced")
+  assert pool.read_range(paths[1]) == b"replaced"
+  write_file(paths[1], b"")
+  assert pool.read_range(paths[1]) == b""
+  pool.close()
+  assert len(pool.files) == 0
+  with pytest.raises(FileNotFoundError):
+    pool.read_range(str(tmpdir.join("missing")))
+
+
+def test_file_views(tmpdir):
+  store = str(tmpdir.join("store"))
+  db = example_store_db(store_dir=store)
+  page = books.BookPortion.from_id(id=PAGE_ID, db_interface=db)
+  with open(os.path.join(store, PAGE_ID, "page.jpg"), "rb") as page_file:
+    content = page_file.read()
+  assert page.read_file_range(db_interface=db, file_name="page.jpg") == content
+  with page.open_file_view(db_interface=db, file_name="page.jpg", offset=100, length=50) as view:
+    assert view.tobytes() == content[100:150]
+  assert db.get_file_handle_pool() is db.get_file_handle_pool()
+
+  # store_file replaces files, rather than overwriting mapped ones.
+  with page.open_file_view(db_interface=db, file_name="page.jpg", length=4) as view:
+    write_file(str(tmpdir.join("new.jpg")), b"new content")
+    page.store_file(db_interface=db, source_path=str(tmpdir.join("new.jpg")), file_name="page.jpg")
+    assert view.tobytes() == content[:4]
+  assert page.read_file_range(db_interface=db, file_name="page.jpg", offset=4) == b"content"
+
+  db.use_blob_store().migrate_object_dirs()
+  assert page.read_file_range(db_interface=db, file_name="page.jpg") == b"new content"
+  with pytest.raises(FileNotFoundError):
+    page.read_file_range(db_interface=db, file_name="missing.jpg")
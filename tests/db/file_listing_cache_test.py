@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+
+import pytest
+
+from sanskrit_data.db import file_listing_cache
+from sanskrit_data.schema import books, common
+from tests.db import PAGE_IDS, example_store_db, write_file
+
+
+def age(path, seconds=60):
+  """Backdate path, so that its listing is trusted."""
+  os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns - seconds * 10 ** 9))
+
+
+@pytest.mark.parametrize("check_mtime", [True, False])
+def test_file_listing_cache(tmpdir, monkeypatch, check_mtime):
+  root_dir = str(tmpdir)
+  for file_name in ("b.png", "a.png", "a.txt", ".hidden"):
+    write_file(os.path.join(root_dir, "x", file_name))
+  age(os.path.join(root_dir, "x"))
+  cache = file_listing_cache.FileListingCache(root_dir=root_dir, check_mtime=check_mtime)
+  assert cache.list_files_many(dir_names=["x", "y"]) == {"x": ["a.png", "a.txt", "b.png"], "y": []}
+  assert cache.list_files(dir_name="x", suffix_pattern="*.png") == ["a.png", "b.png"]
+  assert cache.list_files(dir_name="x", suffix_pattern=".*") == [".hidden"]
+
+  # Trusted listings are not read again.
+  scandir = os.scandir
+  scanned = []
+  monkeypatch.setattr(os, "scandir", lambda path: scanned.append(path) or scandir(path))
+  assert cache.list_files(dir_name="x") == ["a.png", "a.txt", "b.png"]
+  assert scanned == []
+
+  # Changes made elsewhere are noticed by mtime - or upon invalidate.
+  write_file(os.path.join(root_dir, "x", "c.png"))
+  write_file(os.path.join(root_dir, "y", "d.png"))
+  if check_mtime:
+    assert cache.list_files_many(dir_names=["x", "y"]) == {"x": ["a.png", "a.txt", "b.png", "c.png"], "y": ["d.png"]}
+  else:
+    assert cache.list_files_many(dir_names=["x", "y"]) == {"x": ["a.png", "a.txt", "b.png"], "y": []}
+    cache.invalidate(dir_name="x")
+    cache.invalidate(dir_name="y")
+    assert cache.list_files_many(dir_names=["x", "y"]) == {"x": ["a.png", "a.txt", "b.png", "c.png"], "y": ["d.png"]}
+  shutil.rmtree(os.path.join(root_dir, "y"))
+  cache.invalidate(dir_name="y")
+  assert cache.list_files(dir_name="y") == []
+
+
+def test_listing_recently_modified_directories(tmpdir):
+  write_file(str(tmpdir.join("x", "a.png")))
+  cache = file_listing_cache.FileListingCache(root_dir=str(tmpdir))
+  cache.refresh()
+  # Added within the same mtime tick (simulated by restoring the mtime).
+  mtime_ns = os.stat(str(tmpdir.join("x"))).st_mtime_ns
+  write_file(str(tmpdir.join("x", "b.png")))
+  os.utime(str(tmpdir.join("x")), ns=(mtime_ns, mtime_ns))
+  assert cache.list_files(dir_name="x") == ["a.png", "b.png"]
+
+
+def test_db_file_listing_cache(tmpdir):
+  store = str(tmpdir.join("store"))
+  db = example_store_db(store_dir=store)
+  pages = [books.BookPortion.from_id(id=page_id, db_interface=db) for page_id in PAGE_IDS]
+  expected_files = common.JsonObject.list_files_many(objects=pages, db_interface=db)
+  assert expected_files == {PAGE_IDS[0]: ["page.jpg"], PAGE_IDS[1]: ["page.png"], PAGE_IDS[2]: ["page.png"]}
+  db.use_file_listing_cache(check_mtime=False)
+  assert common.JsonObject.list_files_many(objects=pages, db_interface=db) == expected_files
+  assert db.file_listing_cache.complete
+
+  # The library's own writes and deletions keep the cache fresh.
+  pages[0].store_file(db_interface=db, source_path=os.path.join(store, PAGE_IDS[1], "page.png"))
+  assert pages[0].list_files(db_interface=db) == ["page.jpg", "page.png"]
+  pages[0].delete_in_collection(db_interface=db)
+  assert pages[0].list_files(db_interface=db) == []
+  assert db.dump_books(export_dir=str(tmpdir.join("export"))).num_files_copied == 3
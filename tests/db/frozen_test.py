@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+
+import logging
+
+import pytest
+
+from sanskrit_data.db import frozen, in_memory
+from sanskrit_data.schema import books, common
+from tests.benchmarks import make_annotation_corpus
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+@pytest.fixture(scope="module")
+def dbs(tmpdir_factory):
+  in_memory_db = in_memory.BookPortionsInMemory(db_name_frontend="test")
+  in_memory_db.update_docs(make_annotation_corpus(num_annotations=300, num_pages=10))
+  in_memory_db.update_docs([
+    {"_id": u"रामः", "number": 1.0, "flag": True, "tags": ["a", "b"]},
+    {"_id": "int_doc", "number": 1, "flag": 1, "tags": ["b"]},
+  ])
+  image_path = str(tmpdir_factory.mktemp("frozen").join("corpus.img"))
+  index_paths = frozen._get_default_index_paths(db_interface=in_memory_db) + ["number", "flag", "tags", "content.script_renderings.text"]
+  assert frozen.freeze(db_interface=in_memory_db, image_path=image_path, index_paths=index_paths) == 313
+  frozen_db = frozen.FrozenBookPortionsDb(image_path=image_path, db_name_frontend="test")
+  yield in_memory_db, frozen_db
+  frozen_db.close()
+
+
+@pytest.mark.parametrize("find_filter", [
+  {},
+  {"jsonClass": "TextAnnotation"},
+  {"targets": {"$elemMatch": {"container_id": "page_3"}}, "jsonClass": {"$in": ["TextAnnotation", "Annotation"]}},
+  {"targets.container_id": {"$in": ["page_3", "book", "missing"]}},
+  {"path": "myrepo/halAyudha"},
+  {"content.script_renderings.text": "rAmaH 7"},
+  {"number": 1},
+  {"flag": 1},
+  {"flag": True},
+  {"tags": "b"},
+  {"jsonClass": "Missing"},
+])
+def test_find_agrees_with_in_memory_db(dbs, find_filter):
+  in_memory_db, frozen_db = dbs
+  expected_docs = sorted(in_memory_db.find(find_filter), key=lambda doc: doc["_id"])
+  assert sorted(frozen_db.find(find_filter), key=lambda doc: doc["_id"]) == expected_docs
+  if find_filter:
+    assert len(expected_docs) == 0 or frozen_db._get_candidate_doc_numbers(find_filter) is not None
+
+
+def test_lookups(dbs):
+  in_memory_db, frozen_db = dbs
+  assert len(frozen_db) == 313
+  for doc_id in ["book", "page_0", "annotation_299", u"रामः", "int_doc"]:
+    assert frozen_db.find_by_id(doc_id) == in_memory_db.find_by_id(doc_id)
+  assert frozen_db.find_by_id("missing") is None
+  assert frozen_db.find_by_ids(["page_1", "zzz"]) == [in_memory_db.find_by_id("page_1"), None]
+  assert books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=frozen_db)._id == "book"
+  page = common.JsonObject.from_id(id="page_3", db_interface=frozen_db)
+  assert len(page.get_targetting_entities(db_interface=frozen_db)) == 30
+  with pytest.raises(NotImplementedError):
+    frozen_db.update_doc({"_id": "new"})
+
+
+def test_empty_and_invalid_images(tmpdir):
+  image_path = str(tmpdir.join("empty.img"))
+  frozen.freeze(db_interface=in_memory.InMemoryDb(db_name_frontend="test"), image_path=image_path)
+  empty_db = frozen.FrozenDb(image_path=image_path, db_name_frontend="test")
+  assert list(empty_db.find({})) == [] and empty_db.find_by_id("x") is None
+  empty_db.close()
+  tmpdir.join("invalid.img").write("not an image, but long enough")
+  with pytest.raises(ValueError):
+    frozen.FrozenDb(image_path=str(tmpdir.join("invalid.img")), db_name_frontend="test")
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from sanskrit_data.db import in_memory
+from sanskrit_data.db.identity_map import IdentityMap
+from sanskrit_data.schema import books, common
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def make_db_with_book():
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test")
+  book = books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha", portion_class="book").update_collection(db)
+  for page_index in range(3):
+    books.BookPortion.from_details(title="page_%d" % page_index, targets=[books.BookPositionTarget.from_details(container_id=book._id, position=page_index)]).update_collection(db)
+  return db, book
+
+
+def test_same_object_within_session():
+  db, book = make_db_with_book()
+  assert common.JsonObject.from_id(id=book._id, db_interface=db) is not common.JsonObject.from_id(id=book._id, db_interface=db)
+  with IdentityMap(db_interface=db) as identity_map:
+    fetched_book = common.JsonObject.from_id(id=book._id, db_interface=db)
+    assert common.JsonObject.from_id(id=book._id, db_interface=db) is fetched_book
+    assert books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=db) is fetched_book
+    assert db.list_books() == [fetched_book] and db.list_books()[0] is fetched_book
+
+    # Loading a tree twice decodes its documents once.
+    db.get(path="myrepo/halAyudha")
+    misses = identity_map.stats["misses"]
+    book_node = db.get(path="myrepo/halAyudha")
+    assert identity_map.stats["misses"] == misses
+    assert book_node.content is fetched_book and len(book_node.children) == 3
+
+    # Writes invalidate the entry.
+    fetched_book.title = "changed"
+    updated_book = fetched_book.update_collection(db)
+    assert updated_book is not fetched_book
+    assert common.JsonObject.from_id(id=book._id, db_interface=db) is updated_book
+    db.delete_doc(book._id)
+    assert common.JsonObject.from_id(id=book._id, db_interface=db) is None
+  assert db.get_identity_map() is None and db.write_listeners == []
+
+
+def test_revisions_and_threads():
+  db, book = make_db_with_book()
+  with IdentityMap(db_interface=db):
+    book_dict = db.find_by_id(book._id)
+    fetched_book = common.JsonObject.make_from_db_dict(dict(book_dict, _rev="1"), db_interface=db)
+    assert common.JsonObject.make_from_db_dict(dict(book_dict, _rev="1"), db_interface=db) is fetched_book
+    assert common.JsonObject.make_from_db_dict(dict(book_dict, _rev="2"), db_interface=db) is not fetched_book
+
+    # Other threads don't share the map.
+    fetched_in_thread = []
+    thread = threading.Thread(target=lambda: fetched_in_thread.append(common.JsonObject.from_id(id=book._id, db_interface=db)))
+    thread.start()
+    thread.join()
+    assert fetched_in_thread[0] is not common.JsonObject.from_id(id=book._id, db_interface=db)
+
+
+def test_bounded():
+  db, book = make_db_with_book()
+  with IdentityMap(db_interface=db, max_size=2) as identity_map:
+    db.get(path="myrepo/halAyudha")
+    assert len(identity_map.objects) == 2
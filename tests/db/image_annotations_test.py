@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+
+import logging
+import os
+
+import pytest
+
+import tests.db
+from sanskrit_data.db import in_memory
+from sanskrit_data.schema import books, common, ullekhanam
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+PAGE_IDS = ["5a3dfa6f751d5d9780b4c6cd", "5a3dfa6f751d5d9780b4c6d0", "5a3dfa6f751d5d9780b4c6d3"]
+
+
+class FakePageImage(object):
+  """Stands in for docimage.DocumentImage."""
+  detected_pages = []
+
+  def __init__(self, page):
+    self.page = page
+
+  def find_text_regions(self):
+    FakePageImage.detected_pages.append(self.page._id)
+    index = PAGE_IDS.index(self.page._id)
+    return [ullekhanam.Rectangle.from_details(x=10 * region_index, y=index, w=5, h=5, score=0.5) for region_index in range(index + 1)]
+
+
+@pytest.fixture()
+def db():
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test")
+  db.import_all(rootdir=os.path.join(os.path.dirname(tests.db.__file__), "textract-example-repo/books"))
+  FakePageImage.detected_pages = []
+  return db
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_update_image_annotations_in_bulk(db, monkeypatch, num_workers):
+  pages = [books.BookPortion.from_id(id=page_id, db_interface=db) for page_id in PAGE_IDS]
+  find = db.find
+  find_filters = []
+  monkeypatch.setattr(db, "find", lambda find_filter: find_filters.append(find_filter) or find(find_filter))
+  update_docs = db.update_docs
+  written_batches = []
+  monkeypatch.setattr(db, "update_docs", lambda docs: written_batches.append(len(docs)) or update_docs(docs))
+  annotations_by_page = db.update_image_annotations_in_bulk(pages=pages, get_page_image=FakePageImage, num_workers=num_workers, batch_size=2)
+  assert len(find_filters) == 2
+  # Regions of pages 0 and 1, then of page 2 - written batch_size at a time.
+  assert written_batches == [2, 1, 2, 1]
+  assert sorted(FakePageImage.detected_pages) == PAGE_IDS
+  assert [len(annotations_by_page[page_id]) for page_id in PAGE_IDS] == [1, 2, 3]
+  for page_id in PAGE_IDS:
+    for annotation in annotations_by_page[page_id]:
+      assert isinstance(annotation, ullekhanam.ImageAnnotation)
+      assert annotation.targets[0].container_id == page_id
+      assert annotation.source.id == "pyCV2"
+      assert "score" not in db.find_by_id(annotation._id)["targets"][0]["rectangle"]
+  assert sorted(annotation.targets[0].rectangle.x1 for annotation in annotations_by_page[PAGE_IDS[2]]) == [0, 10, 20]
+  monkeypatch.undo()
+  assert [obj._id for obj in pages[1].get_targetting_entities(db_interface=db, entity_type="ImageAnnotation")] == [annotation._id for annotation in annotations_by_page[PAGE_IDS[1]]]
+
+  # Pages with annotations are not detected again.
+  FakePageImage.detected_pages = []
+  assert db.update_image_annotations(page=pages[0], page_image=FakePageImage(pages[0])) == annotations_by_page[PAGE_IDS[0]]
+  assert db.update_image_annotations_in_bulk(pages=pages, get_page_image=FakePageImage, num_workers=num_workers) == annotations_by_page
+  assert FakePageImage.detected_pages == []
+
+
+def test_add_image_annotations_in_bulk(db):
+  pages = [books.BookPortion.from_id(id=page_id, db_interface=db) for page_id in PAGE_IDS]
+  first_page_annotations = db.update_image_annotations(page=pages[0], page_image=FakePageImage(pages[0]))
+  source = common.DataSource.from_details(source_type="user_supplied", id="marker")
+  annotations_by_page = db.add_image_annotations_in_bulk(pages_and_regions=[(page, FakePageImage(page).find_text_regions()) for page in pages], source=source, batch_size=2)
+  assert annotations_by_page[PAGE_IDS[0]] == first_page_annotations
+  assert [annotation.source.id for annotation in annotations_by_page[PAGE_IDS[2]]] == ["marker"] * 3
+
+  # Annotations of annotations (and not of, say, users) are fine.
+  annotation = annotations_by_page[PAGE_IDS[1]][0]
+  assert len(db.add_image_annotations_in_bulk(pages_and_regions=[(annotation, [ullekhanam.Rectangle.from_details(x=1, y=1, w=1, h=1)])])[annotation._id]) == 1
+  text_annotation = ullekhanam.TextAnnotation.from_details(targets=[common.Target.from_details(container_id=PAGE_IDS[0])], source=source, content=common.Text.from_text_string(text_string=u"रामः")).update_collection(db)
+  with pytest.raises(common.TargetValidationError):
+    db.add_image_annotations_in_bulk(pages_and_regions=[(text_annotation, [ullekhanam.Rectangle.from_details(x=1, y=1, w=1, h=1)])])
+  bad_region = ullekhanam.Rectangle.from_details(x=1, y=1, w=1, h=1)
+  bad_region.x1 = "1"
+  with pytest.raises(common.ValidationError):
+    db.add_image_annotations_in_bulk(pages_and_regions=[(annotations_by_page[PAGE_IDS[2]][0], [ullekhanam.Rectangle.from_details(x=1, y=1, w=1, h=1)]), (annotations_by_page[PAGE_IDS[2]][1], [bad_region])])
@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+
+import pytest
+
+import tests.db
+from sanskrit_data import json_stream_helper
+from sanskrit_data.db import import_manifest, in_memory
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def test_manifest(tmpdir):
+  manifest_path = str(tmpdir.join("store.import_manifest.jsonl"))
+  manifest = import_manifest.ImportManifest(manifest_path=manifest_path)
+  manifest.record(path="a/book.json", content_hash="1", doc_ids=["x", "y"])
+  manifest.record(path="b/book.json", content_hash="2", doc_ids=["z"])
+  manifest.record(path="a/book.json", content_hash="3", doc_ids=["x"])
+  manifest.close()
+  with open(manifest_path, "a") as manifest_file:
+    manifest_file.write('{"path": "c/book.json", "ha')
+
+  manifest = import_manifest.ImportManifest(manifest_path=manifest_path)
+  assert manifest.get("a/book.json") == {"hash": "3", "ids": ["x"]}
+  assert manifest.get(os.path.abspath("b/book.json"))["ids"] == ["z"]
+  assert manifest.get("c/book.json") is None
+  manifest.record(path="c/book.json", content_hash="4", doc_ids=[])
+  manifest.compact()
+  manifest.close()
+  with open(manifest_path) as manifest_file:
+    assert len(manifest_file.readlines()) == 3
+  manifest = import_manifest.ImportManifest(manifest_path=manifest_path)
+  assert manifest.get("c/book.json")["hash"] == "4"
+  manifest.record_pending(path="a/book.json", root_id="r1")
+  manifest.record_pending(path="a/book.json", root_id="r2")
+  assert manifest.get("a/book.json") == {"hash": None, "ids": ["x"], "pending_root_ids": ["r1", "r2"]}
+  manifest.record(path="a/book.json", content_hash="5", doc_ids=["w"])
+  assert manifest.get("a/book.json") == {"hash": "5", "ids": ["w"]}
+  manifest.close()
+
+
+def write_book(rootdir, book_index, num_pages=3):
+  with open(os.path.join(os.path.dirname(tests.db.__file__), "textract-example-repo/books/5a3dfa6f751d5d9780b4c6ca/book.json")) as book_file:
+    book_map = json.loads(book_file.read().replace('"5a3dfa6f751d5d9780b4c6', '"book_%d_' % book_index))
+  del book_map["children"][num_pages:]
+  os.makedirs(os.path.join(rootdir, "book_%d" % book_index), exist_ok=True)
+  json_stream_helper.dump_content_first(json_map=book_map, filename=os.path.join(rootdir, "book_%d" % book_index, "book.json"))
+
+
+def test_incremental_import(tmpdir, monkeypatch):
+  rootdir = str(tmpdir.join("books"))
+  store = str(tmpdir.join("store"))
+  for book_index in range(3):
+    write_book(rootdir=rootdir, book_index=book_index)
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=store)
+  assert db.get_import_manifest_path() == store + ".import_manifest.jsonl"
+
+  # An import interrupted while writing the second book.
+  import_book = db.import_book
+
+  def interrupted_import_book(book_json_path, **kwargs):
+    if "book_1" in book_json_path:
+      raise KeyboardInterrupt()
+    return import_book(book_json_path=book_json_path, **kwargs)
+  monkeypatch.setattr(db, "import_book", interrupted_import_book)
+  with pytest.raises(KeyboardInterrupt):
+    db.import_all(rootdir=rootdir, incremental=True)
+  monkeypatch.setattr(db, "import_book", import_book)
+
+  stats = db.import_all(rootdir=rootdir, incremental=True)
+  assert (stats.num_unchanged, stats.num_books) == (1, 2)
+  stats = db.import_all(rootdir=rootdir, incremental=True)
+  assert (stats.num_unchanged, stats.num_books, stats.num_nodes) == (3, 0, 0)
+
+  # A page removed from a book is deleted from the database, along with its files.
+  assert db.find_by_id("book_2_d3") is not None
+  os.makedirs(os.path.join(store, "book_2_d3"))
+  write_book(rootdir=rootdir, book_index=2, num_pages=2)
+  stats = db.import_all(rootdir=rootdir, incremental=True, num_workers=2)
+  assert (stats.num_unchanged, stats.num_books, stats.num_nodes) == (2, 1, 3)
+  assert db.find_by_id("book_2_d3") is None
+  assert not os.path.exists(os.path.join(store, "book_2_d3"))
+  assert db.find_by_id("book_2_d0") is not None
+
+  # The manifest does not describe a fresh database.
+  fresh_db = in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=store)
+  assert fresh_db.import_all(rootdir=rootdir, incremental=True).num_books == 3
+
+  with pytest.raises(ValueError):
+    in_memory.BookPortionsInMemory(db_name_frontend="test").import_all(rootdir=rootdir, incremental=True)
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_incremental_import_after_partial_write(tmpdir, monkeypatch, num_workers):
+  """Documents of a book without _id-s, left by an interrupted import, are deleted when the book is imported again."""
+  rootdir = str(tmpdir.join("books"))
+  write_book(rootdir=rootdir, book_index=0)
+  book_json_path = os.path.join(rootdir, "book_0", "book.json")
+  with open(book_json_path) as book_file:
+    book_json = book_file.read()
+  with open(book_json_path, "w") as book_file:
+    book_file.write(book_json.replace('"_id"', '"_unused_id"'))
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test", external_file_store=str(tmpdir.join("store")))
+
+  # Interrupted after the root and the first page are written.
+  update_docs = db.update_docs
+  written_docs = []
+
+  def interrupted_update_docs(docs):
+    if len(written_docs) >= 2:
+      raise KeyboardInterrupt()
+    updated_docs = update_docs(docs)
+    written_docs.extend(updated_docs)
+    return updated_docs
+  monkeypatch.setattr(db, "update_docs", interrupted_update_docs)
+  with pytest.raises(KeyboardInterrupt):
+    db.import_all(rootdir=rootdir, incremental=True, num_workers=num_workers, batch_size=1)
+  monkeypatch.undo()
+  assert len(list(db.find(find_filter={}))) == 2
+
+  stats = db.import_all(rootdir=rootdir, incremental=True, num_workers=num_workers)
+  assert (stats.num_books, stats.num_nodes) == (1, 4)
+  assert all(db.find_by_id(doc["_id"]) is None for doc in written_docs)
+  assert len(list(db.find(find_filter={}))) == 4
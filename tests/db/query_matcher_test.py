@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import logging
+
+import pytest
+
+from sanskrit_data.db import query_matcher
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+USER = {
+  "_id": "user_1",
+  "jsonClass": "User",
+  "user_type": "human",
+  "age": 30,
+  "verified": True,
+  "authentication_infos": [
+    {"jsonClass": "AuthenticationInfo", "auth_user_id": "sample@gmail.com", "auth_provider": "google"},
+    {"jsonClass": "AuthenticationInfo", "auth_user_id": "sample", "auth_provider": "vedavaapi"},
+  ],
+  "permissions": [{"jsonClass": "UserPermission", "service": "ullekhanam", "actions": ["read", "write"]}],
+  "tags": ["a", "b"],
+  "source": {"jsonClass": "DataSource", "source_type": "user_supplied"},
+}
+
+
+FILTERS_AND_EXPECTED_MATCHES = [
+  ({}, True),
+  ({"user_type": "human"}, True),
+  ({"user_type": "bot"}, False),
+  ({"source.source_type": "user_supplied"}, True),
+  ({"source": {"jsonClass": "DataSource", "source_type": "user_supplied"}}, True),
+  ({"authentication_infos.auth_user_id": "sample"}, True),
+  ({"authentication_infos.auth_user_id": "sample", "authentication_infos.auth_provider": "google"}, True),
+  ({"authentication_infos": {"$elemMatch": {"auth_user_id": "sample", "auth_provider": "google"}}}, False),
+  ({"authentication_infos": {"$elemMatch": {"auth_user_id": "sample", "auth_provider": "vedavaapi"}}}, True),
+  ({"authentication_infos.1.auth_provider": "vedavaapi"}, True),
+  ({"permissions.actions": "write"}, True),
+  ({"tags": "a"}, True),
+  ({"tags": ["a", "b"]}, True),
+  ({"tags": {"$elemMatch": {"$in": ["b", "c"]}}}, True),
+  ({"age": {"$gt": 20, "$lte": 30}}, True),
+  ({"age": {"$lt": 30}}, False),
+  ({"age": {"$gt": "20"}}, False),
+  ({"age": {"$in": [1, 30]}}, True),
+  ({"age": {"$nin": [1, 30]}}, False),
+  ({"age": {"$ne": 31}}, True),
+  ({"age": {"$eq": 30}}, True),
+  ({"verified": 1}, False),
+  ({"verified": True}, True),
+  ({"missing_field": None}, True),
+  ({"missing_field": {"$exists": False}}, True),
+  ({"age": {"$exists": True}}, True),
+  ({"authentication_infos.auth_user_id": {"$regex": "^SAMPLE@", "$options": "i"}}, True),
+  ({"$or": [{"user_type": "bot"}, {"age": 30}]}, True),
+  ({"$and": [{"user_type": "bot"}, {"age": 30}]}, False),
+]
+
+
+@pytest.mark.parametrize("find_filter, expected", FILTERS_AND_EXPECTED_MATCHES)
+def test_matches(find_filter, expected):
+  assert query_matcher.matches(find_filter, USER) == expected
+
+
+def test_compiled_filters_cached():
+  assert query_matcher.compile_filter({"a": 1, "b": 2}) is query_matcher.compile_filter({"b": 2, "a": 1})
+
+
+def test_unsupported_operator():
+  with pytest.raises(ValueError):
+    query_matcher.compile_filter({"a": {"$where": "true"}})
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+
+import logging
+import os
+
+import pytest
+
+from sanskrit_data.db import in_memory, sqlite
+from tests.benchmarks import make_annotation_corpus
+from tests.db import query_matcher_test
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def make_corpus():
+  corpus = make_annotation_corpus(num_annotations=20, num_pages=5)
+  corpus.append(dict(query_matcher_test.USER))
+  corpus.append({"_id": "odd", "jsonClass": "JsonObject", "authentication_infos": {"auth_user_id": "sample"}, "tags": "a", "age": "30", "verified": 1})
+  return corpus
+
+
+@pytest.fixture(params=[False, True], ids=["indexed_after", "indexed_before"])
+def dbs(request):
+  sqlite_db = sqlite.BookPortionsSqlite(db_path=":memory:", db_name_frontend="test")
+  in_memory_db = in_memory.InMemoryDb(db_name_frontend="test")
+  if request.param:
+    sqlite_db.add_index(keys_dict={"authentication_infos.auth_user_id": 1}, index_name="auth_user_id")
+  for doc in make_corpus():
+    sqlite_db.update_doc(dict(doc))
+    in_memory_db.update_doc(dict(doc))
+  if not request.param:
+    sqlite_db.add_index(keys_dict={"authentication_infos.auth_user_id": 1}, index_name="auth_user_id")
+  return sqlite_db, in_memory_db
+
+
+FIND_FILTERS = [find_filter for find_filter, _ in query_matcher_test.FILTERS_AND_EXPECTED_MATCHES] + [
+  {"targets": {"$elemMatch": {"container_id": "page_3"}}},
+  {"targets": {"$elemMatch": {"container_id": {"$in": ["page_1", "page_2"]}}}, "jsonClass": {"$in": ["TextAnnotation"]}},
+  {"targets.container_id": "book"},
+  {"path": "myrepo/halAyudha"},
+  {"portion_class": "page", "title": {"$gte": "page_3"}},
+  {"content.script_renderings.text": "rAmaH 3"},
+  {"content.script_renderings": {"$elemMatch": {"text": {"$regex": "1$"}, "encoding_scheme": "slp1"}}},
+  {"$or": [{"_id": "odd"}, {"jsonClass": "User"}]},
+]
+
+
+@pytest.mark.parametrize("find_filter", FIND_FILTERS)
+def test_find_agrees_with_in_memory(dbs, find_filter):
+  sqlite_db, in_memory_db = dbs
+  assert sorted(doc["_id"] for doc in sqlite_db.find(find_filter)) == sorted(doc["_id"] for doc in in_memory_db.find(find_filter))
+
+
+def test_indexes_used():
+  db = sqlite.BookPortionsSqlite(db_path=":memory:", db_name_frontend="test")
+  for doc in make_corpus():
+    db.update_doc(doc)
+
+  def get_plan(find_filter):
+    sql, params = db.get_find_query(find_filter)
+    return " ".join(row[-1] for row in db.connection.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+  assert "USING INDEX index_path" in get_plan({"path": "myrepo/halAyudha"})
+  assert "index_entries_value" in get_plan({"targets": {"$elemMatch": {"container_id": "page_3"}}})
+
+
+def test_persistence_and_updates(tmpdir):
+  client = sqlite.SqliteClient(db_dir=str(tmpdir))
+  db = client.get_database_interface(db_name_backend="books", db_type="ullekhanam_db")
+  doc = db.update_doc({"jsonClass": "TextAnnotation", "targets": [{"jsonClass": "Target", "container_id": "page_1"}]})
+  doc["targets"][0]["container_id"] = "page_2"
+  db.update_doc(doc)
+  db.close()
+
+  db = client.get_database_interface(db_name_backend="books", db_type="ullekhanam_db")
+  assert db.find_by_id(doc["_id"]) == doc
+  assert list(db.find({"targets": {"$elemMatch": {"container_id": "page_1"}}})) == []
+  assert list(db.find({"targets": {"$elemMatch": {"container_id": "page_2"}}})) == [doc]
+  db.delete_doc(doc["_id"])
+  assert db.find_by_id(doc["_id"]) is None
+  db.close()
+  client.delete_database("books")
+  assert not os.path.exists(client.get_database("books"))
+
+
+def test_bulk_writes_are_atomic():
+  db = sqlite.SqliteDb(db_path=":memory:", db_name_frontend="test")
+  docs = db.update_docs([{"_id": "doc_%d" % i, "value": i} for i in range(3)])
+  assert db.find_by_ids(["doc_2", "missing", "doc_0"]) == [docs[2], None, docs[0]]
+  with pytest.raises(TypeError):
+    # The second document can't be serialized.
+    db.update_docs([{"_id": "doc_3"}, {"_id": "doc_4", "value": object()}])
+  assert db.find_by_id("doc_3") is None
+  db.delete_docs(["doc_0", "doc_1"])
+  assert [doc["_id"] for doc in db.find({})] == ["doc_2"]
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+from sanskrit_data.db import in_memory, write_ahead_log
+from sanskrit_data.schema import books, common
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def get_all_docs(db):
+  return dict((doc["_id"], doc) for doc in db.find({}))
+
+
+def test_state_survives_restart(tmpdir):
+  log_dir = str(tmpdir.join("log"))
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test", log_dir=log_dir)
+  book = books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha").update_collection(db_interface=db)
+  page = books.BookPortion.from_details(title="page", targets=[books.BookPositionTarget.from_details(container_id=book._id, position=1)]).update_collection(db_interface=db)
+  db.update_docs([{"_id": "doc_%d" % i, "text": u"रामः %d" % i} for i in range(10)])
+  db.update_doc({"_id": "doc_1", "text": "changed"})
+  db.delete_docs(["doc_2", "doc_3"])
+  expected_docs = get_all_docs(db)
+  db.close()
+
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test", log_dir=log_dir)
+  assert get_all_docs(db) == expected_docs
+  assert db.find_by_id("doc_1")["text"] == "changed"
+  assert books.BookPortion.from_path(path="myrepo/halAyudha", db_interface=db).title == "halAyudhakoshaH"
+  assert [obj._id for obj in common.JsonObject.from_id(id=book._id, db_interface=db).get_targetting_entities(db_interface=db)] == [page._id]
+  db.close()
+
+
+def test_compaction(tmpdir):
+  log_dir = str(tmpdir.join("log"))
+  db = in_memory.InMemoryDb(db_name_frontend="test", log_dir=log_dir, compact_after_records=10)
+  for i in range(35):
+    db.update_doc({"_id": "doc_%d" % (i % 15), "version": i})
+  db.delete_doc("doc_0")
+  db.compact_log()
+  db.update_doc({"_id": "doc_1", "version": "after snapshot"})
+  expected_docs = get_all_docs(db)
+  db.close()
+  assert os.path.exists(os.path.join(log_dir, write_ahead_log.SNAPSHOT_FILE_NAME))
+  segment_files = [file_name for file_name in os.listdir(log_dir) if file_name.startswith("log_")]
+  assert len(segment_files) == 1
+
+  db = in_memory.InMemoryDb(db_name_frontend="test", log_dir=log_dir)
+  assert get_all_docs(db) == expected_docs
+  # As is the order of find results.
+  assert [doc["_id"] for doc in db.find({})] == ["doc_%d" % i for i in range(1, 15)]
+  assert db.log.num_records_since_snapshot == 1
+  db.close()
+
+
+def test_partly_written_record_is_dropped(tmpdir):
+  log_dir = str(tmpdir.join("log"))
+  db = in_memory.InMemoryDb(db_name_frontend="test", log_dir=log_dir)
+  db.update_doc({"_id": "doc_1"})
+  segment_path = db.log.segment_file.name
+  db.close()
+  with open(segment_path, "a") as segment_file:
+    segment_file.write('{"seq": 2, "update": [{"_id": "do')
+
+  db = in_memory.InMemoryDb(db_name_frontend="test", log_dir=log_dir)
+  assert list(get_all_docs(db)) == ["doc_1"]
+  db.update_doc({"_id": "doc_2"})
+  db.close()
+  db = in_memory.InMemoryDb(db_name_frontend="test", log_dir=log_dir)
+  assert sorted(get_all_docs(db)) == ["doc_1", "doc_2"]
+  db.close()
+
+
+def test_group_commit(tmpdir, monkeypatch):
+  num_syncs = [0]
+  fsync = os.fsync
+
+  def slow_fsync(fd):
+    num_syncs[0] += 1
+    time.sleep(0.002)
+    fsync(fd)
+  monkeypatch.setattr(os, "fsync", slow_fsync)
+  db = in_memory.InMemoryDb(db_name_frontend="test", log_dir=str(tmpdir.join("log")))
+
+  def write(thread_index):
+    for i in range(20):
+      db.update_doc({"_id": "doc_%d_%d" % (thread_index, i)})
+  threads = [threading.Thread(target=write, args=(thread_index,)) for thread_index in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  db.close()
+  assert len(get_all_docs(in_memory.InMemoryDb(db_name_frontend="test", log_dir=str(tmpdir.join("log"))))) == 160
+  # Writers waiting together share syncs.
+  assert num_syncs[0] < 160
@@ -5,6 +5,7 @@ Tests for the ullekhanam_db interface and the associated schema classes.
 
 from __future__ import absolute_import
 
+import json
 import logging
 import os
 import sys
@@ -88,3 +89,89 @@ def test_serialization_omit_nones(caplog):
     test_obj_2.field3 = None
     test_obj_2_map = test_obj_2.to_json_map()
     assert "field3" not in test_obj_2_map
+
+
+def test_make_from_dict_matches_jsonpickle_decoding():
+    from sanskrit_data.schema import books
+    book = books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha", curated_content=common.Text.from_text_string("halAyudhaH"), targets=[books.BookPositionTarget.from_details(container_id="abc", position=2)])
+    book_map = book.to_json_map()
+    book_map["_id"] = "some_id"
+    book_map["extra"] = {"tuple": (1, 2.5, None), "nested": [{"x": "y"}, [book.curated_content.to_json_map()]]}
+    native = JsonObject.make_from_dict(book_map)
+    legacy = common._decode_via_jsonpickle(book_map)
+    legacy._id = "some_id"
+    assert native.__class__ == legacy.__class__
+    assert native.to_json_map() == legacy.to_json_map()
+    assert native.extra["tuple"] == [1, 2.5, None]
+    assert isinstance(native.extra["nested"][1][0], common.Text)
+    assert "_id" in book_map
+
+
+def test_make_from_dict_falls_back_to_jsonpickle():
+    test_obj = JsonObject.make_from_dict({"jsonClass": "Text", "odd_value": {"py/tuple": [1, 2]}})
+    assert test_obj.odd_value == (1, 2)
+
+
+def _to_json_map_multipass(obj, floating_point_precision=None):
+    # The pipeline which JsonObject.to_json_map used to run.
+    from sanskrit_data import collection_helper
+    json_map = collection_helper.dictify(obj, omit_none_values=obj._default_to_none)
+    if obj._default_to_none:
+        json_map = collection_helper.remove_dict_none_values(json_map)
+    json_map = collection_helper.tuples_to_lists(json_map)
+    json_map = collection_helper.remove_none_keys(json_map)
+    json_map = collection_helper.stringify_keys(json_map)
+    if floating_point_precision is not None:
+        json_map = collection_helper.round_floats(json_map, floating_point_precision=floating_point_precision)
+    return json_map
+
+
+def test_to_json_map_matches_multipass_pipeline():
+    from collections import OrderedDict
+    test_obj = DummyClass.from_details(field1=(1.23456, None, "x", [DummyClass2(field1=2.71828)]), field2=OrderedDict([("b", None), ("a", {"_hidden": 1, "_id": "visible", None: 2, "c": (3.14159,)})]))
+    test_obj._id = "some_id"
+    test_obj.jsonClass = "Overridden"
+    test_obj.some_set = {1}
+    for floating_point_precision in [None, 2]:
+        for default_to_none in [True, False]:
+            test_obj._default_to_none = default_to_none
+            expected = _to_json_map_multipass(test_obj, floating_point_precision=floating_point_precision)
+            actual = test_obj.to_json_map(floating_point_precision=floating_point_precision)
+            assert actual == expected
+            assert json.dumps(actual, default=str) == json.dumps(expected, default=str)
+
+
+def test_jsonl_round_trip(tmpdir):
+    jsonl_path = str(tmpdir.join("dump", "objects.jsonl"))
+    objects = [DummyClass.from_details(field1=u"रामः %d" % i, field2=[i, {"x": 1.5}]) for i in range(5)]
+    assert JsonObject.dump_to_jsonl(objects=(obj for obj in objects[:3]), path=jsonl_path) == 3
+    assert JsonObject.dump_to_jsonl(objects=objects[3:], path=jsonl_path, append=True) == 2
+    with open(jsonl_path, encoding="utf-8") as jsonl_file:
+        assert len(jsonl_file.readlines()) == 5
+
+    objects_read = JsonObject.iter_from_jsonl(path=jsonl_path)
+    assert not isinstance(objects_read, list)
+    assert list(objects_read) == objects
+    assert JsonObject.read_from_file(filename=jsonl_path) == objects
+
+    # Docs got from a db (ie. JSON maps) may be dumped as they are.
+    assert JsonObject.dump_to_jsonl(objects=[obj.to_json_map() for obj in objects[:1]], path=jsonl_path) == 1
+    assert list(JsonObject.iter_from_jsonl(path=jsonl_path)) == objects[:1]
+
+
+def test_jsonl_errors_name_the_line(tmpdir):
+    jsonl_path = str(tmpdir.join("objects.jsonl"))
+    with open(jsonl_path, "w") as jsonl_file:
+        jsonl_file.write(json.dumps(DummyClass.from_details(field1=1).to_json_map()) + "\n\n{\"jsonClass\": \n")
+    objects_read = JsonObject.iter_from_jsonl(path=jsonl_path)
+    assert next(objects_read).field1 == 1
+    with pytest.raises(ValueError, match="line 3"):
+        next(objects_read)
+
+
+def test_read_list_from_file(tmpdir):
+    json_path = str(tmpdir.join("objects.json"))
+    objects = [DummyClass.from_details(field1=i) for i in range(3)]
+    with open(json_path, "w") as json_file:
+        json.dump([obj.to_json_map() for obj in objects], json_file)
+    assert JsonObject.read_from_file(filename=json_path) == objects
@@ -88,6 +88,63 @@ def test_deletion_validation_affect_too_many_users(db_fixture):
   assert exception_info.value.message.startswith("This deletion affects more than 2 other users.")
 
 
+def test_deletion_validation_of_unfilled_subtree(db_fixture):
+  db = db_fixture
+  node = make_tree()
+  non_admin_user_raama = users.User.from_details(user_type="human", auth_infos=[users.AuthenticationInfo.from_details(auth_provider="vingo", auth_user_id="rAma")])
+  non_admin_user_siitaa = users.User.from_details(user_type="human", auth_infos=[users.AuthenticationInfo.from_details(auth_provider="vingo", auth_user_id="sItA")])
+  node.update_collection(db_interface=db)
+  leaf = node.children[0].children[0]
+  leaf.content.source = common.DataSource.from_details(source_type="user_supplied", id=non_admin_user_raama.get_first_user_id_or_none())
+  leaf.content.editable_by_others = False
+  leaf.content = leaf.content.update_collection(db_interface=db, user=non_admin_user_raama)
+
+  # rAma's annotation is only found when the tree is filled.
+  subtree = common.JsonObjectNode.from_details(content=common.JsonObject.from_id(id=node.children[0].content._id, db_interface=db))
+  with pytest.raises(jsonschema.ValidationError) as exception_info:
+    subtree.delete_in_collection(db_interface=db, user=non_admin_user_siitaa)
+  assert exception_info.value.message.startswith("vingo____sItA cannot take over vingo____rAma's annotation")
+  assert db.find_by_ids([node.children[0].content._id, leaf.content._id]) != [None, None]
+  subtree.delete_in_collection(db_interface=db, user=non_admin_user_raama)
+  assert db.find_by_ids([node.children[0].content._id, leaf.content._id]) == [None, None]
+
+
+def test_deletion_validation_affect_too_many_users_across_children(db_fixture):
+  db = db_fixture
+  user_names = ["rAma", "sItA", "laxmaNa", "vibhiiShana"]
+  non_admin_users = [users.User.from_details(user_type="human", auth_infos=[users.AuthenticationInfo.from_details(auth_provider="vingo", auth_user_id=user_name)]) for user_name in user_names]
+  node = common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="halAyudhakoshaH"), children=[
+    common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="c%d" % index)) for index in range(3)])
+  node.update_collection(db_interface=db)
+  # No child's subtree affects more than 2 users - but the whole tree does.
+  for child, user in zip(node.children, non_admin_users[1:]):
+    child.content.source = common.DataSource.from_details(source_type="user_supplied", id=user.get_first_user_id_or_none())
+    child.content.editable_by_others = True
+    child.content = child.content.update_collection(db_interface=db, user=user)
+
+  root = common.JsonObjectNode.from_details(content=common.JsonObject.from_id(id=node.content._id, db_interface=db))
+  with pytest.raises(jsonschema.ValidationError) as exception_info:
+    root.delete_in_collection(db_interface=db, user=non_admin_users[0])
+  assert exception_info.value.message.startswith("This deletion affects more than 2 other users.")
+  assert db.find_by_id(node.children[0].content._id) is not None
+
+
+def test_deletion_of_deep_tree(db_fixture):
+  db = db_fixture
+  node = common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="level_120"))
+  for level in range(119, -1, -1):
+    node = common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="level_%d" % level), children=[node])
+  node.update_collection(db_interface=db)
+  leaf = node
+  while leaf.children:
+    leaf = leaf.children[0]
+  assert db.find_by_id(leaf.content._id) is not None
+
+  root = common.JsonObjectNode.from_details(content=common.JsonObject.from_id(id=node.content._id, db_interface=db))
+  root.delete_in_collection(db_interface=db)
+  assert db.find_by_ids([node.content._id, leaf.content._id]) == [None, None]
+
+
 def test_fill_descendents(db_fixture):
   node = make_tree()
   node.update_collection(db_interface=db_fixture)
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+import io
+import json
+import logging
+import os
+
+import pytest
+
+import tests.db
+from sanskrit_data import json_stream_helper
+from sanskrit_data.db import in_memory
+from sanskrit_data.schema import books, common
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+BOOK_JSON_PATH = os.path.join(os.path.dirname(tests.db.__file__), "textract-example-repo/books/5a3dfa6f751d5d9780b4c6ca/book.json")
+TEST_DOCS = [
+  {"a": [1, -2.5, 3e2, True, False, None, {}, []], u"कुञ्जी": u"रामः \"quoted\" \\ é 😀", "nested": {"x": [[{"y": "z"}]]}},
+  [],
+  "just a string",
+  12345,
+]
+
+
+def build(events):
+  builder = json_stream_helper._ValueBuilder()
+  for event, value in events:
+    builder.event(event, value)
+  return builder.value
+
+
+@pytest.mark.parametrize("doc", TEST_DOCS)
+def test_builtin_parser(doc):
+  doc_bytes = json.dumps(doc, ensure_ascii=False, indent=1).encode("utf-8")
+  for buffer_size in [1, 2, 3, 7, 65536]:
+    assert build(json_stream_helper._basic_parse(io.BytesIO(doc_bytes), buffer_size=buffer_size)) == doc
+
+
+def test_builtin_parser_matches_ijson():
+  pytest.importorskip("ijson")
+  for doc in TEST_DOCS:
+    doc_bytes = json.dumps(doc, ensure_ascii=False).encode("utf-8")
+    assert list(json_stream_helper._basic_parse(io.BytesIO(doc_bytes))) == list(json_stream_helper.basic_parse(io.BytesIO(doc_bytes)))
+
+
+def test_builtin_parser_rejects_bad_json():
+  for bad_json in [b'{"a": tru}', b'{"a": [1, 2}', b'{"a": "unterminated']:
+    with pytest.raises(ValueError):
+      list(json_stream_helper._basic_parse(io.BytesIO(bad_json), buffer_size=4))
+
+
+def make_node_map(content_id, children):
+  return {"jsonClass": "JsonObjectNode", "content": {"_id": content_id, "jsonClass": "BookPortion"}, "children": children}
+
+
+def test_iter_node_contents():
+  tree = make_node_map("root", [make_node_map("a", [make_node_map("a0", [])]), make_node_map("b", [])])
+  expected = [((), "root"), ((0,), "a"), ((0, 0), "a0"), ((1,), "b")]
+  for json_map, expected_order in [(json_stream_helper.content_first(tree), expected), (tree, [expected[2], expected[1], expected[3], expected[0]])]:
+    fhandle = io.BytesIO(json.dumps(json_map, sort_keys=json_map is tree).encode("utf-8"))
+    assert [(node_path, content["_id"]) for node_path, content in json_stream_helper.iter_node_contents(fhandle=fhandle, buffer_size=5)] == expected_order
+
+
+@pytest.mark.parametrize("content_first", [True, False])
+def test_import_book(tmpdir, monkeypatch, content_first):
+  with open(BOOK_JSON_PATH) as book_file:
+    book_map = json.load(book_file)
+  book_json_path = str(tmpdir.join("book.json"))
+  with open(book_json_path, "w") as book_file:
+    json.dump(json_stream_helper.content_first(book_map) if content_first else book_map, book_file, sort_keys=not content_first)
+
+  db = in_memory.BookPortionsInMemory(db_name_frontend="test")
+  num_docs_when_parsed = []
+  iter_node_contents = json_stream_helper.iter_node_contents
+
+  def recording_iter_node_contents(fhandle):
+    for item in iter_node_contents(fhandle=fhandle):
+      num_docs_when_parsed.append(len(db.db))
+      yield item
+  monkeypatch.setattr(json_stream_helper, "iter_node_contents", recording_iter_node_contents)
+  num_nodes = db.import_book(book_json_path=book_json_path, batch_size=2)
+
+  assert num_nodes == len(db.db) == len(num_docs_when_parsed)
+  if content_first:
+    # Nodes were written while the file was being parsed.
+    assert 0 < num_docs_when_parsed[-1] < num_nodes
+  book = books.BookPortion.from_id(id=book_map["content"]["_id"], db_interface=db)
+  assert book.source.id == "book_importer"
+  book_node = common.JsonObjectNode.from_details(content=book)
+  book_node.fill_descendents(db_interface=db)
+  assert [child.content._id for child in book_node.children] == [child["content"]["_id"] for child in book_map["children"]]
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the compiled schema validators used by JsonObject.validate_schema.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+import jsonschema
+import pytest
+
+from sanskrit_data import json_schema_helper
+from sanskrit_data.schema import common, books, ullekhanam, users
+
+logging.basicConfig(
+  level=logging.DEBUG,
+  format="%(levelname)s: %(asctime)s {%(filename)s:%(lineno)d}: %(message)s "
+)
+
+
+def get_json_object_classes():
+  return [obj_class for name, obj_class in sorted(common.json_class_index.items()) if isinstance(obj_class, type) and issubclass(obj_class, common.JsonObject)]
+
+
+@pytest.mark.parametrize("obj_class", get_json_object_classes(), ids=lambda obj_class: obj_class.__name__)
+def test_every_schema_compiles(obj_class):
+  json_schema_helper.compile_schema(obj_class.schema)
+
+
+def make_instances():
+  book = books.BookPortion.from_details(title="halAyudhakoshaH", path="myrepo/halAyudha", curated_content=common.Text.from_text_string("halAyudhaH"), targets=[books.BookPositionTarget.from_details(container_id="abc", position=2)])
+  annotation = ullekhanam.ImageAnnotation.from_details(targets=[ullekhanam.ImageTarget.from_details(container_id="abc", rectangle=ullekhanam.Rectangle.from_details())], source=common.DataSource.from_details(source_type="system_inferred", id="pyCV2"))
+  node = common.JsonObjectNode.from_details(content=book, children=[common.JsonObjectNode.from_details(content=book)])
+  return [book, annotation, node]
+
+
+def make_invalid_variants(json_map):
+  # A few ways of breaking an instance - some of them nested.
+  yield dict(json_map, jsonClass="SomethingElse")
+  yield {key: value for key, value in json_map.items() if key != "jsonClass"}
+  yield dict(json_map, targets=[{"jsonClass": "Target"}])
+  yield dict(json_map, targets=[])
+  yield dict(json_map, editable_by_others="yes")
+  # Both type and enum are given for base_data.
+  yield dict(json_map, base_data="video")
+  yield dict(json_map, content={"jsonClass": "BookPortion", "base_data": "video"})
+  yield dict(json_map, content={"jsonClass": "BookPortion", "portion_class": 1})
+  yield dict(json_map, children=[{"jsonClass": "JsonObjectNode", "children": [{"no_class": 1}]}])
+
+
+def test_compiled_validators_agree_with_jsonschema():
+  for instance in make_instances():
+    json_map = instance.to_json_map()
+    validator = instance.get_schema_validator()
+    assert validator.is_valid(json_map)
+    for variant in make_invalid_variants(json_map):
+      expected_error = jsonschema.exceptions.best_match(jsonschema.validators.validator_for(instance.schema)(instance.schema).iter_errors(variant))
+      assert validator.is_valid(variant) == (expected_error is None), variant
+      if expected_error is None:
+        validator.validate(variant)
+      else:
+        with pytest.raises(jsonschema.ValidationError) as exception_info:
+          validator.validate(variant)
+        assert exception_info.value.message == expected_error.message
+        assert list(exception_info.value.path) == list(expected_error.path)
+
+
+def test_enum_distinguishes_booleans():
+  validator = json_schema_helper.CompiledSchemaValidator({"enum": [1, "a"]})
+  assert validator.is_valid(1)
+  assert not validator.is_valid(True)
+  assert not validator.is_valid(1.5)
+
+
+def test_validator_cached_on_class():
+  assert books.BookPortion.get_schema_validator() is books.BookPortion.get_schema_validator()
+  assert books.BookPortion.get_schema_validator() is not common.JsonObject.get_schema_validator()
+
+
+def make_node_chain(depth):
+  node = common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="leaf", curated_content=common.Text.from_text_string("leaf")))
+  for _ in range(depth - 1):
+    node = common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="x"), children=[node])
+  return node
+
+
+def test_validate_schema_visits_each_node_once():
+  depth = 30
+  node = make_node_chain(depth=depth)
+  common.schema_validation_stats.clear()
+  node.validate_schema()
+  # Each level has a JsonObjectNode, a BookPortion and its DataSource; and the leaf has a Text with a ScriptRendering.
+  assert common.schema_validation_stats["nodes"] == 3 * depth + 2
+  assert common.schema_validation_stats["passes"] == 1
+
+
+def test_validate_schema_reports_nested_errors():
+  node = make_node_chain(depth=5)
+  node.children[0].children[0].content.source.source_type = "unknown_source_type"
+  with pytest.raises(jsonschema.ValidationError):
+    node.validate_schema()
+
+
+def test_validate_schema_calls_nested_overrides():
+  auth_info = users.AuthenticationInfo.from_details(auth_user_id="vedavaapi_admin", auth_provider="vedavaapi")
+  auth_info.auth_secret_plain = "secret"
+  user = users.User.from_details(user_type="human", auth_infos=[auth_info])
+  user.validate_schema()
+  # AuthenticationInfo.validate_schema hashes the password.
+  assert getattr(auth_info, "auth_secret_plain", None) is None
+  assert auth_info.check_password("secret")
+  auth_info.auth_secret_hashed = ""
+  with pytest.raises(jsonschema.ValidationError):
+    user.validate_schema()
@@ -4,6 +4,7 @@ Tests for the ullekhanam_db interface and the associated schema classes.
 
 from __future__ import absolute_import
 
+import json
 import logging
 import os
 import pytest
@@ -12,6 +13,7 @@ import jsonschema
 import sanskrit_data
 import tests
 import tests.db
+from sanskrit_data.db import in_memory
 from sanskrit_data.schema import ullekhanam, common, books, users
 from sanskrit_data.schema.ullekhanam.sanskrit import SubantaAnnotation
 
@@ -36,6 +38,83 @@ def test_import_export(db_fixture):
   assert len(list(os.scandir(export_dir))) > 0
 
 
+def test_import_export_annotations(tmpdir):
+  books_dir = os.path.join(os.path.dirname(tests.db.__file__), "textract-example-repo/books")
+  db = in_memory.BookPortionsInMemory(db_name_frontend="ullekhanam", external_file_store=books_dir)
+  db.import_all(rootdir=books_dir)
+  page = books.BookPortion.from_id(id="5a3dfa6f751d5d9780b4c6cd", db_interface=db)
+  source = ullekhanam.DataSource.from_details("system_inferred", "xyz.py")
+  text_annotation = ullekhanam.TextAnnotation.from_details(targets=[common.Target.from_details(container_id=page._id)], source=source, content=common.Text.from_text_string(text_string=u"रामः")).update_collection(db)
+  pada_annotation = SubantaAnnotation.from_details(targets=[ullekhanam.TextTarget.from_details(container_id=text_annotation._id)], source=source, word=common.Text.from_text_string(text_string=u"रामः"), root=common.Text.from_text_string(text_string=u"राम"), linga=u"pum", vibhakti="1", vachana=1).update_collection(db)
+
+  export_dir = str(tmpdir.join("export"))
+  db.dump_books(export_dir=export_dir, dump_annotations=True)
+  annotations_path = os.path.join(export_dir, "5a3dfa6f751d5d9780b4c6ca", "annotations.jsonl")
+  assert [obj._id for obj in common.JsonObject.iter_from_jsonl(path=annotations_path)] == [text_annotation._id, pada_annotation._id]
+
+  imported_db = in_memory.BookPortionsInMemory(db_name_frontend="ullekhanam", external_file_store=books_dir)
+  assert imported_db.import_all(rootdir=export_dir).num_books == len(db.list_books())
+  assert imported_db.find_by_id(pada_annotation._id) == db.find_by_id(pada_annotation._id)
+  assert [obj._id for obj in page.get_targetting_entities(db_interface=imported_db, entity_type="TextAnnotation")] == [text_annotation._id]
+
+
+def make_import_dir(rootdir):
+  """Some copies of the example book (with distinct _id-s), a truncated book.json and one with a schema violation."""
+  from sanskrit_data import json_stream_helper
+  with open(os.path.join(os.path.dirname(tests.db.__file__), "textract-example-repo/books/5a3dfa6f751d5d9780b4c6ca/book.json")) as book_file:
+    book_json = book_file.read()
+  for book_index in range(4):
+    book_map = json.loads(book_json.replace('"5a3dfa6f751d5d9780b4c6', '"book_%d_' % book_index))
+    if book_index == 3:
+      book_map["children"][1]["content"]["base_data"] = "video"
+    os.makedirs(os.path.join(rootdir, "book_%d" % book_index))
+    json_stream_helper.dump_content_first(json_map=book_map, filename=os.path.join(rootdir, "book_%d" % book_index, "book.json"))
+  os.makedirs(os.path.join(rootdir, "truncated"))
+  with open(os.path.join(rootdir, "truncated", "book.json"), "w") as book_file:
+    book_file.write(book_json[:len(book_json) // 2])
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_import_stats(tmpdir, num_workers):
+  rootdir = str(tmpdir.join("books"))
+  make_import_dir(rootdir=rootdir)
+  db = in_memory.BookPortionsInMemory(db_name_frontend="ullekhanam")
+  stats = db.import_all(rootdir=rootdir, num_workers=num_workers, batch_size=2)
+  assert stats.num_books == 3
+  assert stats.num_nodes == 3 * 4
+  assert sorted(os.path.basename(os.path.dirname(path)) for path in stats.failures) == ["book_3", "truncated"]
+  assert "ValidationError" in stats.failures[os.path.join(rootdir, "book_3", "book.json")]
+  assert stats.parse_seconds > 0 and stats.write_seconds > 0 and stats.total_seconds > 0
+  for book_index in range(3):
+    book = books.BookPortion.from_id(id="book_%d_ca" % book_index, db_interface=db)
+    assert book.source.id == "book_importer"
+    pages = book.get_targetting_entities(db_interface=db)
+    assert sorted(page._id for page in pages) == ["book_%d_cd" % book_index, "book_%d_d0" % book_index, "book_%d_d3" % book_index]
+  if num_workers is not None:
+    # The schema violation was caught before anything of the book got written.
+    assert db.find_by_id("book_3_ca") is None
+
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_import_validates_against_db(tmpdir, monkeypatch, num_workers):
+  # Every node (as book.json files have _id-s, which may be those of existing documents) goes through prepare_for_update.
+  rootdir = str(tmpdir.join("books"))
+  make_import_dir(rootdir=rootdir)
+  checked_ids = []
+  detect_illegal_takeover = common.UllekhanamJsonObject.detect_illegal_takeover
+
+  def recording_detect_illegal_takeover(self, db_interface=None, user=None):
+    checked_ids.append(getattr(self, "_id", None))
+    return detect_illegal_takeover(self, db_interface=db_interface, user=user)
+
+  monkeypatch.setattr(common.UllekhanamJsonObject, "detect_illegal_takeover", recording_detect_illegal_takeover)
+  db = in_memory.BookPortionsInMemory(db_name_frontend="ullekhanam")
+  db.import_all(rootdir=rootdir, num_workers=num_workers, batch_size=2)
+  for book_index in range(3):
+    assert set("book_%d_%s" % (book_index, suffix) for suffix in ["ca", "cd", "d0", "d3"]) <= set(checked_ids)
+
+
 # We deliberately don't use find_one_and_update below - as a test.
 def test_BookPortion_db_roundrip(db_fixture):
   book_portion = books.BookPortion.from_details(
@@ -99,6 +178,9 @@ def test_full_sentence_storage(db_fixture):
     linga=u"pum", vibhakti="1", vachana=1)
   pada_annotation_rAmaH = pada_annotation_rAmaH.update_collection(db)
   logging.debug(pada_annotation_rAmaH.to_json_map())
+  # Subclasses of the entity_type are included.
+  assert [entity._id for entity in text_annotation.get_targetting_entities(db_interface=db, entity_type="Annotation")] == [pada_annotation_rAmaH._id]
+  assert text_annotation.get_targetting_entities(db_interface=db, entity_type="ImageAnnotation") == []
   #
   # pada_annotation_vigrahavAn = ullekhanam.SubantaAnnotation.from_details(targets=[
   #   ullekhanam.TextTarget.from_details(container_id=str(text_annotation._id))],
@@ -170,4 +252,46 @@ def test_JsonObjectNode_write(db_fixture):
   json_node = common.JsonObjectNode.from_details(content=book)
   json_node.fill_descendents(db_interface=db_fixture)
   logging.debug(str(json_node))
-  assert(json_node.children.__len__() == 2)
\ No newline at end of file
+  assert(json_node.children.__len__() == 2)
+
+def test_fill_descendents_queries_per_level(db_fixture, monkeypatch):
+  db = db_fixture
+  book = books.BookPortion.from_details(title="levels", path="myrepo/levels", portion_class="book").update_collection(db)
+  source = ullekhanam.DataSource.from_details("system_inferred", "xyz.py")
+  for page_index in range(3):
+    page = books.BookPortion.from_details(title="levels_pg%d" % page_index, targets=[books.BookPositionTarget.from_details(container_id=book._id, position=page_index)]).update_collection(db)
+    for _ in range(2):
+      ullekhanam.TextAnnotation.from_details(targets=[common.Target.from_details(container_id=page._id)], source=source, content=common.Text.from_text_string(text_string=u"रामः")).update_collection(db)
+
+  find_filters = []
+  original_find = db.find
+  monkeypatch.setattr(db, "find", lambda find_filter: find_filters.append(find_filter) or original_find(find_filter))
+  json_node = common.JsonObjectNode.from_details(content=book)
+  json_node.fill_descendents(db_interface=db)
+  # Levels: pages, annotations, and (an empty) level below them.
+  assert len(find_filters) == 3
+  assert [len(child.children) for child in json_node.children] == [2, 2, 2]
+
+  json_node.fill_descendents(db_interface=db, depth=1)
+  assert len(json_node.children) == 3 and all(child.children == [] for child in json_node.children)
+
+  json_node.fill_descendents(db_interface=db, entity_type="TextAnnotation")
+  assert json_node.children == []
+
+
+def test_JsonObjectNode_write_per_level(db_fixture, monkeypatch):
+  db = db_fixture
+  book = books.BookPortion.from_details(title="bulk", path="myrepo/bulk", portion_class="book")
+  pages = [common.JsonObjectNode.from_details(content=books.BookPortion.from_details(title="bulk_pg%d" % i)) for i in range(3)]
+  json_node = common.JsonObjectNode.from_details(content=book, children=pages)
+
+  written_batches = []
+  original_update_docs = db.update_docs
+  monkeypatch.setattr(db, "update_docs", lambda docs: written_batches.append(len(docs)) or original_update_docs(docs))
+  json_node.update_collection(db_interface=db)
+  assert written_batches == [1, 3]
+  assert all(page.content.targets[0].container_id == json_node.content._id for page in pages)
+
+  json_node = common.JsonObjectNode.from_details(content=json_node.content)
+  json_node.delete_in_collection(db_interface=db)
+  assert db.find_by_ids([json_node.content._id] + [page.content._id for page in pages]) == [None] * 4